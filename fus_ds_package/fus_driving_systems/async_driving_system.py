@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2024 Margely Cornelissen, Stein Fekkes (Radboud University) and Erik Dumont (Image
+Guided Therapy)
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+**Attribution Notice**:
+If you use this kit in your research or project, please include the following attribution:
+Margely Cornelissen, Stein Fekkes (Radboud University, Nijmegen, The Netherlands) & Erik Dumont
+(Image Guided Therapy, Pessac, France) (2024), Radboud FUS measurement kit (version 0.8),
+https://github.com/Donders-Institute/Radboud-FUS-measurement-kit
+"""
+
+# Basis packages
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+
+# Miscellaneous packages
+
+# Own packages
+
+# Access the logger
+from fus_driving_systems.config.logging_config import logger
+
+
+class AsyncDrivingSystem:
+    """
+    Class providing an asyncio interface to a ControlDrivingSystem. Blocking calls of the driving
+    system run on a dedicated single-thread executor, so that the calls to one device stay
+    sequential while the event loop keeps running. Completions of sequences are futures resolved
+    from the callbacks of the driving system (listener events for IGT, the sonication timer for
+    Sonic Concepts).
+
+    Attributes:
+        driving_system (ControlDrivingSystem): The wrapped driving system.
+    """
+
+    def __init__(self, driving_system, executor=None):
+        """
+        Initializes an AsyncDrivingSystem object.
+
+        Parameters:
+            driving_system (ControlDrivingSystem): The driving system to wrap.
+            executor (Executor): Executor for the blocking calls. None = a dedicated single-thread
+            executor, which is shut down by close().
+        """
+
+        self.driving_system = driving_system
+
+        self._own_executor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=1,
+                                          thread_name_prefix=type(driving_system).__name__)
+        self._executor = executor
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.disconnect()
+        self.close()
+
+    async def _run(self, func, *args, **kwargs):
+        """
+        Runs a blocking call of the driving system on the executor.
+        """
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def _completion(self):
+        """
+        Returns a future and a thread-safe callback that resolves it with its argument.
+        """
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve(result):
+            if not future.done():
+                future.set_result(result)
+
+        def callback(result):
+            try:
+                loop.call_soon_threadsafe(resolve, result)
+            except RuntimeError:
+                # The event loop is closed: nobody awaits the result anymore
+                pass
+
+        return future, callback
+
+    def is_connected(self):
+        """
+        Checks whether the driving system is currently connected.
+
+        Returns:
+            bool: True if connected, False otherwise.
+        """
+
+        return self.driving_system.is_connected()
+
+    async def connect(self, connect_info, **kwargs):
+        """
+        Connects to the driving system.
+
+        Parameters:
+            connect_info: Information required for establishing a connection, either a com port or
+            configuration file.
+        """
+
+        await self._run(self.driving_system.connect, connect_info, **kwargs)
+
+    async def send_sequence(self, sequence):
+        """
+        Sends an ultrasound sequence to the driving system.
+
+        Parameters:
+            sequence (Sequence): The sequence object containing ultrasound parameters.
+        """
+
+        await self._run(self.driving_system.send_sequence, sequence)
+
+    async def execute_sequence(self, sequence, timeout=None, **kwargs):
+        """
+        Executes the previously sent sequence and waits until it is finished.
+
+        Parameters:
+            sequence (Sequence): The sequence object containing ultrasound parameters.
+            timeout (float): Maximum time to wait for the end of the sequence [s]. None = no limit.
+
+        Returns:
+            The result of the sequence reported by the driving system, e.g. a WaitResult for IGT.
+        """
+
+        future, callback = self._completion()
+        await self._run(self.driving_system.start_sequence, sequence, callback=callback, **kwargs)
+
+        if timeout is None:
+            return await future
+
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            logger.warning('No sequence result received within %s s', timeout)
+            raise
+
+    async def wait_for_trigger(self, sequence, **kwargs):
+        """
+        Arms the driving system to execute the previously sent sequence on a trigger.
+
+        Parameters:
+            sequence (Sequence): The sequence object containing ultrasound parameters.
+
+        Returns:
+            asyncio.Future: Resolved with the result of the triggered sequence. Driving systems
+            that are armed when the sequence is sent (Sonic Concepts) do not report the end of the
+            triggered sequence; their future is resolved with None once armed.
+        """
+
+        future, callback = self._completion()
+
+        wait_for_trigger = getattr(self.driving_system, 'wait_for_trigger', None)
+        if wait_for_trigger is not None:
+            await self._run(wait_for_trigger, sequence, callback=callback, **kwargs)
+        else:
+            if not self.driving_system.is_sequence_sent():
+                await self._run(self.driving_system.send_sequence, sequence)
+            future.set_result(None)
+
+        return future
+
+    async def disconnect(self):
+        """
+        Disconnects from the driving system.
+        """
+
+        await self._run(self.driving_system.disconnect)
+
+    def close(self):
+        """
+        Shuts down the dedicated executor. Calls that are still running are finished first.
+        """
+
+        if self._own_executor:
+            self._executor.shutdown(wait=True)
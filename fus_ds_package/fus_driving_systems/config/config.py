@@ -32,6 +32,7 @@ https://github.com/Donders-Institute/Radboud-FUS-measurement-kit
 
 # Basic packages
 import os
+import tempfile
 
 # Miscellaneous packages
 import configparser
@@ -66,6 +67,19 @@ def sync_config(new_config):
     config_info = new_config
 
 
+def get_cache_path():
+    """
+    Returns the folder used to store precomputed phase and steer tables. An empty cache path in
+    the configuration = a folder in the temporary folder of the platform.
+    """
+
+    path = config_info['General'].get('Cache path', '')
+    if not path:
+        path = os.path.join(tempfile.gettempdir(), 'fus_driving_systems_cache')
+
+    return path
+
+
 # Automatically read the main configuration file when the module is imported
 inp_file = (impresources.files(config) / 'ds_config.ini')
 read_config(inp_file)
@@ -45,6 +45,13 @@ config['General']['Configuration file folder'] = CONFIG_FOLDER
 
 config['General']['Temporary logging path'] = 'C:\\Temp'
 
+# folder used to store precomputed phase and steer tables, empty = fus_driving_systems_cache in
+# the temporary folder of the platform
+config['General']['Cache path'] = ''
+
+# compiled steer tables and transducer geometries, see igt/equipment_index.py
+config['General']['Equipment index'] = 'igt\\config\\equipment_index.bin'
+
 MAX_ALLOWED_PRESSURE = 1.2  # MPa
 config['General']['Maximum pressure allowed in free water [MPa]'] = str(MAX_ALLOWED_PRESSURE)
 
@@ -122,6 +129,20 @@ config['Equipment.Manufacturer.IGT']['Config. file folder driving sys.'] = CONFI
 config['Equipment.Manufacturer.IGT']['Power options'] = '\n'.join([POW_AMPL, POW_PRESS, POW_VOLT])
 config['Equipment.Manufacturer.IGT']['Additional charac. discon. message'] = ''
 
+# Ramp shapes only supported by the IGT generator, on top of config['General']['Ramp shapes']
+RAMP_BLACK = 'Blackman'
+RAMP_GAUSS = 'Gaussian'
+
+config['Equipment.Manufacturer.IGT']['Additional ramp shapes'] = '\n'.join([RAMP_BLACK, RAMP_GAUSS])
+config['Equipment.Manufacturer.IGT']['Ramp shape.black'] = RAMP_BLACK
+config['Equipment.Manufacturer.IGT']['Ramp shape.gauss'] = RAMP_GAUSS
+config['Equipment.Manufacturer.IGT']['Sequence buffer slots'] = str(16)
+config['Equipment.Manufacturer.IGT']['Measurement logging'] = 'summary'
+config['Equipment.Manufacturer.IGT']['Channel health monitor'] = str(True)
+
+# unifus = vendor module (Windows only), simulator = pure-Python simulator without hardware
+config['Equipment.Manufacturer.IGT']['Unifus backend'] = 'unifus'
+
 IGT_DS = ['IGT-128-ch', 'IGT-128-ch_comb_2x10-ch', 'IGT-128-ch_comb_1x10-ch',
           'IGT-128-ch_comb_1x8-ch', 'IGT-128-ch_comb_1x4-ch', 'IGT-128-ch_comb_1x2-ch',
           'IGT-32-ch', 'IGT-32-ch_comb_2x10-ch', 'IGT-32-ch_comb_1x10-ch',
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2024 Margely Cornelissen, Stein Fekkes (Radboud University) and Erik Dumont (Image
+Guided Therapy)
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+**Attribution Notice**:
+If you use this kit in your research or project, please include the following attribution:
+Margely Cornelissen, Stein Fekkes (Radboud University, Nijmegen, The Netherlands) & Erik Dumont
+(Image Guided Therapy, Pessac, France) (2024), Radboud FUS measurement kit (version 0.8),
+https://github.com/Donders-Institute/Radboud-FUS-measurement-kit
+"""
+
+# Basis packages
+import collections
+import threading
+import time
+
+# Miscellaneous packages
+
+# Own packages
+from fus_driving_systems import control_driving_system as ds
+
+# Access the logger
+from fus_driving_systems.config.logging_config import logger
+
+# Default time between health checks [s]
+HEALTH_CHECK_INTERVAL = 1.0
+
+# Default reconnection budget and backoff [s]
+MAX_RETRIES = 5
+BACKOFF_INITIAL = 0.5
+BACKOFF_FACTOR = 2.0
+BACKOFF_MAX = 8.0
+
+
+class DrivingSystemError(Exception):
+    """
+    Raised when an operation of the driving system failed while the connection is alive.
+    """
+
+
+class ConnectionLostError(DrivingSystemError):
+    """
+    Raised when the connection was lost during an operation that is not repeated automatically,
+    e.g. the execution of a sequence. The connection and the resident sequences are restored
+    when the exception is raised.
+    """
+
+
+class ReconnectError(DrivingSystemError):
+    """
+    Raised when no connection could be made within the retry budget.
+    """
+
+
+class ConnectionManager:
+    """
+    Class managing the connection with a ControlDrivingSystem. A health check thread
+    periodically checks the connection with the lightweight check_connection() of the driving
+    system. A lost connection is re-established with exponential backoff and the sequences that
+    were resident before the drop are uploaded again. Failures of the driving system, raised as
+    DrivingSystemExit or other exceptions, are raised as DrivingSystemError instead. Other exits
+    of the interpreter are not caught.
+
+    Uploads are repeated after a reconnection. Executions are not, as the sonication may have
+    been (partly) delivered; a ConnectionLostError is raised after the connection is restored.
+
+    Attributes:
+        driving_system (ControlDrivingSystem): The managed driving system.
+        connect_info: Information required for establishing a connection, either a com port or
+        configuration file.
+        connect_kwargs (dict): Additional keyword arguments of connect().
+        reconnects (int): Number of re-established connections.
+        last_recovery_ms (float): Duration of the last recovery, including the restored uploads.
+        error (ReconnectError): Error of a failed recovery by the health check, None if no error.
+    """
+
+    def __init__(self, driving_system, connect_info, connect_kwargs=None,
+                 health_check_interval=HEALTH_CHECK_INTERVAL, max_retries=MAX_RETRIES,
+                 backoff_initial=BACKOFF_INITIAL, backoff_factor=BACKOFF_FACTOR,
+                 backoff_max=BACKOFF_MAX):
+        """
+        Initializes a ConnectionManager object.
+
+        Parameters:
+            driving_system (ControlDrivingSystem): The driving system to manage.
+            connect_info: Information required for establishing a connection, either a com port or
+            configuration file.
+            connect_kwargs (dict): Additional keyword arguments of connect().
+            health_check_interval (float): Time between health checks [s], None = no health
+            check thread.
+            max_retries (int): Maximum number of connection attempts per recovery.
+            backoff_initial (float): Delay before the second attempt [s].
+            backoff_factor (float): Factor of the delay between consecutive attempts.
+            backoff_max (float): Maximum delay between attempts [s].
+        """
+
+        self.driving_system = driving_system
+        self.connect_info = connect_info
+        self.connect_kwargs = connect_kwargs if connect_kwargs is not None else {}
+
+        self.health_check_interval = health_check_interval
+        self.max_retries = max(1, max_retries)
+        self.backoff_initial = backoff_initial
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+
+        self.reconnects = 0
+        self.last_recovery_ms = None
+        self.error = None
+
+        # Sent sequences by sequence number, in the order in which they were sent
+        self._sent = collections.OrderedDict()
+
+        # Serializes the calls to the driving system
+        self._lock = threading.RLock()
+        self._closed = threading.Event()
+        self._health_thread = None
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.disconnect()
+
+    def _call(self, func, *args, **kwargs):
+        """
+        Calls a method of the driving system and translates a failure of the driving system into
+        a DrivingSystemError.
+        """
+
+        try:
+            return func(*args, **kwargs)
+        except (ds.DrivingSystemExit, Exception) as e:
+            raise DrivingSystemError(f'{func.__name__} failed: {str(e) or type(e).__name__}') from e
+
+    def _backoff(self, attempt):
+        """
+        Returns the delay before the next connection attempt [s].
+        """
+
+        return min(self.backoff_max, self.backoff_initial * self.backoff_factor ** attempt)
+
+    def _connect_with_backoff(self):
+        """
+        Connects to the driving system, retrying with exponential backoff within the budget.
+        """
+
+        last_error = None
+        for attempt in range(self.max_retries):
+            if attempt > 0:
+                delay = self._backoff(attempt - 1)
+                logger.warning('Connection attempt %d of %d failed, retrying in %.1f s: %s',
+                               attempt, self.max_retries, delay, last_error)
+                if self._closed.wait(delay):
+                    break
+
+            try:
+                self._call(self.driving_system.connect, self.connect_info, **self.connect_kwargs)
+                if self.driving_system.check_connection():
+                    return
+                last_error = 'not connected'
+            except DrivingSystemError as e:
+                last_error = e
+
+        raise ReconnectError(f'No connection with the driving system after {self.max_retries} '
+                             + f'attempts: {last_error}')
+
+    def _recover(self):
+        """
+        Re-establishes a lost connection and uploads the sequences that were resident before
+        the drop.
+        """
+
+        start_time = time.monotonic()
+        sent = list(self._sent.values())
+        resident = self.driving_system.resident_sequences(sent)
+
+        logger.warning('Connection with the driving system lost, reconnecting...')
+
+        # Release what is left of the old connection
+        try:
+            self.driving_system.disconnect()
+        except (ds.DrivingSystemExit, Exception) as e:
+            logger.info('Disconnecting the lost connection failed: %s', e)
+
+        self._connect_with_backoff()
+
+        for sequence in resident:
+            self._call(self.driving_system.send_sequence, sequence)
+
+        self.reconnects += 1
+        self.last_recovery_ms = (time.monotonic() - start_time) * 1000
+        logger.info('Connection restored in %.0f ms, %d sequence(s) uploaded again',
+                    self.last_recovery_ms, len(resident))
+
+    def _ensure_connected(self):
+        """
+        Recovers the connection when it is lost. Raises the error of a failed recovery by the
+        health check.
+        """
+
+        if self.error is not None:
+            raise self.error
+
+        if not self.driving_system.check_connection():
+            self._recover()
+
+    def _health_check(self):
+        """
+        Checks the connection periodically and recovers it when it is lost. Checks are skipped
+        while an operation is running.
+        """
+
+        while not self._closed.wait(self.health_check_interval):
+            if not self._lock.acquire(blocking=False):
+                continue
+
+            try:
+                if self.error is None and not self.driving_system.check_connection():
+                    self._recover()
+            except DrivingSystemError as e:
+                logger.error('Recovery of the connection failed: %s', e)
+                self.error = e if isinstance(e, ReconnectError) else ReconnectError(str(e))
+            finally:
+                self._lock.release()
+
+    def connect(self):
+        """
+        Connects to the driving system and starts the health check.
+        """
+
+        with self._lock:
+            self.error = None
+            self._closed.clear()
+            self._connect_with_backoff()
+
+        if self.health_check_interval is not None and self._health_thread is None:
+            self._health_thread = threading.Thread(target=self._health_check,
+                                                   name='ConnectionHealthCheck', daemon=True)
+            self._health_thread.start()
+
+    def send_sequence(self, sequence):
+        """
+        Sends an ultrasound sequence to the driving system. The upload is repeated once when the
+        connection was lost during the upload.
+
+        Parameters:
+            sequence (Sequence): The sequence object containing ultrasound parameters.
+        """
+
+        with self._lock:
+            self._ensure_connected()
+            try:
+                self._call(self.driving_system.send_sequence, sequence)
+            except DrivingSystemError:
+                if self.driving_system.check_connection():
+                    raise
+                self._recover()
+                self._call(self.driving_system.send_sequence, sequence)
+
+            self._sent.pop(sequence.seq_num, None)
+            self._sent[sequence.seq_num] = sequence
+
+    def _execute(self, func, sequence, **kwargs):
+        """
+        Calls an execution method of the driving system. A lost connection is restored, but the
+        execution is not repeated.
+        """
+
+        with self._lock:
+            self._ensure_connected()
+            try:
+                return self._call(func, sequence, **kwargs)
+            except DrivingSystemError as e:
+                if self.driving_system.check_connection():
+                    raise
+                self._recover()
+                raise ConnectionLostError('Connection lost during the execution of sequence '
+                                          + f'{sequence.seq_num}, it is not repeated') from e
+
+    def execute_sequence(self, sequence, **kwargs):
+        """
+        Executes the previously sent sequence.
+
+        Parameters:
+            sequence (Sequence): The sequence object containing ultrasound parameters.
+        """
+
+        return self._execute(self.driving_system.execute_sequence, sequence, **kwargs)
+
+    def start_sequence(self, sequence, **kwargs):
+        """
+        Starts the previously sent sequence without waiting until it is finished.
+
+        Parameters:
+            sequence (Sequence): The sequence object containing ultrasound parameters.
+        """
+
+        return self._execute(self.driving_system.start_sequence, sequence, **kwargs)
+
+    def wait_for_trigger(self, sequence, **kwargs):
+        """
+        Arms the driving system to execute the previously sent sequence on a trigger.
+
+        Parameters:
+            sequence (Sequence): The sequence object containing ultrasound parameters.
+        """
+
+        wait_for_trigger = getattr(self.driving_system, 'wait_for_trigger', None)
+        if wait_for_trigger is None:
+            # Driving systems without wait_for_trigger() are armed when the sequence is sent
+            if sequence.seq_num not in self._sent:
+                self.send_sequence(sequence)
+            return None
+
+        return self._execute(wait_for_trigger, sequence, **kwargs)
+
+    def disconnect(self):
+        """
+        Stops the health check and disconnects from the driving system.
+        """
+
+        self._closed.set()
+        if self._health_thread is not None:
+            self._health_thread.join()
+            self._health_thread = None
+
+        with self._lock:
+            self._call(self.driving_system.disconnect)
@@ -38,6 +38,14 @@ from abc import ABC, abstractmethod
 # Own packages
 
 
+class DrivingSystemExit(SystemExit):
+    """
+    Raised by the driving systems when an operation failed and the program can not continue. When
+    it is not handled, the program stops as with sys.exit(). Callers that can recover from a failed
+    operation, like the ConnectionManager, catch this exception instead of SystemExit.
+    """
+
+
 class ControlDrivingSystem(ABC):
     """
     Abstract base class for an ultrasound driving system.
@@ -61,6 +69,9 @@ class ControlDrivingSystem(ABC):
         # generator object
         self.gen = None
 
+        # sequence and callback prepared by arm_sequence()
+        self.armed_sequence = None
+
     @abstractmethod
     def connect(self, connect_info):
         """
@@ -88,6 +99,55 @@ class ControlDrivingSystem(ABC):
         Abstract method for executing the previously sent sequence.
         """
 
+    def start_sequence(self, sequence, callback=None):
+        """
+        Starts the previously sent sequence. Driving systems that can not start a sequence without
+        waiting for it execute the sequence and call the callback afterwards.
+
+        Parameters:
+            sequence(Object): contains, amongst other things, of:
+                the ultrasound protocol (focus, pulse duration, pulse rep. interval and etcetera)
+                used equipment (driving system and transducer)
+            callback (function): Called once with the result when the sequence is finished.
+            None = no callback.
+        """
+
+        self.execute_sequence(sequence)
+
+        if callback is not None:
+            callback(True)
+
+    def arm_sequence(self, sequence, callback=None):
+        """
+        Prepares the previously sent sequence, so that start_armed_sequence() only has to start
+        it. Driving systems that can not prepare the start keep the sequence until it is started.
+
+        Parameters:
+            sequence(Object): contains, amongst other things, of:
+                the ultrasound protocol (focus, pulse duration, pulse rep. interval and etcetera)
+                used equipment (driving system and transducer)
+            callback (function): Called once with the result when the sequence is finished.
+            None = no callback.
+        """
+
+        self.armed_sequence = (sequence, callback)
+
+    def start_armed_sequence(self):
+        """
+        Starts the sequence prepared by arm_sequence().
+        """
+
+        sequence, callback = self.armed_sequence
+        self.start_sequence(sequence, callback=callback)
+
+    def disarm_sequence(self):
+        """
+        Releases the sequence prepared by arm_sequence() without starting it. Driving systems that
+        can be armed for a trigger or that may already have started the sequence stop it as well.
+        """
+
+        self.armed_sequence = None
+
     @abstractmethod
     def disconnect(self):
         """
@@ -104,6 +164,34 @@ class ControlDrivingSystem(ABC):
 
         return self.connected
 
+    def check_connection(self):
+        """
+        Lightweight check whether the connection with the ultrasound driving system is still
+        alive, without sending commands. Updates the connection state.
+
+        Returns:
+            bool: True if the connection is alive, False otherwise.
+        """
+
+        return self.connected
+
+    def resident_sequences(self, sequences):
+        """
+        Returns which of the sent sequences are still held by the ultrasound driving system.
+        Driving systems that hold one sequence only keep the last sent one.
+
+        Parameters:
+            sequences (list): Sent sequences in the order in which they were sent.
+
+        Returns:
+            list: The resident sequences in the order in which they were sent.
+        """
+
+        if self.is_sequence_sent() and len(sequences) > 0:
+            return [sequences[-1]]
+
+        return []
+
     def is_sequence_sent(self):
         """
         Checks whether a sequence has been sent to the ultrasound driving system.
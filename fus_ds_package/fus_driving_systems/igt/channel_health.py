@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2024 Margely Cornelissen, Stein Fekkes (Radboud University) and Erik Dumont (Image
+Guided Therapy)
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+**Attribution Notice**:
+If you use this kit in your research or project, please include the following attribution:
+Margely Cornelissen, Stein Fekkes (Radboud University, Nijmegen, The Netherlands) & Erik Dumont
+(Image Guided Therapy, Pessac, France) (2024), Radboud FUS measurement kit (version 0.8),
+https://github.com/Donders-Institute/Radboud-FUS-measurement-kit
+"""
+
+# Basis packages
+import collections
+import threading
+
+# Miscellaneous packages
+import numpy as np
+
+# Access the logger
+from fus_driving_systems.config.logging_config import logger
+
+# Monitored quantities: name and whether its limit is relative to the baseline or absolute
+FEATURES = (('impedance', True), ('phase', False), ('power', True))
+
+# Monitored quantities that are angles in degrees, their differences are wrapped to [-180, 180)
+CIRCULAR = np.array([False, True, False])
+
+# Default limits of the drift per monitored quantity: fraction of the baseline for impedance and
+# power, degrees for the phase
+DEFAULT_LIMITS = (0.2, 10.0, 0.3)
+
+# Weight of a new pulse in the rolling statistics
+DEFAULT_ALPHA = 0.05
+
+# Number of pulses averaged into the baseline of each channel
+DEFAULT_BASELINE_PULSES = 20
+
+ChannelDrift = collections.namedtuple('ChannelDrift', ['channel', 'feature', 'baseline', 'mean',
+                                                       'std'])
+
+
+def channel_features(channels):
+    """
+    Derives the monitored quantities from the channel measurements of a pulse. With voltage and
+    current measures (5 measures) the impedance is |V/I| and the phase is the V/I phase. With
+    forward and reverse voltages (4 measures) the reflection Vrev/Vfwd is used as impedance and the
+    V/Vref phase as phase. The V/Vref phase follows the focus of the sequence, so the monitor is
+    re-baselined per sequence.
+
+    Parameters:
+        channels (np.ndarray): (channels x channel measures + power) measurements.
+
+    Returns:
+        np.ndarray: (channels x features) float64 values, None if the layout is not supported.
+    """
+
+    n_measures = channels.shape[1] - 1
+    if n_measures == 5:
+        ratio, phase = (channels[:, 0], channels[:, 1]), channels[:, 2]
+    elif n_measures == 4:
+        ratio, phase = (channels[:, 1], channels[:, 0]), channels[:, 2]
+    else:
+        return None
+
+    features = np.empty((channels.shape[0], len(FEATURES)))
+    numerator, denominator = ratio
+
+    # A channel without current or forward voltage gets an infinite impedance
+    with np.errstate(divide='ignore', invalid='ignore'):
+        features[:, 0] = np.abs(numerator / denominator.astype(float))
+    features[:, 1] = phase
+    features[:, 2] = channels[:, -1]
+
+    return features
+
+
+class ChannelHealthMonitor:
+    """
+    Class representing a streaming monitor of the channel measurements. A baseline per channel is
+    averaged over the first pulses, after which an exponentially weighted mean and variance are
+    updated per pulse. A channel is flagged when its mean drifts from its own baseline beyond
+    the limit and also differs from the median drift of all channels beyond the limit, so that a
+    change of the applied amplitude does not flag every channel. Phase differences are wrapped to
+    [-180, 180) degrees. The statistics are updated from the listener thread and reset from the
+    thread that activates a sequence, so both are serialized by a lock.
+
+    Attributes:
+        alpha (float): Weight of a new pulse in the rolling statistics.
+        baseline_pulses (int): Number of pulses averaged into the baseline.
+        limits (np.ndarray): Drift limit per monitored quantity.
+        callback (function): Called with a list of ChannelDrift for newly flagged channels.
+        n_pulses (int): Number of processed pulses.
+        baseline (np.ndarray): (channels x features) baseline values.
+        mean (np.ndarray): (channels x features) rolling mean.
+        var (np.ndarray): (channels x features) rolling variance.
+        flags (np.ndarray): (channels x features) True when drifted.
+    """
+
+    def __init__(self, alpha=DEFAULT_ALPHA, baseline_pulses=DEFAULT_BASELINE_PULSES,
+                 limits=DEFAULT_LIMITS, callback=None):
+        """
+        Initializes a ChannelHealthMonitor object.
+
+        Parameters:
+            alpha (float): Weight of a new pulse in the rolling statistics.
+            baseline_pulses (int): Number of pulses averaged into the baseline.
+            limits (tuple): Drift limit per monitored quantity, see DEFAULT_LIMITS.
+            callback (function): Called with a list of ChannelDrift for newly flagged channels,
+            from the listener thread. None = log a warning.
+        """
+
+        self.alpha = alpha
+        self.baseline_pulses = max(1, baseline_pulses)
+        self.limits = np.asarray(limits, dtype=float)
+        self.relative = np.array([relative for _, relative in FEATURES])
+        self.callback = callback if callback is not None else log_drift
+
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Discards the baselines and statistics, e.g. after sending another sequence.
+        """
+
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        """
+        Discards the baselines and statistics, the lock has to be held.
+        """
+
+        self.n_pulses = 0
+        self.baseline = None
+        self.mean = None
+        self.var = None
+        self.flags = None
+
+    def update(self, channels):
+        """
+        Updates the statistics with the channel measurements of a pulse.
+
+        Parameters:
+            channels (np.ndarray): (channels x channel measures + power) measurements.
+
+        Returns:
+            np.ndarray: (channels x features) drift flags, None if the layout is not supported.
+        """
+
+        features = channel_features(channels)
+        if features is None:
+            return None
+
+        with self._lock:
+            drifts = self._update(features)
+            flags = self.flags
+
+        # The callback is called outside of the lock, so that it can query the monitor
+        if drifts:
+            self.callback(drifts)
+
+        return flags
+
+    def _update(self, features):
+        """
+        Updates the statistics with the features of a pulse, the lock has to be held.
+
+        Parameters:
+            features (np.ndarray): (channels x features) values of the pulse.
+
+        Returns:
+            list: ChannelDrift per newly flagged channel and quantity.
+        """
+
+        if self.mean is None or self.mean.shape != features.shape:
+            self._reset()
+            self.mean = features.copy()
+            self.var = np.zeros_like(features)
+            self.flags = np.zeros(features.shape, dtype=bool)
+            self.n_pulses = 1
+            return []
+
+        self.n_pulses += 1
+        delta = _wrap(features - self.mean)
+
+        # Cumulative average for the baseline, exponentially weighted afterwards
+        alpha = max(self.alpha, 1.0 / self.n_pulses) if self.baseline is None else self.alpha
+        self.mean = _wrap(self.mean + alpha * delta, absolute=True)
+        self.var = (1 - alpha) * (self.var + alpha * delta * delta)
+
+        if self.baseline is None:
+            if self.n_pulses >= self.baseline_pulses:
+                self.baseline = self.mean.copy()
+            return []
+
+        drift = _wrap(self.mean - self.baseline)
+        bound = np.where(self.relative, self.limits * np.abs(self.baseline), self.limits)
+        common = np.median(drift, axis=0)
+        flags = (np.abs(drift) > bound) & (np.abs(_wrap(drift - common)) > bound)
+
+        new = flags & ~self.flags
+        self.flags = flags
+        if not new.any():
+            return []
+
+        std = np.sqrt(self.var)
+        return [ChannelDrift(int(c), FEATURES[f][0], float(self.baseline[c, f]),
+                             float(self.mean[c, f]), float(std[c, f]))
+                for c, f in zip(*np.nonzero(new))]
+
+    def flagged_channels(self):
+        """
+        Returns the channels that currently drifted on any monitored quantity.
+
+        Returns:
+            list: Indices of the drifted channels.
+        """
+
+        flags = self.flags
+        if flags is None:
+            return []
+
+        return np.nonzero(flags.any(axis=1))[0].tolist()
+
+
+def _wrap(values, absolute=False):
+    """
+    Wraps the circular columns of a (channels x features) array.
+
+    Parameters:
+        values (np.ndarray): (channels x features) differences or values.
+        absolute (bool): True = wrap to [0, 360) instead of [-180, 180) degrees.
+
+    Returns:
+        np.ndarray: The wrapped array.
+    """
+
+    offset = 0.0 if absolute else 180.0
+    values[:, CIRCULAR] = (values[:, CIRCULAR] + offset) % 360.0 - offset
+    return values
+
+
+def log_drift(drifts):
+    """
+    Default callback of the monitor, logs the drifted channels.
+
+    Parameters:
+        drifts (list): ChannelDrift per newly drifted channel and quantity.
+    """
+
+    for drift in drifts:
+        logger.warning('Channel %d: %s drifted from %#.4g to %#.4g (std %#.3g)', drift.channel,
+                       drift.feature, drift.baseline, drift.mean, drift.std)
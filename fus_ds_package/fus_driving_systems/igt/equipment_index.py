@@ -0,0 +1,453 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2024 Margely Cornelissen, Stein Fekkes (Radboud University) and Erik Dumont (Image
+Guided Therapy)
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+**Attribution Notice**:
+If you use this kit in your research or project, please include the following attribution:
+Margely Cornelissen, Stein Fekkes (Radboud University, Nijmegen, The Netherlands) & Erik Dumont
+(Image Guided Therapy, Pessac, France) (2024), Radboud FUS measurement kit (version 0.8),
+https://github.com/Donders-Institute/Radboud-FUS-measurement-kit
+"""
+
+# Basis packages
+import hashlib
+import json
+import os
+import struct
+import time
+from types import SimpleNamespace
+
+# Miscellaneous packages
+import numpy as np
+import pkg_resources
+
+# Own packages
+from fus_driving_systems import control_driving_system as ds
+from fus_driving_systems.config.config import config_info as config
+from fus_driving_systems.igt import steer_table
+from fus_driving_systems.igt import transducerXYZ
+
+# Access the logger
+from fus_driving_systems.config.logging_config import logger
+
+# Layout of the index file: magic, format version and length of the JSON header, followed by the
+# JSON header and the array blocks. Every block starts at a multiple of ALIGNMENT bytes.
+MAGIC = b'FUSDSIDX'
+VERSION = 1
+PREAMBLE = struct.Struct('<8sII')
+ALIGNMENT = 64
+
+# Index loaded in this process, indexed by normalized path: (mtime, size, EquipmentIndex)
+_indexes = {}
+
+
+def _source_key(steer_info):
+    """
+    Returns the key of a steer information path in the index: a package relative path with
+    forward slashes, so that the index is independent of the operating system.
+    """
+
+    return steer_info.replace('\\', '/')
+
+
+def _padding(offset):
+    """
+    Returns the number of bytes needed to align the offset.
+    """
+
+    return -offset % ALIGNMENT
+
+
+class EquipmentIndex:
+    """
+    Class representing a compiled equipment index: the steer tables of the Sonic Concepts
+    transducers and the geometries of the Imasonic transducers in one memory-mapped file.
+
+    Attributes:
+        path (str): Path of the index file.
+        header (dict): JSON header of the index file.
+        serials (dict): Transducer serial mapped to the key of its steer information.
+    """
+
+    def __init__(self, path):
+        """
+        Initializes an EquipmentIndex object by memory-mapping the index file.
+
+        Parameters:
+            path (str): Path of the index file.
+        """
+
+        self.path = path
+        self._buffer = np.memmap(path, dtype=np.uint8, mode='r')
+
+        magic, version, header_size = PREAMBLE.unpack(bytes(self._buffer[:PREAMBLE.size]))
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not an equipment index file')
+        if version != VERSION:
+            raise ValueError(f'Equipment index {path} has version {version}, expected {VERSION}')
+
+        self.header = json.loads(bytes(self._buffer[PREAMBLE.size:PREAMBLE.size + header_size]))
+        self.serials = self.header['serials']
+
+        self._steer_tables = {}
+        self._definitions = {}
+
+    def _array(self, block):
+        """
+        Returns a read-only view on an array block of the index.
+        """
+
+        dtype = np.dtype(block['dtype'])
+        n_bytes = dtype.itemsize * int(np.prod(block['shape']))
+        data = self._buffer[block['offset']:block['offset'] + n_bytes]
+
+        return data.view(dtype).reshape(block['shape'])
+
+    def _entry(self, key):
+        """
+        Returns the entry of a serial or steer information path, or None if it is not indexed.
+        """
+
+        key = self.serials.get(key, _source_key(key))
+        return self.header['entries'].get(key)
+
+    def is_current(self, key, source_path):
+        """
+        Checks whether the indexed entry still corresponds with its source file. When the size and
+        modification time are unchanged, the source file is not read. When only the modification
+        time differs, e.g. after copying the package, the content hash decides.
+
+        Parameters:
+            key (str): Serial or steer information path.
+            source_path (str): Path of the source file.
+
+        Returns:
+            bool: True if the entry is indexed and the source file is unchanged.
+        """
+
+        entry = self._entry(key)
+        if entry is None:
+            return False
+
+        try:
+            stat = os.stat(source_path)
+        except OSError:
+            # The index can be used without the original source files
+            return True
+
+        if stat.st_size != entry['source_size']:
+            return False
+        if stat.st_mtime_ns == entry.get('source_mtime_ns'):
+            return True
+
+        return _hash_file(source_path)[0] == entry['source_hash']
+
+    def get_steer_table(self, key):
+        """
+        Returns the steer table of a Sonic Concepts transducer.
+
+        Parameters:
+            key (str): Serial or steer information path.
+
+        Returns:
+            SteerTable: The steer table, or None if it is not indexed.
+        """
+
+        entry = self._entry(key)
+        if entry is None or entry['kind'] != 'steer_table':
+            return None
+
+        table = self._steer_tables.get(entry['source'])
+        if table is None:
+            table = steer_table.SteerTable(self._array(entry['blocks']['distances']),
+                                           self._array(entry['blocks']['phases']),
+                                           entry['source_hash'])
+            self._steer_tables[entry['source']] = table
+
+        return table
+
+    def get_definition(self, key):
+        """
+        Returns the parsed definition of an Imasonic transducer.
+
+        Parameters:
+            key (str): Serial or steer information path.
+
+        Returns:
+            transducerXYZ.TransducerDefinition: The definition, or None if it is not indexed.
+        """
+
+        entry = self._entry(key)
+        if entry is None or entry['kind'] != 'definition':
+            return None
+
+        definition = self._definitions.get(entry['source'])
+        if definition is None:
+            # JSON stores the direction and ranges as lists
+            metadata = {name: tuple(value) if isinstance(value, list) else value
+                        for name, value in entry['metadata'].items()}
+            checksum = metadata.pop('checksum')
+            trans = SimpleNamespace(elements=np.array(self._array(entry['blocks']['elements'])),
+                                    **metadata)
+
+            definition = transducerXYZ.TransducerDefinition(entry['source'], None, checksum,
+                                                            entry['source_hash'], trans)
+            self._definitions[entry['source']] = definition
+
+        return definition
+
+
+def _hash_file(path):
+    """
+    Returns the SHA-1 and size of a file.
+    """
+
+    with open(path, 'rb') as f:
+        content = f.read()
+
+    return hashlib.sha1(content).hexdigest().upper(), len(content)
+
+
+def _collect_sources():
+    """
+    Returns the steer information of all transducers in the configuration, and of all steer
+    tables and transducer definitions shipped with the package.
+
+    Returns:
+        tuple: Source keys and a dictionary with serial mapped to source key.
+    """
+
+    sources = set()
+    serials = {}
+
+    for serial in config['Equipment']['Transducers'].split('\n'):
+        steer_info = config['Equipment.Transducer.' + serial]['Steer information']
+        if steer_info.endswith(('.xlsx', '.ini')):
+            serials[serial] = _source_key(steer_info)
+            sources.add(_source_key(steer_info))
+
+    for section in ('Equipment.Manufacturer.SC', 'Equipment.Manufacturer.IS'):
+        folder = _source_key(config[section]['Config. file folder transducers'])
+        folder_path = pkg_resources.resource_filename('fus_driving_systems', folder)
+        if os.path.isdir(folder_path):
+            for filename in os.listdir(folder_path):
+                if filename.endswith(('.xlsx', '.ini')):
+                    sources.add(folder + '/' + filename)
+
+    return sorted(sources), serials
+
+
+def compile_index(output_path=None):
+    """
+    Converts all steer tables and transducer definitions into one versioned equipment index file.
+
+    Parameters:
+        output_path (str): Path of the index file. None = equipment index path in the
+        configuration.
+
+    Returns:
+        str: Path of the written index file.
+    """
+
+    if output_path is None:
+        output_path = pkg_resources.resource_filename(
+            'fus_driving_systems', _source_key(config['General']['Equipment index']))
+
+    sources, serials = _collect_sources()
+
+    entries = {}
+    arrays = []
+    for source in sources:
+        source_path = pkg_resources.resource_filename('fus_driving_systems', source)
+        if not os.path.exists(source_path):
+            logger.warning('Steer information %s not found, not added to the index', source_path)
+            continue
+
+        source_hash, source_size = _hash_file(source_path)
+        entry = {'source': source, 'source_hash': source_hash, 'source_size': source_size,
+                 'source_mtime_ns': os.stat(source_path).st_mtime_ns}
+
+        if source.endswith('.xlsx'):
+            distances, phases = steer_table._convert(source_path)
+            entry['kind'] = 'steer_table'
+            blocks = {'distances': distances, 'phases': phases}
+        else:
+            definition = transducerXYZ.loadDefinition(source_path)
+            if definition is None:
+                logger.error('Transducer definition %s can not be loaded', source_path)
+                raise ds.DrivingSystemExit(f'Transducer definition {source_path} can not be ' +
+                                           'loaded.')
+
+            entry['kind'] = 'definition'
+            entry['metadata'] = {
+                'checksum': definition.checksum,
+                'name': definition.name,
+                'serial': definition.serial,
+                'focalLength': definition.focalLength,
+                'defaultFrequency': definition.defaultFrequency,
+                'maxAmplitude': definition.maxAmplitude,
+                'shootingDirection': definition.shootingDirection,
+                'xRange': definition.xRange,
+                'yRange': definition.yRange,
+                'zRange': definition.zRange
+                }
+            blocks = {'elements': np.ascontiguousarray(definition.elements, dtype=np.float64)}
+
+        entry['blocks'] = {}
+        for name, array in blocks.items():
+            entry['blocks'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape)}
+            arrays.append((entry['blocks'][name], np.ascontiguousarray(array)))
+
+        entries[source] = entry
+
+    # Offsets depend on the header size and the header contains the offsets, so reserve room
+    # for the offsets before the final layout is computed
+    for block, _ in arrays:
+        block['offset'] = 0
+    header = {'version': VERSION, 'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'serials': serials, 'entries': entries}
+    header_size = len(json.dumps(header).encode('utf-8')) + 16 * len(arrays)
+
+    offset = PREAMBLE.size + header_size
+    offset += _padding(offset)
+    for block, array in arrays:
+        block['offset'] = offset
+        offset += array.nbytes
+        offset += _padding(offset)
+
+    header_bytes = json.dumps(header).encode('utf-8').ljust(header_size)
+
+    # Write to a temporary file first so that other processes never read a partial index
+    tmp_path = output_path + f'.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(PREAMBLE.pack(MAGIC, VERSION, header_size))
+        f.write(header_bytes)
+        for block, array in arrays:
+            f.write(b'\0' * (block['offset'] - f.tell()))
+            f.write(array.tobytes())
+    os.replace(tmp_path, output_path)
+
+    _indexes.pop(os.path.normcase(os.path.abspath(output_path)), None)
+
+    logger.info('Equipment index with %d entries written to %s', len(entries), output_path)
+
+    return output_path
+
+
+def load_index(index_path=None):
+    """
+    Returns the memory-mapped equipment index. The index is only reopened when the modification
+    time or size of the index file changes.
+
+    Parameters:
+        index_path (str): Path of the index file. None = equipment index path in the configuration.
+
+    Returns:
+        EquipmentIndex: The equipment index, or None if no valid index file exists.
+    """
+
+    if index_path is None:
+        index_path = pkg_resources.resource_filename(
+            'fus_driving_systems', _source_key(config['General']['Equipment index']))
+
+    path = os.path.normcase(os.path.abspath(index_path))
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    cached = _indexes.get(path)
+    if cached is not None and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+        return cached[2]
+
+    try:
+        index = EquipmentIndex(path)
+    except (ValueError, KeyError) as e:
+        logger.warning('Equipment index %s is ignored: %s', path, e)
+        return None
+
+    _indexes[path] = (stat.st_mtime, stat.st_size, index)
+
+    return index
+
+
+def _is_current(index, steer_info, source_path):
+    """
+    Checks whether the steer information can be read from the index, and warns when its entry is
+    outdated.
+    """
+
+    if index is None:
+        return False
+
+    if index.is_current(steer_info, source_path):
+        return True
+
+    if index._entry(steer_info) is not None:
+        logger.warning('The equipment index entry of %s is outdated, the source file is read '
+                       + 'instead. Run fus-ds-compile-index to update the index.', steer_info)
+
+    return False
+
+
+def get_steer_table(steer_info):
+    """
+    Returns the steer table of a steer information path. The table is read from the equipment
+    index when available and up to date, otherwise it is converted from the Excel file.
+
+    Parameters:
+        steer_info (str): Package relative path of the Excel steer table.
+
+    Returns:
+        SteerTable: The steer table.
+    """
+
+    excel_path = pkg_resources.resource_filename('fus_driving_systems', _source_key(steer_info))
+
+    index = load_index()
+    if _is_current(index, steer_info, excel_path):
+        return index.get_steer_table(steer_info)
+
+    return steer_table.load_steer_table(excel_path)
+
+
+def get_definition(steer_info):
+    """
+    Returns the transducer definition of a steer information path. The definition is read from
+    the equipment index when available and up to date, otherwise it is parsed from the ini file.
+
+    Parameters:
+        steer_info (str): Package relative path of the transducer definition file.
+
+    Returns:
+        transducerXYZ.TransducerDefinition: The definition, or None if it can not be loaded.
+    """
+
+    ini_path = pkg_resources.resource_filename('fus_driving_systems', _source_key(steer_info))
+
+    index = load_index()
+    if _is_current(index, steer_info, ini_path):
+        return index.get_definition(steer_info)
+
+    return transducerXYZ.loadDefinition(ini_path)
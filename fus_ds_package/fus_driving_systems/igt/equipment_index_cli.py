@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2024 Margely Cornelissen, Stein Fekkes (Radboud University) and Erik Dumont (Image
+Guided Therapy)
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+**Attribution Notice**:
+If you use this kit in your research or project, please include the following attribution:
+Margely Cornelissen, Stein Fekkes (Radboud University, Nijmegen, The Netherlands) & Erik Dumont
+(Image Guided Therapy, Pessac, France) (2024), Radboud FUS measurement kit (version 0.8),
+https://github.com/Donders-Institute/Radboud-FUS-measurement-kit
+"""
+
+# Basis packages
+import argparse
+import logging
+
+# Miscellaneous packages
+
+# Own packages
+from fus_driving_systems.config import logging_config
+from fus_driving_systems.config.config import config_info as config
+
+
+def main():
+    """
+    Command line entry point to compile the equipment index. The modules of the driving systems
+    bind the logger when they are imported, so the console logger is set before importing them.
+    """
+
+    parser = argparse.ArgumentParser(description='Compile the steer tables and transducer ' +
+                                     'definitions into one equipment index file.')
+    parser.add_argument('-o', '--output', default=None,
+                        help='path of the index file (default: equipment index path in the ' +
+                        'configuration)')
+    args = parser.parse_args()
+
+    # Log to the console when the index is compiled from the command line
+    if logging_config.logger is None:
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+        logging_config.sync_logger(logging.getLogger(config['General']['Logger name']))
+
+    from fus_driving_systems.igt import equipment_index
+
+    print(equipment_index.compile_index(args.output))
+
+
+if __name__ == '__main__':
+    main()
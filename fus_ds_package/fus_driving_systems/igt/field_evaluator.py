@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2024 Margely Cornelissen, Stein Fekkes (Radboud University) and Erik Dumont (Image
+Guided Therapy)
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+**Attribution Notice**:
+If you use this kit in your research or project, please include the following attribution:
+Margely Cornelissen, Stein Fekkes (Radboud University, Nijmegen, The Netherlands) & Erik Dumont
+(Image Guided Therapy, Pessac, France) (2024), Radboud FUS measurement kit (version 0.8),
+https://github.com/Donders-Institute/Radboud-FUS-measurement-kit
+"""
+
+# Basis packages
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Miscellaneous packages
+import numpy as np
+
+# Own packages
+from fus_driving_systems.igt import transducerXYZ
+
+# Access the logger
+from fus_driving_systems.config.logging_config import logger
+
+# Number of grid points evaluated per chunk, bounds the memory to chunk x elements complex values
+CHUNK_SIZE = 16384
+
+LEVEL_3DB = 10**(-3/20)
+LEVEL_6DB = 10**(-6/20)
+
+# Number of point sources used per annular element
+RING_POINTS = 64
+
+
+class FieldResult:
+    """
+    Class representing the evaluated acoustic pressure amplitude on a grid.
+
+    Attributes:
+        axes (tuple(np.ndarray)): Grid coordinates along x, y and z [mm].
+        amplitude (np.ndarray): (nx, ny, nz) array of the pressure amplitude [a.u.].
+        peak_mm (tuple(float)): Location (x, y, z) of the peak amplitude [mm].
+        peak_amplitude (float): Peak amplitude [a.u.].
+        extent_3db (dict): Per evaluated axis ('x', 'y' or 'z'), the (start, end) [mm] of the -3 dB
+        focal region through the peak.
+        extent_6db (dict): Same as extent_3db for the -6 dB focal region.
+        psr_db (float): Peak-to-sidelobe ratio [dB], None if no sidelobe is within the grid.
+    """
+
+    def __init__(self, axes, amplitude):
+        """
+        Initializes a FieldResult object and analyzes the focal region.
+
+        Parameters:
+            axes (tuple(np.ndarray)): Grid coordinates along x, y and z [mm].
+            amplitude (np.ndarray): (nx, ny, nz) array of the pressure amplitude [a.u.].
+        """
+
+        self.axes = axes
+        self.amplitude = amplitude
+
+        peak_index = np.unravel_index(np.argmax(amplitude), amplitude.shape)
+        self.peak_amplitude = float(amplitude[peak_index])
+        self.peak_mm = tuple(float(axis[i]) for axis, i in zip(axes, peak_index))
+
+        self.extent_3db = {}
+        self.extent_6db = {}
+        main_lobe = []
+        for dim, name in enumerate('xyz'):
+            if len(axes[dim]) < 2:
+                main_lobe.append(slice(None))
+                continue
+
+            # Profile along this axis through the peak
+            index = list(peak_index)
+            index[dim] = slice(None)
+            profile = amplitude[tuple(index)] / self.peak_amplitude
+
+            self.extent_3db[name] = _level_extent(axes[dim], profile, peak_index[dim], LEVEL_3DB)
+            self.extent_6db[name] = _level_extent(axes[dim], profile, peak_index[dim], LEVEL_6DB)
+            main_lobe.append(_first_nulls(profile, peak_index[dim]))
+
+        # Sidelobes are all grid points outside the main lobe, delimited by the first nulls
+        outside = np.ones(amplitude.shape, dtype=bool)
+        outside[tuple(main_lobe)] = False
+        self.psr_db = None
+        if outside.any():
+            sidelobe = amplitude[outside].max()
+            if sidelobe > 0:
+                self.psr_db = 20*math.log10(self.peak_amplitude / sidelobe)
+
+    def __str__(self):
+        """
+        Returns a formatted string containing the analysis of the focal region.
+
+        Returns:
+            str: Formatted analysis of the focal region.
+        """
+
+        info = ''
+        info += f"Peak location (x, y, z) [mm]: {self.peak_mm} \n "
+        for name in self.extent_3db:
+            start, end = self.extent_3db[name]
+            info += f"-3 dB extent along {name} [mm]: {start:.2f} - {end:.2f} ({end-start:.2f}) \n "
+            start, end = self.extent_6db[name]
+            info += f"-6 dB extent along {name} [mm]: {start:.2f} - {end:.2f} ({end-start:.2f}) \n "
+        if self.psr_db is None:
+            info += "Peak-to-sidelobe ratio [dB]: no sidelobe within grid \n "
+        else:
+            info += f"Peak-to-sidelobe ratio [dB]: {self.psr_db:.2f} \n "
+
+        return info
+
+
+def _level_extent(axis, profile, peak, level):
+    """
+    Returns the (start, end) coordinates [mm] where the normalized profile drops below the level on
+    both sides of the peak, linearly interpolated between grid points. The grid boundary is returned
+    when the profile does not drop below the level within the grid.
+    """
+
+    below = np.nonzero(profile[:peak] < level)[0]
+    if len(below) == 0:
+        start = axis[0]
+    else:
+        i = below[-1]
+        start = np.interp(level, [profile[i], profile[i+1]], [axis[i], axis[i+1]])
+
+    below = np.nonzero(profile[peak+1:] < level)[0]
+    if len(below) == 0:
+        end = axis[-1]
+    else:
+        i = peak + below[0]
+        end = np.interp(level, [profile[i+1], profile[i]], [axis[i+1], axis[i]])
+
+    return (float(start), float(end))
+
+
+def _first_nulls(profile, peak):
+    """
+    Returns the slice between the first local minima on both sides of the peak. Equal neighbours
+    (for example a peak between two grid points) are part of the main lobe.
+    """
+
+    start = peak
+    while start > 0 and profile[start-1] <= profile[start]:
+        start -= 1
+
+    end = peak
+    while end < len(profile) - 1 and profile[end+1] <= profile[end]:
+        end += 1
+
+    return slice(start, end + 1)
+
+
+def _evaluate_chunk(points, elements, weights, wavenumber):
+    """
+    Sums the contributions of all elements, modelled as point sources, at the given points. The
+    computation is done in single precision, which is accurate to about 1e-5 of the peak.
+
+    Parameters:
+        points (np.ndarray): (M,3) float32 array of positions [m].
+        elements (np.ndarray): (N,3) float32 array of element positions [m].
+        weights (np.ndarray): (N,) complex64 array of element amplitudes and phases.
+        wavenumber (float): Wavenumber [rad/m].
+
+    Returns:
+        np.ndarray: (M,) array of the pressure amplitude [a.u.].
+    """
+
+    dist = np.square(points[:, 0:1] - elements[:, 0])
+    dist += np.square(points[:, 1:2] - elements[:, 1])
+    dist += np.square(points[:, 2:3] - elements[:, 2])
+    np.sqrt(dist, out=dist)
+
+    # exp(-i*k*r) / r, split in its real and imaginary part
+    phase = dist * np.float32(wavenumber)
+    np.reciprocal(dist, out=dist)
+    real = np.cos(phase)
+    real *= dist
+    imag = np.sin(phase, out=phase)
+    imag *= dist
+
+    return np.abs(real @ weights - 1j * (imag @ weights))
+
+
+def ring_sources(elements_m, phases_deg, amplitudes, ring_points=RING_POINTS):
+    """
+    Models annular elements, described by one position at their radius, as rings of point sources
+    around the Z axis.
+
+    Parameters:
+        elements_m (np.ndarray): (N,3) array of element positions [m].
+        phases_deg (list(float)): Phase per element [degrees].
+        amplitudes (float or list(float)): Amplitude per element or one for all elements [a.u.].
+        ring_points (int): Number of point sources per element.
+
+    Returns:
+        tuple: (N*ring_points,3) positions [m], phases [degrees] and amplitudes [a.u.] per source.
+    """
+
+    elements = np.asarray(elements_m, dtype=np.float64).reshape(-1, 3)
+    phases = np.asarray(phases_deg, dtype=np.float64)
+    amplitudes = np.broadcast_to(np.asarray(amplitudes, dtype=np.float64), phases.shape)
+
+    angles = np.linspace(0, 2*math.pi, ring_points, endpoint=False)
+    radius = np.hypot(elements[:, 0], elements[:, 1])[:, np.newaxis]
+    sources = np.stack([radius*np.cos(angles), radius*np.sin(angles),
+                        np.repeat(elements[:, 2:3], ring_points, axis=1)], axis=-1)
+
+    # Keep the total amplitude per element independent of the number of points
+    return (sources.reshape(-1, 3), np.repeat(phases, ring_points),
+            np.repeat(amplitudes / ring_points, ring_points))
+
+
+def evaluate_field(elements_m, phases_deg, amplitudes, oper_freq_hz, axes_mm,
+                   chunk_size=CHUNK_SIZE, n_workers=None):
+    """
+    Evaluates the acoustic pressure amplitude on a 1D, 2D or 3D grid with a Rayleigh point-source
+    model: p(r) = sum(A_n * exp(i*(phi_n - k*r_n)) / r_n). The grid is processed in chunks on a
+    thread pool so the memory usage stays bounded for large grids.
+
+    Parameters:
+        elements_m (np.ndarray): (N,3) array of element positions [m] in the transducer space.
+        phases_deg (list(float)): Phase per element [degrees].
+        amplitudes (float or list(float)): Amplitude per element or one for all elements [a.u.].
+        oper_freq_hz (float): Operating frequency [Hz].
+        axes_mm (tuple): Grid coordinates (x, y, z) [mm] in the transducer space; each is either
+        a single value or a 1D array.
+        chunk_size (int): Number of grid points per chunk.
+        n_workers (int): Number of threads. None = number of CPUs.
+
+    Returns:
+        FieldResult: The evaluated field and its focal region analysis.
+    """
+
+    elements = np.asarray(elements_m, dtype=np.float32).reshape(-1, 3)
+    phases = np.deg2rad(np.asarray(phases_deg, dtype=np.float64))
+    amplitudes = np.broadcast_to(np.asarray(amplitudes, dtype=np.float64), phases.shape)
+    weights = (amplitudes * np.exp(1j * phases)).astype(np.complex64)
+    wavenumber = 2*math.pi*oper_freq_hz / transducerXYZ.SOUND_SPEED_WATER
+
+    axes = tuple(np.atleast_1d(np.asarray(axis, dtype=np.float64)) for axis in axes_mm)
+    shape = tuple(len(axis) for axis in axes)
+    n_points = int(np.prod(shape))
+    axes_m = tuple(axis / 1000.0 for axis in axes)
+
+    amplitude = np.empty(n_points, dtype=np.float64)
+
+    def run(start):
+        stop = min(start + chunk_size, n_points)
+        index = np.unravel_index(np.arange(start, stop), shape)
+        points = np.stack([axis[i] for axis, i in zip(axes_m, index)], axis=-1).astype(np.float32)
+        amplitude[start:stop] = _evaluate_chunk(points, elements, weights, wavenumber)
+
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        # Consume the results so exceptions of the workers are raised here
+        list(executor.map(run, range(0, n_points, chunk_size)))
+
+    result = FieldResult(axes, amplitude.reshape(shape))
+    logger.info('Evaluated field on %d grid points: \n %s', n_points, result)
+
+    return result
+
+
+def evaluate_transducer_field(ini_path, phases_deg, amplitudes, oper_freq_hz, axes_mm,
+                              ring_points=None, **kwargs):
+    """
+    Evaluates the acoustic field of a transducer definition file, see evaluate_field().
+
+    Annular transducers are described by one position per ring in the XZ plane (y = 0). Modelling
+    such a ring as a single point source places the peak near the elements instead of at the
+    focus, so those elements are modelled as rings of point sources (see ring_sources()).
+
+    Parameters:
+        ini_path (str): Path to the transducer definition file.
+        phases_deg (list(float)): Phase per element [degrees], for example the phases written by
+        transducerXYZ.Transducer.computePhases() or taken from a steer table.
+        amplitudes (float or list(float)): Amplitude per element or one for all elements [a.u.].
+        oper_freq_hz (float): Operating frequency [Hz].
+        axes_mm (tuple): Grid coordinates (x, y, z) [mm] in the transducer space.
+        ring_points (int): Number of point sources per annular element. 0 = point sources,
+        None = RING_POINTS if all elements lie in the XZ plane, otherwise 0.
+
+    Returns:
+        FieldResult: The evaluated field and its focal region analysis.
+    """
+
+    definition = transducerXYZ.loadDefinition(ini_path)
+    if definition is None:
+        logger.error('Error: can not load the transducer definition from %s', ini_path)
+        return None
+
+    elements = definition.elements
+    if ring_points is None:
+        ring_points = RING_POINTS if np.all(elements[:, 1] == 0) else 0
+
+    if ring_points > 0:
+        elements, phases_deg, amplitudes = ring_sources(elements, phases_deg, amplitudes,
+                                                        ring_points)
+
+    return evaluate_field(elements, phases_deg, amplitudes, oper_freq_hz, axes_mm, **kwargs)
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2024 Margely Cornelissen, Stein Fekkes (Radboud University) and Erik Dumont (Image
+Guided Therapy)
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+**Attribution Notice**:
+If you use this kit in your research or project, please include the following attribution:
+Margely Cornelissen, Stein Fekkes (Radboud University, Nijmegen, The Netherlands) & Erik Dumont
+(Image Guided Therapy, Pessac, France) (2024), Radboud FUS measurement kit (version 0.8),
+https://github.com/Donders-Institute/Radboud-FUS-measurement-kit
+"""
+
+# Basis packages
+import threading
+
+# Own packages
+from fus_driving_systems.igt import ramp_envelope
+
+# Access the logger
+from fus_driving_systems.config.logging_config import logger
+
+
+class GeneratorShadow:
+    """
+    Class representing the configurable state of an IGT generator as last applied during the
+    current connection. Calls that would not change the state are skipped. The end of a sequence
+    is recorded from the listener thread, so the state transitions are made under a lock. The
+    generator calls themselves are made outside of the lock.
+
+    Attributes:
+        gen: Generator object.
+        channels_enabled (bool): True if all channels are enabled, None = unknown.
+        params (dict): Generator parameters mapped to their last applied value.
+        modulation (tuple): Active pulse modulation, None = unknown.
+        sequence_started (bool): True if a sequence has been started since the last stop.
+        starts (int): Number of started sequences, identifies the last started sequence.
+        sent (int): Number of calls sent to the generator.
+        skipped (int): Number of calls skipped because the state was unchanged.
+    """
+
+    def __init__(self, gen):
+        """
+        Initializes a GeneratorShadow object. The state of a new connection is unknown.
+
+        Parameters:
+            gen: Generator object.
+        """
+
+        self.gen = gen
+        self.sent = 0
+        self.skipped = 0
+        self.starts = 0
+
+        self._lock = threading.Lock()
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Forgets the recorded state, e.g. after (re)connecting to the generator. The counters are
+        kept.
+        """
+
+        with self._lock:
+            self.channels_enabled = None
+            self.params = {}
+            self.modulation = None
+
+            # A sequence started before the connection may still be running
+            self.sequence_started = True
+
+    def _count(self, is_sent):
+        """
+        Updates the counters of sent and skipped calls.
+        """
+
+        with self._lock:
+            if is_sent:
+                self.sent += 1
+            else:
+                self.skipped += 1
+
+        return is_sent
+
+    def enable_all_channels(self):
+        """
+        Enables all channels of the generator, unless they are already enabled.
+
+        Returns:
+            bool: True if the call was sent to the generator.
+        """
+
+        if not self._count(self.channels_enabled is not True):
+            return False
+
+        self.gen.enableAllChannels()
+        with self._lock:
+            self.channels_enabled = True
+
+        return True
+
+    def set_param(self, param, value):
+        """
+        Sets a parameter of the generator, unless it already has the value.
+
+        Parameters:
+            param (unifus.GenParam): The parameter.
+            value: The value of the parameter.
+
+        Returns:
+            bool: True if the call was sent to the generator.
+        """
+
+        if not self._count(param not in self.params or self.params[param] != value):
+            return False
+
+        self.gen.setParam(param, value)
+        with self._lock:
+            self.params[param] = value
+
+        return True
+
+    def set_pulse_modulation(self, modulation):
+        """
+        Pushes a pulse modulation to the generator, unless it is already active.
+
+        Parameters:
+            modulation (tuple): Pulse modulation as returned by ramp_envelope.ramp_modulation().
+
+        Returns:
+            bool: True if the call was sent to the generator.
+        """
+
+        if not self._count(modulation != self.modulation):
+            return False
+
+        ramp_up, ramp_up_res, ramp_down, ramp_down_res = modulation
+        self.gen.setPulseModulation(list(ramp_up), ramp_up_res, list(ramp_down), ramp_down_res)
+        with self._lock:
+            self.modulation = modulation
+
+        return True
+
+    def disable_pulse_modulation(self):
+        """
+        Disables any pulse modulation, unless no modulation is active.
+
+        Returns:
+            bool: True if the call was sent to the generator.
+        """
+
+        return self.set_pulse_modulation(ramp_envelope.NO_MODULATION)
+
+    def start_sequence(self):
+        """
+        Starts the prepared sequence. The start is recorded before the call, so that the result
+        of an earlier sequence that arrives during the call does not mark this one as stopped.
+
+        Returns:
+            int: Number of the started sequence, see mark_stopped().
+        """
+
+        with self._lock:
+            self.starts += 1
+            self.sent += 1
+            self.sequence_started = True
+            start = self.starts
+
+        self.gen.startSequence()
+
+        return start
+
+    def stop_sequence(self):
+        """
+        Stops the running sequence, unless no sequence has been started since the last stop.
+
+        Returns:
+            bool: True if the call was sent to the generator.
+        """
+
+        with self._lock:
+            if not self.sequence_started:
+                self.skipped += 1
+                return False
+
+            self.sent += 1
+            start = self.starts
+
+        self.gen.stopSequence()
+
+        # A sequence started meanwhile is still running
+        self.mark_stopped(start)
+
+        return True
+
+    def mark_stopped(self, start=None):
+        """
+        Records that a started sequence has finished or was aborted, so that no stop is needed.
+
+        Parameters:
+            start (int): Number of the finished sequence as returned by start_sequence(). The
+            state is only changed when it is the last started sequence. None = the last started
+            sequence.
+        """
+
+        with self._lock:
+            if start is None or start == self.starts:
+                self.sequence_started = False
+
+    def log_stats(self):
+        """
+        Logs the number of sent and skipped generator calls.
+        """
+
+        logger.info('Generator calls: %d sent, %d skipped', self.sent, self.skipped)
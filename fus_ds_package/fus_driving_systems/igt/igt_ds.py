@@ -33,6 +33,7 @@ https://github.com/Donders-Institute/Radboud-FUS-measurement-kit
 # Basis packages
 import os
 import sys
+import tempfile
 import time
 
 # Miscellaneous packages
@@ -41,20 +42,37 @@ import math
 
 import numpy as np
 
-import pandas as pd
 import pkg_resources
 
 # Own packages
 from fus_driving_systems import control_driving_system as ds
 
 from fus_driving_systems.igt.utils import ExecListener
+from fus_driving_systems.igt import channel_health
+from fus_driving_systems.igt import equipment_index
+from fus_driving_systems.igt import generator_shadow
+from fus_driving_systems.igt import phase_processing
+from fus_driving_systems.igt import phase_table
+from fus_driving_systems.igt import ramp_envelope
+from fus_driving_systems.igt import sequence_encoding
+from fus_driving_systems.igt import slot_manager
 from fus_driving_systems.igt import transducerXYZ
-from fus_driving_systems.igt import unifus
+from fus_driving_systems.igt.unifus_backend import unifus
 
 # Access the logger
 from fus_driving_systems.config.logging_config import logger
 from fus_driving_systems.config.config import config_info as config
 
+# Folder of the logs of the driving system and the fault handler
+DEFAULT_LOG_DIR = 'C:\\Temp' if sys.platform == 'win32' else tempfile.gettempdir()
+
+# Time added to the sequence duration before a wait for the sequence result times out [ms]
+SEQUENCE_TIMEOUT_MARGIN = 100
+
+# Maximum time to wait for the confirmation of a stopped sequence or a disconnection [s]
+STOP_TIMEOUT = 2.0
+DISCONNECT_TIMEOUT = 2.0
+
 
 class IGT(ds.ControlDrivingSystem):
     """
@@ -75,38 +93,97 @@ class IGT(ds.ControlDrivingSystem):
         """
         super().__init__()
 
-        with open("C:/Temp/faulthandler_output.log", "w") as f:
-            faulthandler.enable(file=f)
+        # The file stays open, so that a crash of the driving system can be written to it
+        self._faulthandler_file = open(os.path.join(DEFAULT_LOG_DIR, 'faulthandler_output.log'),
+                                       'w')
+        faulthandler.enable(file=self._faulthandler_file)
+
+        # Compiled sequences resident in the buffer slots of the generator
+        self.slots = slot_manager.SlotManager(
+            int(config['Equipment.Manufacturer.IGT']['Sequence buffer slots']))
 
-        self.sent_seq_nums = []
         self.fus = None
         self.listener = None
         self.n_channels = 0
         self.total_sequence_duration_ms = 0
 
         self.seq = None
+        self.pulse_phases = None
+
+        # Preloaded sequences indexed by sequence number, see preload_bundle()
+        self.bundle = {}
+
+        # Fingerprint and start number of the last prepared sequence, its slot is not reused
+        # while it is armed or running
+        self.active_content = None
+        self.active_start = None
+
+        # Generator state applied during the current connection
+        self.shadow = None
 
         self.n_pulse_train_rep = 0
         self.pulse_train_delay = 0
 
-    def is_sequence_sent(self, seq_num):
+        # Upload a pulse train of identical pulses as one pulse repeated by the generator
+        self.compact_upload = True
+        self.encoded_seq = None
+        self.upload_stats = {}
+
+        # Interpolate steer tables between tabulated focal depths, up to the given gap [mm]
+        self.steer_table_interpolation = True
+        self.steer_table_max_gap = 0.1
+
+        # Write the pulse results of each connection to a session folder next to the logs
+        self.record_pulse_results = True
+        self.pulse_session = None
+        self.shutdown_ms = None
+
+        # Logging of channel and board measurements: full, summary or off
+        self.measurement_logging = config['Equipment.Manufacturer.IGT']['Measurement logging']
+
+        # Flag channels whose measurements drift from their baseline and the other channels
+        self.channel_health = None
+        if config['Equipment.Manufacturer.IGT']['Channel health monitor'] == 'True':
+            self.channel_health = channel_health.ChannelHealthMonitor()
+
+    def check_connection(self):
         """
-        Checks whether a sequence has been sent to the ultrasound driving system.
+        Checks whether the connection with the IGT ultrasound driving system is still alive,
+        without sending commands. Updates the connection state.
 
         Returns:
-            bool: True if a sequence has been sent, False otherwise.
+            bool: True if the connection is alive, False otherwise.
         """
 
-        return seq_num in self.sent_seq_nums
+        self.connected = self.fus is not None and self.fus.isConnected()
+
+        return self.connected
 
-    def register_sent_sequence(self, seq_num):
+    def resident_sequences(self, sequences):
         """
-        Adds the sequence number of the sent sequence to the sent sequence list.
+        Returns which of the sent sequences are still resident in a buffer slot.
+
+        Parameters:
+            sequences (list): Sent sequences in the order in which they were sent.
+
+        Returns:
+            list: The resident sequences in the order in which they were sent.
+        """
+
+        return [sequence for sequence in sequences if self.is_sequence_sent(sequence.seq_num)]
+
+    def is_sequence_sent(self, seq_num):
         """
+        Checks whether a sequence has been sent to the ultrasound driving system and is still
+        resident in one of its buffer slots.
 
-        self.sent_seq_nums.append(seq_num)
+        Returns:
+            bool: True if a sequence has been sent, False otherwise.
+        """
 
-    def connect(self, connect_info, log_dir='C:\\Temp', log_name='standalone_igt'):
+        return self.slots.entry(seq_num) is not None
+
+    def connect(self, connect_info, log_dir=DEFAULT_LOG_DIR, log_name='standalone_igt'):
         """
         Connects to the IGT ultrasound driving system.
 
@@ -115,7 +192,11 @@ class IGT(ds.ControlDrivingSystem):
         """
 
         # When no connection, it is assumed that all sent sequences aren't available (anymore)
-        self.sent_seq_nums = []
+        # and that the generator state is unknown
+        self.slots.clear()
+        self.active_content = None
+        if self.shadow is not None:
+            self.shadow.invalidate()
 
         try:
             # Establish connection with driving system
@@ -124,7 +205,7 @@ class IGT(ds.ControlDrivingSystem):
             logger.info('After unifus.FUSSystem....')
         except Exception as e:
             logger.error(f'Error initializing FUSSystem: {e}')
-            sys.exit()
+            raise ds.DrivingSystemExit(f'Error initializing FUSSystem: {e}')
 
         try:
             unifus.setLogPath(log_dir, log_name + "_igt_ds_log")
@@ -133,34 +214,45 @@ class IGT(ds.ControlDrivingSystem):
             logger.info('After setting logging....')
         except Exception as e:
             logger.error(f"Error setting up logging: {e}")
-            sys.exit()
+            raise ds.DrivingSystemExit(f'Error setting up logging: {e}')
 
         try:
             # Update the name of your configuration file
-            igt_config_path = pkg_resources.resource_filename('fus_driving_systems', connect_info)
+            igt_config_path = pkg_resources.resource_filename('fus_driving_systems',
+                                                              connect_info.replace('\\', '/'))
             logger.info(f'igt_config_path: {igt_config_path} found....')
             if igt_config_path != '':
                 self.fus.loadConfig(igt_config_path)
                 logger.info('After loadConfig....')
             else:
                 logger.error("Configuration file %s doesn't exist.", igt_config_path)
-                sys.exit()
+                raise ds.DrivingSystemExit(f"Configuration file {igt_config_path} doesn't exist.")
         except Exception as e:
             logger.error(f"Error loading configuration: {e}")
-            sys.exit()
+            raise ds.DrivingSystemExit(f'Error loading configuration: {e}')
 
         try:
             # Create and register an event listener
-            self.listener = ExecListener()
+            self.listener = ExecListener(self.measurement_logging)
+            if self.channel_health is not None:
+                self.channel_health.reset()
+                self.listener.channelHealth = self.channel_health
             self.fus.registerListener(self.listener)
             logger.info('After listener....')
 
+            if self.record_pulse_results:
+                self.pulse_session = os.path.join(log_dir, log_name + '_pulse_results_' +
+                                                  time.strftime('%Y%m%d_%H%M%S'))
+                self.listener.startRecording(self.pulse_session)
+                logger.info('Pulse results are recorded in %s', self.pulse_session)
+
+            self.listener.expectConnection()
             self.fus.connect()
-            self.listener.waitConnection()
-            logger.info('After waitConnection()....')
+            result = self.listener.waitConnection()
+            logger.info('After waitConnection()....: %s', result)
         except Exception as e:
             logger.error(f"Error during connection or listener registration: {e}")
-            sys.exit()
+            raise ds.DrivingSystemExit(f'Error during connection or listener registration: {e}')
 
         try:
             if self.fus.isConnected():
@@ -168,15 +260,19 @@ class IGT(ds.ControlDrivingSystem):
                 logger.info('Driving system is connected.')
 
                 self.gen = self.fus.gen()
+                if self.shadow is None:
+                    self.shadow = generator_shadow.GeneratorShadow(self.gen)
+                else:
+                    self.shadow.gen = self.gen
                 self.n_channels = self.gen.getParam(unifus.GenParam.ChannelCount)
                 logger.info("Generator: %s channels", self.n_channels)
             else:
                 self.connected = False
                 logger.error("Error: connection failed.")
-                sys.exit()
+                raise ds.DrivingSystemExit('Connection failed.')
         except Exception as e:
             logger.error(f"Error after connection check: {e}")
-            sys.exit()
+            raise ds.DrivingSystemExit(f'Error after connection check: {e}')
 
     def validate_sequence(self, sequence):
         """
@@ -199,6 +295,10 @@ class IGT(ds.ControlDrivingSystem):
             error_messages.append('Pulse repetition interval is not allowed to be smaller than' +
                                   ' 170 us.')
 
+        if sequence.pulse_ramp_shape not in ramp_envelope.ramp_shapes():
+            error_messages.append(f'Ramp shape {sequence.pulse_ramp_shape} is not supported by ' +
+                                  'the IGT driving system.')
+
         if sequence.pulse_ramp_dur > 0 and sequence.pulse_ramp_shape != config['General']['Ramp shape.rect']:
             if sequence.pulse_ramp_dur > sequence.pulse_dur/2 - 0.035:
                 error_messages.append('When applying ramping, there needs to be at least ' +
@@ -216,67 +316,132 @@ class IGT(ds.ControlDrivingSystem):
                 used equipment (driving system and transducer)
         """
 
-        logger.info('Sequence with the following parameters is validated before sending: \n '
-                    + '%s', sequence)
-
-        error_messages = self.validate_sequence(sequence)
-
-        if error_messages:
-            for error in error_messages:
-                logger.error(error)
-            sys.exit()
+        self._validate_or_exit(sequence)
 
         if self.is_connected():
 
-            # define pulse
-            pulse = self._define_pulse(sequence)
+            # define pulse, pulse train, pulse train repetition and ramping
+            content, modulation = self._compile_sequence(sequence)
 
-            # define pulse train
-            self._define_pulse_train(sequence, pulse)
+            self._prepare_generator()
 
-            # Define pulse train repetition
-            # number of executions of one pulse train
-            self.n_pulse_train_rep = math.floor(sequence.pulse_train_rep_dur /
-                                                sequence.pulse_train_rep_int)
+            # Identical compiled content that is still resident on the generator is not uploaded
+            entry, _ = self._upload_compiled(sequence, content, modulation)
+            self._activate_entry(entry)
 
-            # Apply ramping
-            if sequence.pulse_ramp_shape != config['General']['Ramp shape.rect']:
-                self._apply_ramping(sequence)
+            logger.info('Sequence slots: %s', self.slots.stats())
 
-            # (optional) restore disabled channels
-            self.gen.enableAllChannels()
+        else:
+            logger.warning("No connection with driving system.")
+            logger.warning("Reconnecting with driving system...")
 
-            # (optional) disable HeartBeat security
-            self.gen.setParam(unifus.GenParam.HeartBeatTimeout, 0)
+            # if no connection can be made, program stops preventing infinite loop
+            self.connect(sequence.driving_sys.connect_info)
+            self.send_sequence(sequence)
 
-            # (optional) only for generator with a transducer multiplexer
-            # gen.setParam (unifus.GenParam.MultiplexerValue, 3);
+    def preload_bundle(self, sequences):
+        """
+        Validates, compiles and uploads a bundle of ultrasound sequences in one batch, e.g. directly
+        after connecting. A bundle entry is executed afterwards with execute_bundle_entry(), which
+        only prepares and starts the resident sequence.
 
-            # Upload the sequence
-            self.gen.sendSequence(sequence.seq_num, self.seq)
+        Parameters:
+            sequences (list(Sequence)): The sequences of the bundle, identified by their sequence
+            number.
 
-            self.total_sequence_duration_ms = (100 + unifus.sequenceDurationMs(
-                self.seq, self.n_pulse_train_rep, self.pulse_train_delay))
+        Returns:
+            dict: Per sequence number, the slot and the compile and upload time [ms]. The upload
+            time is None if identical content was already resident.
+        """
 
-            self.register_sent_sequence(sequence.seq_num)
+        seq_nums = [sequence.seq_num for sequence in sequences]
+        if len(set(seq_nums)) != len(seq_nums):
+            logger.error(f'Sequence numbers in a bundle need to be unique: {seq_nums}')
+            raise ds.DrivingSystemExit('Sequence numbers in a bundle need to be unique.')
 
-        else:
+        for sequence in sequences:
+            self._validate_or_exit(sequence)
+
+        if not self.is_connected():
             logger.warning("No connection with driving system.")
             logger.warning("Reconnecting with driving system...")
 
             # if no connection can be made, program stops preventing infinite loop
-            self.connect(sequence.driving_sys.connect_info)
-            self.send_sequence(sequence)
+            self.connect(sequences[0].driving_sys.connect_info)
+
+        self._prepare_generator()
+
+        timings = {}
+        contents = set()
+        for sequence in sequences:
+            start_time = time.perf_counter()
+            content, modulation = self._compile_sequence(sequence)
+            compile_time = time.perf_counter() - start_time
+
+            contents.add(content)
+            if len(contents) > self.slots.capacity:
+                logger.error(f'Bundle needs more than the {self.slots.capacity} sequence buffer ' +
+                             'slots of the generator.')
+                raise ds.DrivingSystemExit('Bundle needs more sequence buffer slots.')
+
+            entry, upload_time = self._upload_compiled(sequence, content, modulation)
+
+            self.bundle[sequence.seq_num] = sequence
+            timings[sequence.seq_num] = {
+                'slot': entry.slot,
+                'compile_ms': compile_time * 1000,
+                'upload_ms': None if upload_time is None else upload_time * 1000
+                }
+
+            logger.info('Bundle entry %s in slot %s: compiled in %.1f ms, %s', sequence.seq_num,
+                        entry.slot, compile_time * 1000,
+                        'already resident' if upload_time is None
+                        else f'uploaded in {upload_time * 1000:.1f} ms')
 
-    def wait_for_trigger(self, sequence, debug_info=False):
+        logger.info('Sequence slots: %s', self.slots.stats())
+
+        return timings
+
+    def execute_bundle_entry(self, seq_num, debug_info=False):
+        """
+        Executes a sequence of the preloaded bundle. A resident sequence is only prepared and
+        started; a sequence that is not resident (anymore) is sent again first.
+
+        Parameters:
+            seq_num (int): Sequence number of the bundle entry.
+            debug_info (bool): True = measure channels, boards or timings during execution.
+        """
+
+        sequence = self.bundle.get(seq_num)
+        if sequence is None:
+            logger.error(f'Sequence number {seq_num} is not part of the preloaded bundle: ' +
+                         f'{list(self.bundle)}')
+            raise ds.DrivingSystemExit(f'Sequence {seq_num} is not part of the preloaded bundle.')
+
+        if sequence.wait_for_trigger:
+            self.wait_for_trigger(sequence, debug_info)
+        else:
+            self.execute_sequence(sequence, debug_info)
+
+    def wait_for_trigger(self, sequence, debug_info=False, callback=None):
         """
         Activates the listener on the IGT ultrasound driving system to wait for the trigger to
         execte the previously sent sequence.
+
+        Parameters:
+            sequence (Sequence): The sequence object containing ultrasound parameters.
+            debug_info (bool): True = measure channels, boards or timings during execution.
+            callback (function): Called once from the listener thread with the WaitResult of the
+            triggered sequence. None = no callback.
         """
 
         if self.is_connected():
-            if self.is_sequence_sent(sequence.seq_num):
+            entry = self.slots.entry(sequence.seq_num)
+            if entry is not None:
                 try:
+                    # Execution parameters and modulation of the resident sequence
+                    self._activate_entry(entry)
+
                     # Use unifus.ExecFlag.NONE if nothing special, or simply don't pass the
                     # exec_flags argument. Use '|' to combine multiple flags: flag1 | flag2 | flag3
                     # To use trigger, add one of unifus::ExecFlag::Trigger*
@@ -310,24 +475,26 @@ class IGT(ds.ControlDrivingSystem):
                     else:
                         logger.error(f'Trigger option {sequence.trigger_option} is not identical ' +
                                      f'to implemented trigger options: {sequence.get_trigger_options()}.')
-                        sys.exit()
+                        raise ds.DrivingSystemExit('Unknown trigger option ' +
+                                                   f'{sequence.trigger_option}.')
 
-                    self.gen.prepareSequence(sequence.seq_num, self.n_pulse_train_rep,
+                    self.gen.prepareSequence(entry.slot, self.n_pulse_train_rep,
                                              self.pulse_train_delay, exec_flags)
 
-                    self.gen.startSequence()
+                    self.listener.expectSequence(self._sequence_result_handler(callback))
+                    self.shadow.start_sequence()
                     logger.info('Wait for trigger')
 
                 except Exception as why:
                     logger.error("Exception: %s", str(why))
-                    sys.exit()
+                    raise ds.DrivingSystemExit(str(why))
             else:
                 logger.warning('The sequence has to be sent first using send_sequence() before ' +
                                'the driving system can wait for a trigger.')
                 logger.warning('Sending sequence...')
 
                 self.send_sequence(sequence)
-                self.wait_for_trigger(sequence)
+                self.wait_for_trigger(sequence, debug_info, callback)
         else:
             logger.warning("No connection with driving system.")
             logger.warning("Reconnecting with driving system...")
@@ -335,16 +502,59 @@ class IGT(ds.ControlDrivingSystem):
             # if no connection can be made, program stops preventing infinite loop
             self.connect(sequence.driving_sys.connect_info)
             self.send_sequence(sequence)
-            self.wait_for_trigger(sequence)
+            self.wait_for_trigger(sequence, debug_info, callback)
 
     def execute_sequence(self, sequence, debug_info=False):
         """
-        Executes the previously sent sequence on the IGT ultrasound driving system.
+        Executes the previously sent sequence on the IGT ultrasound driving system and waits until
+        it is finished.
+        """
+
+        self.start_sequence(sequence, debug_info)
+
+        # Returns as soon as the sequence result is received
+        result = self.listener.waitSequence((self.total_sequence_duration_ms +
+                                             SEQUENCE_TIMEOUT_MARGIN) / 1000.0)
+        if result.timedOut:
+            logger.warning('No sequence result received within %.0f ms',
+                           self.total_sequence_duration_ms + SEQUENCE_TIMEOUT_MARGIN)
+        elif not result.success:
+            logger.error('Sequence execution failed with error code %s', result.errorCode)
+
+    def start_sequence(self, sequence, debug_info=False, callback=None):
+        """
+        Starts the previously sent sequence on the IGT ultrasound driving system without waiting
+        until it is finished.
+
+        Parameters:
+            sequence (Sequence): The sequence object containing ultrasound parameters.
+            debug_info (bool): True = measure channels, boards or timings during execution.
+            callback (function): Called once from the listener thread with the WaitResult of the
+            sequence. None = no callback; use listener.waitSequence() to wait.
+        """
+
+        self.arm_sequence(sequence, debug_info, callback)
+        self.start_armed_sequence()
+
+    def arm_sequence(self, sequence, debug_info=False, callback=None):
+        """
+        Prepares the previously sent sequence on the IGT ultrasound driving system, so that
+        start_armed_sequence() only has to start it.
+
+        Parameters:
+            sequence (Sequence): The sequence object containing ultrasound parameters.
+            debug_info (bool): True = measure channels, boards or timings during execution.
+            callback (function): Called once from the listener thread with the WaitResult of the
+            sequence. None = no callback; use listener.waitSequence() to wait.
         """
 
         if self.is_connected():
-            if self.is_sequence_sent(sequence.seq_num):
+            entry = self.slots.entry(sequence.seq_num)
+            if entry is not None:
                 try:
+                    # Execution parameters and modulation of the resident sequence
+                    self._activate_entry(entry)
+
                     # Use unifus.ExecFlag.NONE if nothing special, or simply don't pass the
                     # exec_flags argument. Use '|' to combine multiple flags: flag1 | flag2 | flag3
                     # To use trigger, add one of unifus::ExecFlag::Trigger*
@@ -365,22 +575,22 @@ class IGT(ds.ControlDrivingSystem):
                         elif sequence.pulse_dur >= 0.001 + ramp_transient_t:  # [ms]:
                             exec_flags |= unifus.ExecFlag.MeasureTimings  # or NONE
 
-                    self.gen.prepareSequence(sequence.seq_num, self.n_pulse_train_rep,
+                    self.gen.prepareSequence(entry.slot, self.n_pulse_train_rep,
                                              self.pulse_train_delay, exec_flags)
 
-                    self.gen.startSequence()
-                    self.listener.waitSequence(self.total_sequence_duration_ms / 1000.0)
+                    self.listener.expectSequence(self._sequence_result_handler(callback))
+                    self.armed_sequence = (sequence, callback)
 
                 except Exception as why:
                     logger.error("Exception: %s", str(why))
-                    sys.exit()
+                    raise ds.DrivingSystemExit(str(why))
             else:
                 logger.warning('The sequence has to be sent first using send_sequence() before ' +
                                'the driving system can execute a sequence.')
                 logger.warning('Sending sequence...')
 
                 self.send_sequence(sequence)
-                self.execute_sequence(sequence)
+                self.arm_sequence(sequence, debug_info, callback)
 
         else:
             logger.warning("No connection with driving system.")
@@ -389,25 +599,76 @@ class IGT(ds.ControlDrivingSystem):
             # if no connection can be made, program stops preventing infinite loop
             self.connect(sequence.driving_sys.connect_info)
             self.send_sequence(sequence)
-            self.execute_sequence(sequence)
+            self.arm_sequence(sequence, debug_info, callback)
+
+    def start_armed_sequence(self):
+        """
+        Starts the sequence prepared by arm_sequence().
+        """
+
+        try:
+            self.shadow.start_sequence()
+            self.armed_sequence = None
+        except Exception as why:
+            logger.error("Exception: %s", str(why))
+            raise ds.DrivingSystemExit(str(why))
+
+    def disarm_sequence(self):
+        """
+        Releases the sequence prepared by arm_sequence() or wait_for_trigger() without executing
+        it. A started sequence, including one waiting for a trigger, is stopped and the stop is
+        confirmed through the listener.
+        """
+
+        if self.gen is None or not self.is_connected():
+            return
+
+        try:
+            if self.armed_sequence is not None:
+                # A prepared sequence that was not started does not send a result
+                self.armed_sequence = None
+                self.listener.cancelSequence()
+
+            elif self.shadow.stop_sequence() and self.listener.isSequenceRunning():
+                result = self.listener.waitSequence(STOP_TIMEOUT)
+                if result.timedOut:
+                    logger.warning('No confirmation of the stopped sequence within %g s',
+                                   STOP_TIMEOUT)
+        except Exception as why:
+            logger.error("Exception: %s", str(why))
+            raise ds.DrivingSystemExit(str(why))
 
     def disconnect(self):
         """
-        Disconnects from the IGT ultrasound driving system.
+        Disconnects from the IGT ultrasound driving system. A running sequence is stopped and the
+        stop is confirmed through the listener; the stop and modulation reset are skipped when
+        the generator is known to be idle. The duration of the shutdown is stored in
+        shutdown_ms.
         """
 
-        if self.gen is not None:
-            # disabling any old modulation
-            self.gen.stopSequence()
+        start_time = time.monotonic()
 
-            time.sleep(2)
+        if self.gen is not None:
+            # Sequences started on this connection mark the generator idle when their result is
+            # received, otherwise the state is unknown and the sequence is stopped
+            if self.shadow.stop_sequence() and self.listener.isSequenceRunning():
+                result = self.listener.waitSequence(STOP_TIMEOUT)
+                if result.timedOut:
+                    logger.warning('No confirmation of the stopped sequence within %g s',
+                                   STOP_TIMEOUT)
 
-            self.gen.setPulseModulation([], 0, [], 0)  # disable any modulation
+            self.shadow.disable_pulse_modulation()  # disable any modulation
+            self.shadow.log_stats()
 
         if self.fus is not None:
-            self.fus.clearListeners()
+            self.listener.expectDisconnect()
             self.fus.disconnect()
 
+            # Returns as soon as the disconnection is received
+            if self.fus.isConnected():
+                self.listener.waitDisconnect(DISCONNECT_TIMEOUT)
+            self.fus.clearListeners()
+
             if not self.fus.isConnected():
                 self.connected = False
                 logger.info("Disconnected")
@@ -415,6 +676,192 @@ class IGT(ds.ControlDrivingSystem):
                 logger.error("Failed to disconnect")
                 self.connected = True
 
+        if self.listener is not None:
+            self.listener.stopRecording()
+
+        self.shutdown_ms = (time.monotonic() - start_time) * 1000
+        logger.info('Shutdown took %.0f ms', self.shutdown_ms)
+
+    def _validate_or_exit(self, sequence):
+        """
+        Validates an ultrasound sequence and stops the program if it is not valid.
+
+        Parameters:
+            sequence (Sequence): The sequence object containing ultrasound parameters.
+        """
+
+        logger.info('Sequence with the following parameters is validated before sending: \n '
+                    + '%s', sequence)
+
+        error_messages = self.validate_sequence(sequence)
+
+        if error_messages:
+            for error in error_messages:
+                logger.error(error)
+            raise ds.DrivingSystemExit(' '.join(error_messages))
+
+    def _prepare_generator(self):
+        """
+        Sets the generator state needed before uploading sequences.
+        """
+
+        # (optional) restore disabled channels
+        self.shadow.enable_all_channels()
+
+        # (optional) disable HeartBeat security
+        self.shadow.set_param(unifus.GenParam.HeartBeatTimeout, 0)
+
+        # (optional) only for generator with a transducer multiplexer
+        # gen.setParam (unifus.GenParam.MultiplexerValue, 3);
+
+    def _compile_sequence(self, sequence):
+        """
+        Compiles an ultrasound sequence into the pulse train, pulse train repetition and pulse
+        modulation for the IGT ultrasound driving system.
+
+        Parameters:
+            sequence (Sequence): The sequence object containing ultrasound parameters.
+
+        Returns:
+            tuple: Fingerprint of the compiled sequence and the pulse modulation used for ramping.
+        """
+
+        # define pulse
+        pulse = self._define_pulse(sequence)
+
+        # define pulse train and pulse train repetition
+        self._define_pulse_train(sequence, pulse)
+
+        # Define ramping
+        modulation = ramp_envelope.ramp_modulation(sequence.pulse_ramp_shape,
+                                                   sequence.pulse_ramp_dur)
+
+        return self._fingerprint(sequence, modulation), modulation
+
+    def _upload_compiled(self, sequence, content, modulation):
+        """
+        Uploads the last compiled sequence to a buffer slot, unless identical content is still
+        resident on the generator, and binds the sequence number to it.
+
+        Parameters:
+            sequence (Sequence): The sequence object containing ultrasound parameters.
+            content (str): Fingerprint of the compiled sequence.
+            modulation (tuple): Pulse modulation used for ramping.
+
+        Returns:
+            tuple: The resident entry and the upload time [s] (None = upload was skipped).
+        """
+
+        upload_time = None
+        entry = self.slots.lookup(content)
+
+        if entry is None:
+            total_sequence_duration_ms = unifus.sequenceDurationMs(
+                self.seq, self.n_pulse_train_rep, self.pulse_train_delay)
+            entry = self.slots.allocate(content, self.n_pulse_train_rep, self.pulse_train_delay,
+                                        total_sequence_duration_ms, modulation,
+                                        self._pinned_content())
+            if entry is None:
+                logger.error('All sequence buffer slots are in use by the armed or running ' +
+                             'sequence, the sequence can not be uploaded.')
+                raise ds.DrivingSystemExit('No free sequence buffer slot.')
+
+            # Upload the sequence
+            start_time = time.perf_counter()
+            self.gen.sendSequence(entry.slot, self.seq)
+            upload_time = time.perf_counter() - start_time
+            self._log_upload(sequence.seq_num, upload_time)
+
+        else:
+            logger.info('Sequence %s is resident in slot %s, upload is skipped',
+                        sequence.seq_num, entry.slot)
+
+        self.slots.bind(sequence.seq_num, content)
+
+        return entry, upload_time
+
+    def _pinned_content(self):
+        """
+        Returns the fingerprints of the resident content whose slot may not be reused: the armed
+        or running sequence.
+
+        Returns:
+            set: Fingerprints of the pinned content.
+        """
+
+        if self.active_content is None:
+            return set()
+
+        running = self.shadow.sequence_started and self.shadow.starts == self.active_start
+        if self.armed_sequence is not None or running:
+            return {self.active_content}
+
+        return set()
+
+    def _sequence_result_handler(self, callback):
+        """
+        Returns the listener callback of a started sequence, which records that the generator is
+        idle again before calling the given callback.
+
+        Parameters:
+            callback (function): Called with the WaitResult of the sequence, None = no callback.
+
+        Returns:
+            function: The listener callback.
+        """
+
+        # The handler is created just before its sequence is started, so the result of an
+        # earlier sequence does not mark a later one as stopped
+        start = self.shadow.starts + 1
+
+        def on_result(result):
+            self.shadow.mark_stopped(start)
+            if callback is not None:
+                callback(result)
+
+        return on_result
+
+    def _activate_entry(self, entry):
+        """
+        Restores the execution parameters of a resident sequence: the pulse train repetition,
+        the total duration and the pulse modulation. The channel health baseline is discarded.
+
+        Parameters:
+            entry (SlotEntry): The resident sequence.
+        """
+
+        self.active_content = entry.fingerprint
+        self.active_start = self.shadow.starts + 1
+        self.n_pulse_train_rep = entry.n_pulse_train_rep
+        self.pulse_train_delay = entry.pulse_train_delay
+        self.total_sequence_duration_ms = entry.total_duration_ms
+
+        self.shadow.set_pulse_modulation(entry.modulation)
+
+        # The channel phases depend on the focus and amplitude of the sequence, so every sequence
+        # gets its own baseline
+        if self.channel_health is not None:
+            self.channel_health.reset()
+
+    def _fingerprint(self, sequence, modulation):
+        """
+        Returns the fingerprint of the compiled sequence: the pulse, pulse train, pulse train
+        repetition and pulse modulation.
+
+        Parameters:
+            sequence (Sequence): The sequence object containing ultrasound parameters.
+            modulation (tuple): Pulse modulation used for ramping.
+
+        Returns:
+            str: Fingerprint of the compiled sequence.
+        """
+
+        return slot_manager.fingerprint(
+            int(self.n_channels), sequence.pulse_dur,
+            round(sequence.pulse_rep_int - sequence.pulse_dur, 1), int(sequence.oper_freq * 1e3),
+            sequence.ampl, self.pulse_phases, [run.count for run in self.encoded_seq.runs],
+            self.n_pulse_train_rep, self.pulse_train_delay, modulation)
+
     def _define_pulse(self, sequence):
         """
         Defines the pulse for the IGT ultrasound driving system.
@@ -440,21 +887,23 @@ class IGT(ds.ControlDrivingSystem):
             pulse.setAmplitudes([sequence.ampl])
         else:
             logger.error("Intensity parameter may be set incorrectly. Amplitude is None.")
-            sys.exit()
+            raise ds.DrivingSystemExit('Amplitude is None.')
 
         # set same phase offset for all channels (angle in [0,360] degrees)
         if sequence.dephasing_degree is not None and len(sequence.dephasing_degree) == sequence.transducer.elements:
                 logger.info(f'Phases are overridden by phases set at dephasing_degree :{sequence.dephasing_degree}')
-                pulse.setPhases(sequence.dephasing_degree)
+                self.pulse_phases = list(sequence.dephasing_degree)
+                pulse.setPhases(self.pulse_phases)
         else:
-            pulse = self._set_phases(pulse, sequence.focus, sequence.transducer.steer_info,
-                                     sequence.transducer.natural_foc, sequence.dephasing_degree)
+            pulse = self._set_phases(pulse, sequence.focus, sequence.transducer,
+                                     sequence.dephasing_degree)
 
         return pulse
 
     def _define_pulse_train(self, sequence, pulse):
         """
-        Defines the pulse train for the IGT ultrasound driving system.
+        Defines the pulse train and pulse train repetition for the IGT ultrasound driving system.
+        Identical pulses are uploaded once and repeated by the generator when the timing allows it.
 
         Parameters:
             sequence (Sequence): The sequence object containing ultrasound parameters.
@@ -465,22 +914,68 @@ class IGT(ds.ControlDrivingSystem):
         # number of executions of one pulse train
         n_pulse_train = math.floor(sequence.pulse_train_dur / sequence.pulse_rep_int)
 
+        # milliseconds between pulse trains
+        pulse_train_delay = sequence.pulse_train_rep_int - sequence.pulse_train_dur
+
+        # Define pulse train repetition
+        # number of executions of one pulse train
+        n_pulse_train_rep = math.floor(sequence.pulse_train_rep_dur /
+                                       sequence.pulse_train_rep_int)
+
+        # When waiting for a trigger, the repetition controls are used for triggering
+        allow_collapse = self.compact_upload and not sequence.wait_for_trigger
+        self.encoded_seq = sequence_encoding.encode_pulse_train(n_pulse_train * [pulse],
+                                                                n_pulse_train_rep,
+                                                                pulse_train_delay,
+                                                                allow_collapse)
+
         # Define a complete sequence
-        self.seq = []
-        self.seq += n_pulse_train * [pulse]
+        self.seq = self.encoded_seq.pulses()
+        self.n_pulse_train_rep = self.encoded_seq.n_pulse_train_rep
+        self.pulse_train_delay = self.encoded_seq.pulse_train_delay
 
-        # milliseconds between pulse trains
-        self.pulse_train_delay = sequence.pulse_train_rep_int - sequence.pulse_train_dur
+    def _log_upload(self, seq_num, upload_time):
+        """
+        Logs and stores the duration of a sequence upload and a model estimate of its size, see
+        EncodedSequence.estimated_bytes(). Only the duration of the encoding that is actually
+        uploaded is measured; the pulse by pulse encoding is described by its pulse count and
+        estimated size.
 
-    def _set_phases(self, pulse, focus, steer_info, natural_foc, dephasing_degree):
+        Parameters:
+            seq_num (int): Sequence number of the uploaded sequence.
+            upload_time (float): Duration of the upload [s].
+        """
+
+        # n phases, 1 frequency and 1 amplitude per pulse (see _define_pulse)
+        n_values = int(self.n_channels) + 2
+
+        self.upload_stats = {
+            'seq_num': seq_num,
+            'collapsed': self.encoded_seq.collapsed,
+            'pulses': self.encoded_seq.n_pulses,
+            'estimated_bytes': self.encoded_seq.estimated_bytes(n_values),
+            'expanded_pulses': self.encoded_seq.n_pulses_expanded,
+            'estimated_expanded_bytes': self.encoded_seq.estimated_bytes(n_values, expanded=True),
+            'time_ms': upload_time * 1000
+            }
+
+        logger.info('Sequence %s uploaded in %.1f ms: %d pulse(s), model estimate ~%d bytes ' +
+                    '(pulse by pulse: %d pulses, model estimate ~%d bytes, upload time not ' +
+                    'measured), executed %d time(s) with %s ms delay',
+                    seq_num, self.upload_stats['time_ms'], self.upload_stats['pulses'],
+                    self.upload_stats['estimated_bytes'], self.upload_stats['expanded_pulses'],
+                    self.upload_stats['estimated_expanded_bytes'], self.n_pulse_train_rep,
+                    self.pulse_train_delay)
+
+    def _set_phases(self, pulse, focus, transducer, dephasing_degree):
         """
         Gets the phases for the IGT ultrasound driving system.
 
         Parameters:
             pulse (unifus.Pulse): The defined pulse.
             focus (float): The focus value [mm].
-            steer_info (str): Path to the steer information.
-            natural_foc (float): The natural focus value [mm] used to calculate target focus.
+            transducer (Transducer): The transducer containing the steer information, natural focus
+            [mm] used to calculate target focus and focal range [mm].
             dephasing_degree (list(float)): The degree used to dephase n elements in one cycle.
             None = no dephasing. If the list is equal to the number of elements, the phases based on
             the focus are overridden.
@@ -490,135 +985,76 @@ class IGT(ds.ControlDrivingSystem):
         """
 
         # transducer has been chosen where phases are calculated based on phase law
+        steer_info = transducer.steer_info
         if steer_info.endswith('.ini'):
 
-            trans = transducerXYZ.Transducer()
-            ini_path = pkg_resources.resource_filename('fus_driving_systems', steer_info)
-            if not trans.load(ini_path):
-                logger.error('Error: can not load the transducer definition from %s', ini_path)
-                sys.exit()
+            ini_path = pkg_resources.resource_filename('fus_driving_systems',
+                                                       steer_info.replace('\\', '/'))
+
+            # Foci on the 0.1 mm grid are read from the precomputed phase table
+            table = phase_table.get_phase_table(ini_path, pulse.frequency(0),
+                                                transducer.natural_foc, transducer.min_foc,
+                                                transducer.max_foc)
+            phases = table.get_phases(focus) if table is not None else None
+
+            if phases is None:
+                definition = equipment_index.get_definition(steer_info)
+                if definition is None:
+                    logger.error('Error: can not load the transducer definition from %s', ini_path)
+                    raise ds.DrivingSystemExit('Can not load the transducer definition ' +
+                                               f'from {ini_path}.')
 
-            # Calculate target focus with respect to natural focus: + is before natural focus,
-            # - is after natural focus
-            aim_wrt_natural_focus = natural_foc - focus
+                trans = transducerXYZ.Transducer()
+                trans.setDefinition(definition)
 
-            # Aim n mm away from the natural focal spot, on main axis (Z)
-            trans.computePhases(pulse, (0, 0, aim_wrt_natural_focus), focus, dephasing_degree)
+                # Calculate target focus with respect to natural focus: + is before natural focus,
+                # - is after natural focus
+                aim_wrt_natural_focus = transducer.natural_foc - focus
+
+                # Aim n mm away from the natural focal spot, on main axis (Z)
+                phases = trans.computePhasesBatch([(0, 0, aim_wrt_natural_focus)],
+                                                  pulse.frequency(0))[0]
 
         else:
             # Import excel file containing phases per focal depth
-            excel_path = pkg_resources.resource_filename('fus_driving_systems', steer_info)
+            excel_path = pkg_resources.resource_filename('fus_driving_systems',
+                                                         steer_info.replace('\\', '/'))
 
             logger.info('Extract phase information from %s', excel_path)
 
             if os.path.exists(excel_path):
-                data = pd.read_excel(excel_path, engine='openpyxl')
-
-                # Make sure both values have the same amount of decimals
-                focus = round(focus, 1)
-                match_row = data.loc[data['Distance'] == focus]
-
-                if match_row.empty:
-                    logger.error(f'No focus in transducer phases file {excel_path}' +
-                                 f' corresponds with {focus}')
-                    sys.exit()
-
-                elif len(match_row) > 1:
-                    logger.error('Duplicate foci %s found in transducer phases file %s',
-                                 focus, excel_path)
-                    sys.exit()
+                table = equipment_index.get_steer_table(steer_info)
 
-                # Retrieve phases dependent of number of channels
-                phases = [match_row.iloc[0].iloc[1:int(self.n_channels)+1]].to_list()
+                if self.steer_table_interpolation:
+                    # Retrieve phases dependent of number of channels, interpolated between rows
+                    phases = table.interpolate([focus], int(self.n_channels),
+                                               self.steer_table_max_gap)[0]
 
-                if dephasing_degree is not None:
-                    if len(dephasing_degree) > 1:
-                        logger.warning('Too few or too many entries given at dephasing_degree.' +
-                                       ' Only the first one is now used for dephasing purposes.')
+                else:
+                    # Make sure both values have the same amount of decimals
+                    focus = round(focus, 1)
 
-                    dephasing_degree = dephasing_degree[0]
-                    # determine n elements to dephase in one cycle
-                    nth_elem = round(360/dephasing_degree)
-                    dephasing_elem = 0
-                    for i in range(len(phases)):
-                        # Add chosen degrees to dephase signal
-                        phases[i] = phases[i] + dephasing_degree*dephasing_elem
+                    # Retrieve phases dependent of number of channels
+                    phases = table.get_phases(focus, int(self.n_channels))
 
-                        dephasing_elem = dephasing_elem + 1
-                        if dephasing_elem == nth_elem:
-                            dephasing_elem = 0
-
-                phases_str = ', '.join([format(x, '.2f') for x in phases])
-                logger.info(f'Computed phases for set focus of {focus}: {phases_str}')
-
-                pulse.setPhases(phases)
+                    if phases is None:
+                        logger.error(f'No focus in transducer phases file {excel_path}' +
+                                     f' corresponds with {focus}')
+                        raise ds.DrivingSystemExit(f'No focus in {excel_path} corresponds ' +
+                                                   f'with {focus}.')
 
             else:
                 logger.error("Pipeline is cancelled. The following direction cannot be found: "
                              + "%s", excel_path)
-                sys.exit()
-
-        return pulse
-
-    def _apply_ramping(self, sequence):
-        """
-        Applies ramping on the IGT ultrasound driving system.
-
-        Parameters:
-            sequence (Sequence): The sequence object containing ultrasound parameters.
-        """
+                raise ds.DrivingSystemExit(f'Steer information {excel_path} can not be found.')
 
-        # Use best temporal resolution for pulse ramping [ms]
-        min_ramp_temp_res = 0.005  # [ms]
-        max_ramp_steps = 1023
+        # Apply dephasing and wrap the phases into [0, 360)
+        phases = phase_processing.post_process_phases(phases, dephasing_degree)
 
-        ramp_n_steps = int(sequence.pulse_ramp_dur/min_ramp_temp_res)
-        if ramp_n_steps > max_ramp_steps:
-            min_ramp_temp_res = sequence.pulse_ramp_dur/max_ramp_steps
+        phases_str = ', '.join([format(x, '.2f') for x in phases])
+        logger.info(f'Computed phases for set focus of {focus}: {phases_str}')
 
-        # Note: ramp up and ramp down order are the other way around
-        # ramp up descends, ramp down ascends
-        ampl_ramp = self._get_ramping_amplitude(sequence, min_ramp_temp_res)
+        self.pulse_phases = phases.tolist()
+        pulse.setPhases(self.pulse_phases)
 
-        # Execution with pulse modulation (automatically disable ramps if any)
-        # Values are attenuation in percent of the full Pulse amplitude.
-        # 0 = no attenuation = full amplitude, 100 = full attenuation = 0 amplitude.
-        max_ampl = 100  # [%]
-        ramp_down = ampl_ramp * max_ampl
-        ramp_down = [int(pUp) for pUp in ramp_down]
-
-        ramp_up = np.flip(ampl_ramp) * max_ampl
-        ramp_up = [int(pDown) for pDown in ramp_up]
-
-        self.gen.setPulseModulation(
-            ramp_up, min_ramp_temp_res,  # beginning
-            ramp_down, min_ramp_temp_res)  # end
-
-    def _get_ramping_amplitude(self, sequence, pulse_ramp_temp_res):
-        """
-        Gets the ramping array that has to be applied to the amplitude for the IGT ultrasound
-        driving system.
-
-        Parameters:
-            sequence (Sequence): The sequence object containing ultrasound parameters.
-            pulse_ramp_temp_res (float): temporal resolution for pulse ramping [ms].
-
-        Returns:
-            tuple: A tuple containing the amplitude ramping and step duration.
-        """
-
-        if sequence.pulse_ramp_shape == config['General']['Ramp shape.lin']:  # Linear ramping
-            # amount of points where ramping is applied
-            n_points = math.floor(sequence.pulse_ramp_dur/pulse_ramp_temp_res)
-            ampl_ramp = np.linspace(0, 1, n_points)
-
-        elif sequence.pulse_ramp_shape == config['General']['Ramp shape.tuk']:  # Tukey ramping
-            # amount of points where ramping is applied
-            n_points = math.floor(sequence.pulse_ramp_dur/pulse_ramp_temp_res)
-            alpha = 1
-            x = np.linspace(0, alpha/2, n_points)
-            ampl_ramp = np.zeros(n_points)
-            for i in range(n_points):
-                ampl_ramp[i] = 0.5 * (1 + math.cos((2*math.pi/alpha) * (x[i] - alpha/2)))
-
-        return ampl_ramp
+        return pulse
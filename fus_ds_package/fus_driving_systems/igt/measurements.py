@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2024 Margely Cornelissen, Stein Fekkes (Radboud University) and Erik Dumont (Image
+Guided Therapy)
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+**Attribution Notice**:
+If you use this kit in your research or project, please include the following attribution:
+Margely Cornelissen, Stein Fekkes (Radboud University, Nijmegen, The Netherlands) & Erik Dumont
+(Image Guided Therapy, Pessac, France) (2024), Radboud FUS measurement kit (version 0.8),
+https://github.com/Donders-Institute/Radboud-FUS-measurement-kit
+"""
+
+# Basis packages
+import collections
+import threading
+
+# Miscellaneous packages
+import numpy as np
+
+# Access the logger
+from fus_driving_systems.config.logging_config import logger
+
+# Measurement logging modes
+LOG_FULL = 'full'
+LOG_SUMMARY = 'summary'
+LOG_OFF = 'off'
+LOG_MODES = (LOG_FULL, LOG_SUMMARY, LOG_OFF)
+
+# Number of pulses waiting to be logged before measurements are skipped
+LOG_QUEUE_SIZE = 256
+
+# Labels and formats of the channel measures, the last column is the power
+CHANNEL_LABELS = {5: (('V', '%#4.3g V'), ('I', '%#4.3g A'), ('PhaseV/I', '%#4.3g°'),
+                      ('PhaseV/Vref', '%#5.4g°'), ('Freq', '%7d Hz'), ('Pow', '%#g W')),
+                  4: (('Vfwd', '%#4.3g V'), ('Vrev', '%#4.3g V'), ('PhaseV/Vref', '%#5.4g°'),
+                      ('Freq', '%7d Hz'), ('Pow', '%#g W'))}
+
+
+class MeasurementExtractor:
+    """
+    Class representing the extraction of the shared measurements of a pulse result into
+    preallocated arrays. The arrays are reused for every pulse with the same number of channels,
+    boards and measures, so consumers must copy the values they keep.
+
+    Attributes:
+        channels (np.ndarray): (channels x channel measures + power) float32 values of the last
+        pulse.
+        boards (np.ndarray): (boards x board measures) float32 values of the last pulse.
+    """
+
+    def __init__(self):
+        """
+        Initializes a MeasurementExtractor object.
+        """
+
+        self.channels = None
+        self.boards = None
+
+        self._channel_physical = None
+        self._board_physical = None
+
+    def _prepare(self, measures):
+        """
+        (Re)allocates the arrays and checks which measures have physical values when the layout of
+        the measurements changes.
+        """
+
+        n_channels = measures.channelCount()
+        n_measures = measures.channelMeasureCount()
+        if n_channels > 0 and n_measures > 0:
+            shape = (n_channels, n_measures + 1)
+            if self.channels is None or self.channels.shape != shape:
+                self.channels = np.empty(shape, dtype=np.float32)
+                self._channel_physical = [measures.physicalChannelMeasureAvailable(m)
+                                          for m in range(n_measures)]
+        else:
+            self.channels = None
+
+        n_boards = measures.boardCount()
+        n_measures = measures.boardMeasureCount()
+        if n_boards > 0 and n_measures > 0:
+            shape = (n_boards, n_measures)
+            if self.boards is None or self.boards.shape != shape:
+                self.boards = np.empty(shape, dtype=np.float32)
+                self._board_physical = [measures.physicalBoardMeasureAvailable(m)
+                                        for m in range(n_measures)]
+        else:
+            self.boards = None
+
+    def extract(self, measures):
+        """
+        Fills the arrays with the measurements of a pulse. Physical values are used when
+        available, raw values otherwise.
+
+        Parameters:
+            measures (unifus.SharedMeasurements): Measurements of a pulse result.
+
+        Returns:
+            tuple: Channel and board arrays, None if not measured.
+        """
+
+        self._prepare(measures)
+
+        if self.channels is not None:
+            n_channels, n_columns = self.channels.shape
+            for m in range(n_columns - 1):
+                getter = (measures.channelPhysicalValue if self._channel_physical[m]
+                          else measures.channelRawValue)
+                self.channels[:, m] = [getter(channel, m) for channel in range(n_channels)]
+            self.channels[:, -1] = [measures.power(channel) for channel in range(n_channels)]
+
+        if self.boards is not None:
+            n_boards, n_columns = self.boards.shape
+            for m in range(n_columns):
+                getter = (measures.boardPhysicalValue if self._board_physical[m]
+                          else measures.boardRawValue)
+                self.boards[:, m] = [getter(board, m) for board in range(n_boards)]
+
+        return self.channels, self.boards
+
+
+class MeasurementLog:
+    """
+    Class representing a consumer thread that formats and logs pulse measurements, so that the
+    listener thread only copies the values. When the consumer falls behind, measurements are
+    skipped and counted.
+
+    Attributes:
+        mode (str): Measurement logging mode, one of LOG_MODES.
+        logged (int): Number of logged pulses.
+        skipped (int): Number of pulses not logged because the queue was full.
+    """
+
+    def __init__(self, mode=LOG_SUMMARY, queue_size=LOG_QUEUE_SIZE):
+        """
+        Initializes a MeasurementLog object.
+
+        Parameters:
+            mode (str): Measurement logging mode, one of LOG_MODES.
+            queue_size (int): Number of pulses waiting to be logged before measurements are
+            skipped.
+        """
+
+        if mode not in LOG_MODES:
+            logger.error('Unknown measurement logging mode %s, choose from %s', mode,
+                         ', '.join(LOG_MODES))
+            mode = LOG_SUMMARY
+
+        self.mode = mode
+        self.queue_size = queue_size
+        self.logged = 0
+        self.skipped = 0
+
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        # Serializes starting and stopping the consumer thread
+        self._lock = threading.Lock()
+        self._stop = False
+        self._thread = None
+
+    def submit(self, exec_index, pulse_index, channels, boards):
+        """
+        Queues the measurements of a pulse for logging.
+
+        Parameters:
+            exec_index (int): Index of the execution.
+            pulse_index (int): Index of the pulse in the execution.
+            channels (np.ndarray): Channel measurements, None = not measured.
+            boards (np.ndarray): Board measurements, None = not measured.
+        """
+
+        if self.mode == LOG_OFF:
+            return
+
+        with self._lock, self._cond:
+            if len(self._queue) >= self.queue_size:
+                self.skipped += 1
+                return
+
+            self._queue.append((exec_index, pulse_index,
+                                None if channels is None else channels.copy(),
+                                None if boards is None else boards.copy()))
+
+            if self._thread is None:
+                self._stop = False
+                self._thread = threading.Thread(target=self._run, name='MeasurementLog',
+                                                daemon=True)
+                self._thread.start()
+
+            self._cond.notify()
+
+    def _run(self):
+        """
+        Logs the queued measurements until the log is stopped and the queue is empty.
+        """
+
+        while True:
+            with self._cond:
+                while not self._queue and not self._stop:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                item = self._queue.popleft()
+
+            if self.mode == LOG_FULL:
+                self._log_full(*item)
+            else:
+                self._log_summary(*item)
+            self.logged += 1
+
+    def _log_full(self, exec_index, pulse_index, channels, boards):
+        """
+        Logs every channel and board measurement of a pulse.
+        """
+
+        n_board_measures, n_boards = (0, 0) if boards is None else boards.shape[::-1]
+        n_channel_measures, n_channels = ((0, 0) if channels is None
+                                          else (channels.shape[1] - 1, channels.shape[0]))
+        logger.info("          Available: %d measures for %d board(s), %d measures for %d "
+                    "channel(s) (exec: %d, pulse: %d)", n_board_measures, n_boards,
+                    n_channel_measures, n_channels, exec_index, pulse_index)
+
+        if channels is not None:
+            fmt = ', '.join(label + '=' + value_fmt for label, value_fmt in
+                            channel_labels(n_channel_measures))
+            for channel, values in enumerate(channels):
+                logger.info("    ch[%d] " % channel + fmt % tuple(values))
+
+        if boards is not None:
+            for board, values in enumerate(boards):
+                logger.info("    board[%d] %s", board, ', '.join('%#g' % v for v in values))
+
+    def _log_summary(self, exec_index, pulse_index, channels, boards):
+        """
+        Logs the minimum, mean and maximum over the channels and boards of each measure. Board
+        measures have no names, so they are labelled with their measure index.
+        """
+
+        parts = []
+        if channels is not None:
+            for (label, _), values in zip(channel_labels(channels.shape[1] - 1), channels.T):
+                parts.append('%s=%#.4g/%#.4g/%#.4g' % (label, values.min(), values.mean(),
+                                                       values.max()))
+        if boards is not None:
+            for m, values in enumerate(boards.T):
+                parts.append('board M%d=%#.4g/%#.4g/%#.4g' % (m, values.min(), values.mean(),
+                                                               values.max()))
+
+        logger.info("    exec %d pulse %d (min/mean/max): %s", exec_index, pulse_index,
+                    ', '.join(parts))
+
+    def stop(self):
+        """
+        Logs the queued measurements and stops the consumer thread. Pulses submitted meanwhile
+        wait until the thread has stopped, and then start a new one.
+        """
+
+        with self._lock:
+            with self._cond:
+                thread = self._thread
+                self._stop = True
+                self._cond.notify()
+
+            if thread is not None:
+                thread.join()
+
+            self._thread = None
+
+        if self.skipped > 0:
+            logger.warning('Measurements of %d pulses were not logged, the log could not keep '
+                           'up', self.skipped)
+
+
+def channel_labels(n_measures):
+    """
+    Returns the labels and formats of the channel measures and the power.
+
+    Parameters:
+        n_measures (int): Number of channel measures.
+
+    Returns:
+        tuple: (label, format) per column of the channel measurements.
+    """
+
+    labels = CHANNEL_LABELS.get(n_measures)
+    if labels is None:
+        labels = tuple(('M%d' % m, '%#g') for m in range(n_measures)) + (('Pow', '%#g W'),)
+
+    return labels
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2024 Margely Cornelissen, Stein Fekkes (Radboud University) and Erik Dumont (Image
+Guided Therapy)
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+**Attribution Notice**:
+If you use this kit in your research or project, please include the following attribution:
+Margely Cornelissen, Stein Fekkes (Radboud University, Nijmegen, The Netherlands) & Erik Dumont
+(Image Guided Therapy, Pessac, France) (2024), Radboud FUS measurement kit (version 0.8),
+https://github.com/Donders-Institute/Radboud-FUS-measurement-kit
+"""
+
+# Miscellaneous packages
+import numpy as np
+
+# Access the logger
+from fus_driving_systems.config.logging_config import logger
+
+
+def dephasing_offsets(n_elements, dephasing_degree):
+    """
+    Returns the phase offsets used to dephase every nth element, for example 90 degrees with 4
+    elements: 1 elem: 0, 2 elem: 90, 3 elem: 180, 4 elem: 270 and the 5th element starts at 0 again.
+
+    Parameters:
+        n_elements (int): Number of elements.
+        dephasing_degree (float): The degree used to dephase n elements in one cycle.
+
+    Returns:
+        np.ndarray: (n_elements,) array of offsets [degrees].
+    """
+
+    # determine n elements to dephase in one cycle
+    nth_elem = round(360/dephasing_degree)
+    return (np.arange(n_elements) % nth_elem) * dephasing_degree
+
+
+def post_process_phases(phases, dephasing_degree=None, offsets=None, global_shift=0, wrap=True):
+    """
+    Applies the dephasing pattern, per-element calibration offsets and a global phase shift to
+    computed phases, and wraps the result into [0, 360).
+
+    Parameters:
+        phases (array-like): (N,) phases of one pulse or (M,N) phases of M pulses [degrees].
+        dephasing_degree (list(float)): The degree used to dephase n elements in one cycle.
+        None = no dephasing. Only the first entry is used.
+        offsets (array-like): (N,) calibration offset per element [degrees]. None = no offsets.
+        global_shift (float): Phase shift added to all elements [degrees].
+        wrap (bool): If True, the phases are wrapped into [0, 360).
+
+    Returns:
+        np.ndarray: Processed phases with the same shape as the input [degrees].
+    """
+
+    phases = np.array(phases, dtype=np.float64)
+    n_elements = phases.shape[-1]
+
+    if dephasing_degree is not None:
+        if len(dephasing_degree) > 1:
+            logger.warning('Too few or too many entries given at dephasing_degree.' +
+                           ' Only the first one is now used for dephasing purposes.')
+
+        phases += dephasing_offsets(n_elements, dephasing_degree[0])
+
+    if offsets is not None:
+        phases += np.asarray(offsets, dtype=np.float64)
+
+    if global_shift != 0:
+        phases += global_shift
+
+    if wrap:
+        np.mod(phases, 360.0, out=phases)
+
+    return phases
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2024 Margely Cornelissen, Stein Fekkes (Radboud University) and Erik Dumont (Image
+Guided Therapy)
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+**Attribution Notice**:
+If you use this kit in your research or project, please include the following attribution:
+Margely Cornelissen, Stein Fekkes (Radboud University, Nijmegen, The Netherlands) & Erik Dumont
+(Image Guided Therapy, Pessac, France) (2024), Radboud FUS measurement kit (version 0.8),
+https://github.com/Donders-Institute/Radboud-FUS-measurement-kit
+"""
+
+# Basis packages
+import hashlib
+import os
+
+# Miscellaneous packages
+import numpy as np
+
+# Own packages
+from fus_driving_systems.igt import transducerXYZ
+
+# Access the logger
+from fus_driving_systems.config.logging_config import logger
+from fus_driving_systems.config.config import get_cache_path
+
+FOCUS_STEP = 0.1  # [mm], resolution of the focal depth grid
+
+# Phase tables opened in this process, indexed by their cache key
+_tables = {}
+
+# Definition keys computed in this process, (size, mtime, key) indexed by normalized path
+_definition_keys = {}
+
+
+class PhaseTable:
+    """
+    Class representing the precomputed phases of a transducer for one operating frequency.
+
+    Attributes:
+        phases (np.ndarray): (n_foci, n_elements) memory-mapped array of phases [degrees].
+        min_foc (float): Focal depth of the first row [mm].
+        max_foc (float): Focal depth of the last row [mm].
+    """
+
+    def __init__(self, phases, min_foc, max_foc):
+        """
+        Initializes a PhaseTable object.
+
+        Parameters:
+            phases (np.ndarray): (n_foci, n_elements) array of phases [degrees].
+            min_foc (float): Focal depth of the first row [mm].
+            max_foc (float): Focal depth of the last row [mm].
+        """
+
+        self.phases = phases
+        self.min_foc = min_foc
+        self.max_foc = max_foc
+
+    def row_index(self, focus):
+        """
+        Returns the row index of the given focal depth.
+
+        Parameters:
+            focus (float): The focus value [mm].
+
+        Returns:
+            int: Row index, or None if the focus is not on the 0.1 mm grid of the table.
+        """
+
+        index = round((focus - self.min_foc) / FOCUS_STEP)
+        if index < 0 or index >= len(self.phases):
+            return None
+
+        if abs(self.min_foc + index*FOCUS_STEP - focus) > 1e-6:
+            return None
+
+        return index
+
+    def get_phases(self, focus):
+        """
+        Returns the phases of the given focal depth.
+
+        Parameters:
+            focus (float): The focus value [mm].
+
+        Returns:
+            np.ndarray: Phases per element [degrees], or None if the focus is not in the table.
+        """
+
+        index = self.row_index(focus)
+        if index is None:
+            return None
+
+        return self.phases[index]
+
+
+def definition_key(ini_path, revalidate=False):
+    """
+    Returns the key of a transducer definition file, consisting of the checksum embedded in the
+    file and a hash of the file content. The embedded checksum alone is not unique: the shipped
+    definition files share the same checksum line while their geometries differ. The file is not
+    parsed; the key is computed from the raw content once. Afterwards, the key of the definition
+    parsed by transducerXYZ or the key computed before is reused without accessing the file.
+
+    Parameters:
+        ini_path (str): Path to the transducer definition file.
+        revalidate (bool): True = compute the key again when the file size or modification time
+        changed since it was computed.
+
+    Returns:
+        str: Key of the transducer definition, or None if the file can not be read.
+    """
+
+    path = os.path.normcase(os.path.abspath(ini_path))
+
+    if not revalidate:
+        definition = transducerXYZ.cachedDefinition(path)
+        if definition is not None:
+            return ((definition.checksum or 'NOCHECKSUM') + '_' +
+                    definition.contentHash[:12])
+
+        if path in _definition_keys:
+            return _definition_keys[path][2]
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    cached = _definition_keys.get(path)
+    if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+        key = cached[2]
+    else:
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+        except OSError:
+            return None
+
+        # Same checksum and content hash as transducerXYZ.loadDefinition
+        checksum = ''
+        first_line = content.decode('utf-8-sig', errors='replace').lstrip().split('\n', 1)[0]
+        if first_line.strip().lower().startswith('checksum='):
+            checksum = first_line.split('=', 1)[1].strip()
+        key = (checksum or 'NOCHECKSUM') + '_' + hashlib.sha1(content).hexdigest().upper()[:12]
+        _definition_keys[path] = (stat.st_size, stat.st_mtime_ns, key)
+
+    return key
+
+
+def get_phase_table(ini_path, oper_freq_hz, natural_foc, min_foc, max_foc, cache_dir=None,
+                    revalidate=False):
+    """
+    Returns the phase table of a transducer definition and operating frequency. The table is
+    computed once for all foci between the minimum and maximum focus and is stored as a .npy file
+    in the cache folder, keyed by the checksum of the definition and the operating frequency.
+    Afterwards, the table is memory-mapped instead of recomputing the phases. The definition itself
+    is only parsed when the table has to be computed.
+
+    Parameters:
+        ini_path (str): Path to the transducer definition file.
+        oper_freq_hz (int): Operating frequency [Hz].
+        natural_foc (float): The natural focus value [mm] used to calculate target focus.
+        min_foc (float): Minimum focal depth of the transducer [mm].
+        max_foc (float): Maximum focal depth of the transducer [mm].
+        cache_dir (str): Folder to store the phase tables. None = cache path in the configuration.
+        revalidate (bool): True = check whether the definition file changed since its key was
+        computed, see definition_key().
+
+    Returns:
+        PhaseTable: The phase table.
+    """
+
+    if cache_dir is None:
+        cache_dir = get_cache_path()
+
+    # Foci are stored in units of the focus step to keep the file name free of decimal points
+    min_step = round(min_foc / FOCUS_STEP)
+    max_step = round(max_foc / FOCUS_STEP)
+    nat_step = round(natural_foc / FOCUS_STEP)
+    def_key = definition_key(ini_path, revalidate)
+    if def_key is None:
+        logger.error('Error: can not load the transducer definition from %s', ini_path)
+        return None
+
+    key = f'{def_key}_{int(oper_freq_hz)}Hz_nat{nat_step}_foc{min_step}-{max_step}'
+
+    if key in _tables:
+        return _tables[key]
+
+    table_path = os.path.join(cache_dir, 'phase_table_' + key + '.npy')
+    if not os.path.exists(table_path):
+        logger.info('Precompute phase table %s', table_path)
+
+        # The key follows the file on disk, so the parsed definition has to follow it as well
+        definition = transducerXYZ.loadDefinition(ini_path, revalidate=True)
+        if definition is None:
+            logger.error('Error: can not load the transducer definition from %s', ini_path)
+            return None
+
+        trans = transducerXYZ.Transducer()
+        trans.setDefinition(definition)
+
+        # Aim n mm away from the natural focal spot, on main axis (Z)
+        foci = np.arange(min_step, max_step + 1) * FOCUS_STEP
+        points = np.zeros((len(foci), 3))
+        points[:, 2] = natural_foc - foci
+        phases = trans.computePhasesBatch(points, oper_freq_hz)
+
+        # Write to a temporary file first so that other processes never read a partial table
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = table_path + f'.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, phases)
+        os.replace(tmp_path, table_path)
+
+    table = PhaseTable(np.load(table_path, mmap_mode='r'), min_step*FOCUS_STEP,
+                       max_step*FOCUS_STEP)
+    _tables[key] = table
+
+    return table
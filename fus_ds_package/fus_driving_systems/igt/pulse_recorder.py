@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2024 Margely Cornelissen, Stein Fekkes (Radboud University) and Erik Dumont (Image
+Guided Therapy)
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+**Attribution Notice**:
+If you use this kit in your research or project, please include the following attribution:
+Margely Cornelissen, Stein Fekkes (Radboud University, Nijmegen, The Netherlands) & Erik Dumont
+(Image Guided Therapy, Pessac, France) (2024), Radboud FUS measurement kit (version 0.8),
+https://github.com/Donders-Institute/Radboud-FUS-measurement-kit
+"""
+
+# Basis packages
+import json
+import os
+import threading
+import time
+
+# Miscellaneous packages
+import numpy as np
+
+# Access the logger
+from fus_driving_systems.config.logging_config import logger
+
+# Number of pulse results kept in memory until they are written
+RING_CAPACITY = 4096
+
+# Time between writes of the session writer [s]
+FLUSH_INTERVAL = 0.5
+
+SESSION_VERSION = 1
+HEADER_FILE = 'header.json'
+
+# Columns with one value per pulse
+SCALAR_COLUMNS = (('exec_index', np.int32), ('pulse_index', np.int32), ('duration', np.float32),
+                  ('ms_from_start', np.float64), ('has_channels', np.bool_),
+                  ('has_boards', np.bool_))
+
+# Columns with a measurement array per pulse, allocated when the first measurement is received
+MEASUREMENT_COLUMNS = ('channel_values', 'board_values')
+
+
+class PulseRing:
+    """
+    Class representing a preallocated ring buffer of pulse results. The listener thread appends
+    records and a writer drains them. When the writer falls behind, the oldest records are
+    overwritten and counted as dropped.
+
+    Attributes:
+        capacity (int): Maximum number of records kept in memory.
+        appended (int): Total number of appended records.
+        dropped (int): Number of records overwritten before they were drained.
+        dropped_measurements (int): Number of measurements ignored because their shape differs
+        from the first measurement.
+    """
+
+    def __init__(self, capacity=RING_CAPACITY):
+        """
+        Initializes a PulseRing object.
+
+        Parameters:
+            capacity (int): Maximum number of records kept in memory.
+        """
+
+        self.capacity = capacity
+        self.appended = 0
+        self.dropped = 0
+        self.dropped_measurements = 0
+
+        self._columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in SCALAR_COLUMNS}
+        self._drained = 0
+
+        self.cond = threading.Condition()
+
+    def _store_measurement(self, name, flag, index, values):
+        """
+        Stores a measurement array, allocating its column on first use.
+        """
+
+        if values is None:
+            self._columns[flag][index] = False
+            return
+
+        column = self._columns.get(name)
+        if column is None:
+            column = np.zeros((self.capacity,) + values.shape, dtype=np.float32)
+            self._columns[name] = column
+        elif column.shape[1:] != values.shape:
+            self.dropped_measurements += 1
+            self._columns[flag][index] = False
+            return
+
+        column[index] = values
+        self._columns[flag][index] = True
+
+    def append(self, exec_index, pulse_index, duration, ms_from_start, channels=None,
+               boards=None):
+        """
+        Appends the result of a pulse.
+
+        Parameters:
+            exec_index (int): Index of the execution.
+            pulse_index (int): Index of the pulse in the execution.
+            duration (float): Duration of the pulse [ms].
+            ms_from_start (float): Time of the pulse from the start of the execution [ms].
+            channels (np.ndarray): Channel measurements, None = not measured.
+            boards (np.ndarray): Board measurements, None = not measured.
+        """
+
+        with self.cond:
+            index = self.appended % self.capacity
+            self._columns['exec_index'][index] = exec_index
+            self._columns['pulse_index'][index] = pulse_index
+            self._columns['duration'][index] = duration
+            self._columns['ms_from_start'][index] = ms_from_start
+            self._store_measurement('channel_values', 'has_channels', index, channels)
+            self._store_measurement('board_values', 'has_boards', index, boards)
+
+            self.appended += 1
+            if self.appended - self._drained > self.capacity:
+                self.dropped += 1
+                self._drained += 1
+
+            self.cond.notify()
+
+    def _copy(self, start, stop):
+        """
+        Returns copies of the columns for the records in [start, stop).
+        """
+
+        first = start % self.capacity
+        count = stop - start
+        indices = np.arange(first, first + count) % self.capacity
+
+        return {name: column[indices] for name, column in self._columns.items()}
+
+    def drain(self):
+        """
+        Returns the records appended since the previous drain.
+
+        Returns:
+            dict: Column name mapped to a copy of its values, None if there are no new records.
+        """
+
+        with self.cond:
+            if self._drained == self.appended:
+                return None
+
+            records = self._copy(self._drained, self.appended)
+            self._drained = self.appended
+
+        return records
+
+    def snapshot(self):
+        """
+        Returns the records currently in memory without draining them, e.g. the most recent
+        pulses of an execution.
+
+        Returns:
+            dict: Column name mapped to a copy of its values.
+        """
+
+        with self.cond:
+            return self._copy(max(0, self.appended - self.capacity), self.appended)
+
+
+class SessionWriter:
+    """
+    Class representing a background thread that drains a pulse ring into a session folder with
+    one append-only binary file per column and a JSON header.
+
+    Attributes:
+        path (str): Session folder.
+        ring (PulseRing): The drained ring buffer.
+        count (int): Number of records written.
+    """
+
+    def __init__(self, path, ring, flush_interval=FLUSH_INTERVAL):
+        """
+        Initializes a SessionWriter object and starts its thread.
+
+        Parameters:
+            path (str): Session folder, created if it does not exist.
+            ring (PulseRing): The ring buffer to drain.
+            flush_interval (float): Time between writes [s].
+        """
+
+        self.path = path
+        self.ring = ring
+        self.flush_interval = flush_interval
+        self.count = 0
+
+        self._columns = {}
+        self._files = {}
+        self._stop = threading.Event()
+
+        os.makedirs(path, exist_ok=True)
+        self._write_header()
+
+        self._thread = threading.Thread(target=self._run, name='PulseSessionWriter', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        """
+        Writes the drained records until the writer is stopped.
+        """
+
+        while not self._stop.is_set():
+            with self.ring.cond:
+                self.ring.cond.wait(self.flush_interval)
+
+            # Collect more records before writing
+            self._stop.wait(self.flush_interval)
+            self._write(self.ring.drain())
+
+        self._write(self.ring.drain())
+
+    def _write(self, records):
+        """
+        Appends records to the column files and updates the header.
+        """
+
+        if records is None:
+            return
+
+        try:
+            n_records = len(records['exec_index'])
+            for name, values in records.items():
+                if name not in self._files:
+                    self._columns[name] = {'dtype': values.dtype.str,
+                                           'shape': list(values.shape[1:]),
+                                           'file': name + '.bin'}
+                    self._files[name] = open(os.path.join(self.path, name + '.bin'), 'ab')
+
+                    # Columns that appear later start with empty rows for the written records
+                    if self.count > 0:
+                        self._files[name].write(
+                            np.zeros((self.count,) + values.shape[1:], dtype=values.dtype).tobytes())
+
+                self._files[name].write(np.ascontiguousarray(values).tobytes())
+                self._files[name].flush()
+
+            self.count += n_records
+            self._write_header()
+
+        except OSError as e:
+            logger.error('Pulse results can not be written to %s: %s', self.path, e)
+
+    def _write_header(self):
+        """
+        Replaces the header, so that readers never see a partial header.
+        """
+
+        header = {'version': SESSION_VERSION,
+                  'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+                  'count': self.count,
+                  'dropped': self.ring.dropped,
+                  'dropped_measurements': self.ring.dropped_measurements,
+                  'columns': self._columns}
+
+        header_path = os.path.join(self.path, HEADER_FILE)
+        tmp_path = header_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(header, f, indent=1)
+        os.replace(tmp_path, header_path)
+
+    def stop(self):
+        """
+        Writes the remaining records, closes the column files and stops the thread.
+        """
+
+        self._stop.set()
+        with self.ring.cond:
+            self.ring.cond.notify_all()
+        self._thread.join()
+
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+        self._write_header()
+
+        if self.ring.dropped > 0:
+            logger.warning('%d pulse results were dropped before they could be written to %s',
+                           self.ring.dropped, self.path)
+
+
+class PulseSession:
+    """
+    Class representing a recorded session of pulse results. Columns are memory-mapped when they
+    are accessed for the first time.
+
+    Attributes:
+        path (str): Session folder.
+        header (dict): JSON header of the session.
+        columns (list): Names of the recorded columns.
+    """
+
+    def __init__(self, path):
+        """
+        Initializes a PulseSession object.
+
+        Parameters:
+            path (str): Session folder.
+        """
+
+        self.path = path
+        with open(os.path.join(path, HEADER_FILE)) as f:
+            self.header = json.load(f)
+
+        self.columns = list(self.header['columns'])
+        self._arrays = {}
+
+    def __len__(self):
+        return self.header['count']
+
+    def __getitem__(self, name):
+        """
+        Returns a read-only memory map of a column.
+
+        Parameters:
+            name (str): Name of the column.
+
+        Returns:
+            np.ndarray: (records x ...) values of the column.
+        """
+
+        array = self._arrays.get(name)
+        if array is None:
+            column = self.header['columns'][name]
+            shape = (len(self),) + tuple(column['shape'])
+            if len(self) == 0:
+                array = np.zeros(shape, dtype=column['dtype'])
+            else:
+                array = np.memmap(os.path.join(self.path, column['file']), mode='r',
+                                  dtype=column['dtype'], shape=shape)
+            self._arrays[name] = array
+
+        return array
+
+
+def load_session(path):
+    """
+    Returns a recorded session of pulse results.
+
+    Parameters:
+        path (str): Session folder.
+
+    Returns:
+        PulseSession: The session.
+    """
+
+    return PulseSession(path)
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2024 Margely Cornelissen, Stein Fekkes (Radboud University) and Erik Dumont (Image
+Guided Therapy)
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+**Attribution Notice**:
+If you use this kit in your research or project, please include the following attribution:
+Margely Cornelissen, Stein Fekkes (Radboud University, Nijmegen, The Netherlands) & Erik Dumont
+(Image Guided Therapy, Pessac, France) (2024), Radboud FUS measurement kit (version 0.8),
+https://github.com/Donders-Institute/Radboud-FUS-measurement-kit
+"""
+
+# Basis packages
+from functools import lru_cache
+import math
+
+# Miscellaneous packages
+import numpy as np
+
+# Own packages
+from fus_driving_systems import control_driving_system as ds
+from fus_driving_systems.config.config import config_info as config
+
+# Access the logger
+from fus_driving_systems.config.logging_config import logger
+
+# Best temporal resolution of the pulse modulation and maximum number of modulation steps
+MIN_RAMP_TEMP_RES = 0.005  # [ms]
+MAX_RAMP_STEPS = 1023
+
+# Standard deviation of the Gaussian ramp, relative to the ramp duration
+GAUSSIAN_SIGMA = 0.4
+
+# Pulse modulation that disables any modulation, as expected by setPulseModulation
+NO_MODULATION = ((), 0, (), 0)
+
+
+def ramp_temp_res(ramp_dur):
+    """
+    Returns the best temporal resolution of the pulse modulation for a ramp duration.
+
+    Parameters:
+        ramp_dur (float): Ramp duration [ms].
+
+    Returns:
+        float: Temporal resolution [ms].
+    """
+
+    if int(ramp_dur/MIN_RAMP_TEMP_RES) > MAX_RAMP_STEPS:
+        return ramp_dur/MAX_RAMP_STEPS
+
+    return MIN_RAMP_TEMP_RES
+
+
+def ramp_shapes():
+    """
+    Returns the ramp shapes supported by the IGT generator: the general ramp shapes and the
+    additional IGT ramp shapes.
+
+    Returns:
+        list: Ramp shape names.
+    """
+
+    return (config['General']['Ramp shapes'].split('\n') +
+            config['Equipment.Manufacturer.IGT']['Additional ramp shapes'].split('\n'))
+
+
+@lru_cache(maxsize=64)
+def ramp_envelope(ramp_shape, ramp_dur, temp_res):
+    """
+    Returns the attenuation during the ramp down, rising from 0 (full amplitude) to 1, one value
+    per modulation step. The ramp up is the reversed envelope.
+    Envelopes are memoized on shape, ramp duration and temporal resolution.
+
+    Parameters:
+        ramp_shape (str): Ramp shape, one of ramp_shapes().
+        ramp_dur (float): Ramp duration [ms].
+        temp_res (float): Temporal resolution of the envelope [ms].
+
+    Returns:
+        np.ndarray: Read-only envelope.
+    """
+
+    # amount of points where ramping is applied
+    n_points = math.floor(ramp_dur/temp_res)
+    t = np.linspace(0, 1, n_points)
+
+    if ramp_shape == config['General']['Ramp shape.lin']:
+        envelope = t
+
+    elif ramp_shape == config['General']['Ramp shape.tuk']:
+        # Tukey window with alpha = 1: taper over the full ramp
+        alpha = 1
+        x = np.linspace(0, alpha/2, n_points)
+        envelope = 0.5 * (1 + np.cos((2*np.pi/alpha) * (x - alpha/2)))
+
+    else:
+        # Rising half of a window; the attenuation during the ramp down is 1 - falling half
+        if ramp_shape == config['Equipment.Manufacturer.IGT']['Ramp shape.black']:
+            window = 0.42 - 0.5 * np.cos(np.pi * t) + 0.08 * np.cos(2 * np.pi * t)
+
+        elif ramp_shape == config['Equipment.Manufacturer.IGT']['Ramp shape.gauss']:
+            # Gaussian normalized to start at 0 and end at 1
+            window = np.exp(-0.5 * ((t - 1) / GAUSSIAN_SIGMA)**2)
+            window = (window - window[0]) / (1 - window[0]) if n_points > 1 else window
+
+        else:
+            logger.error(f'Ramp shape {ramp_shape} is not one of the implemented ramp shapes: ' +
+                         f'{ramp_shapes()}')
+            raise ds.DrivingSystemExit(f'Ramp shape {ramp_shape} is not implemented.')
+
+        envelope = 1 - window[::-1]
+
+    envelope.setflags(write=False)
+
+    return envelope
+
+
+@lru_cache(maxsize=64)
+def ramp_modulation(ramp_shape, ramp_dur):
+    """
+    Returns the pulse modulation of a ramp shape and duration. Values are attenuation in percent of
+    the full pulse amplitude: 0 = no attenuation = full amplitude, 100 = full attenuation =
+    0 amplitude. Modulations are memoized on shape and ramp duration.
+
+    Parameters:
+        ramp_shape (str): Ramp shape, one of ramp_shapes().
+        ramp_dur (float): Ramp duration [ms].
+
+    Returns:
+        tuple: Ramp up, ramp up step duration [ms], ramp down and ramp down step duration [ms]
+        as expected by setPulseModulation.
+    """
+
+    if ramp_shape == config['General']['Ramp shape.rect'] or ramp_dur <= 0:
+        return NO_MODULATION
+
+    temp_res = ramp_temp_res(ramp_dur)
+    envelope = ramp_envelope(ramp_shape, ramp_dur, temp_res)
+
+    # Note: ramp up and ramp down order are the other way around
+    # ramp up descends, ramp down ascends
+    max_ampl = 100  # [%]
+    ramp_down = (envelope * max_ampl).astype(int)
+    ramp_up = (envelope[::-1] * max_ampl).astype(int)
+
+    return (tuple(ramp_up.tolist()), temp_res,  # beginning
+            tuple(ramp_down.tolist()), temp_res)  # end
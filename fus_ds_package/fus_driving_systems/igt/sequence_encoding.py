@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2024 Margely Cornelissen, Stein Fekkes (Radboud University) and Erik Dumont (Image
+Guided Therapy)
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+**Attribution Notice**:
+If you use this kit in your research or project, please include the following attribution:
+Margely Cornelissen, Stein Fekkes (Radboud University, Nijmegen, The Netherlands) & Erik Dumont
+(Image Guided Therapy, Pessac, France) (2024), Radboud FUS measurement kit (version 0.8),
+https://github.com/Donders-Institute/Radboud-FUS-measurement-kit
+"""
+
+# Basis packages
+from collections import namedtuple
+
+# Size model of one pulse in an uploaded sequence: a fixed part (duration, delay and counts) and a
+# part per phase, frequency and amplitude value [bytes]. These are assumed sizes, the vendor API
+# does not report the size of an upload, so they only serve to compare both encodings.
+PULSE_HEADER_BYTES = 16
+VALUE_BYTES = 4
+
+# Identical consecutive pulses: the pulse object and the number of times it is repeated
+PulseRun = namedtuple('PulseRun', ['pulse', 'count'])
+
+
+class EncodedSequence:
+    """
+    Class representing a run-length encoded sequence: the pulses to upload together with the
+    repetition controls of the generator.
+
+    Attributes:
+        runs (list(PulseRun)): Runs of identical consecutive pulses in the uploaded sequence.
+        n_pulse_train_rep (int): Number of executions of the uploaded sequence.
+        pulse_train_delay (float): Delay between executions of the uploaded sequence [ms].
+        collapsed (bool): True if the pulse train is mapped onto the repetition controls.
+        n_pulses_expanded (int): Number of pulses of the pulse train uploaded pulse by pulse.
+    """
+
+    def __init__(self, runs, n_pulse_train_rep, pulse_train_delay, collapsed, n_pulses_expanded):
+        """
+        Initializes an EncodedSequence object.
+
+        Parameters:
+            runs (list(PulseRun)): Runs of identical consecutive pulses in the uploaded sequence.
+            n_pulse_train_rep (int): Number of executions of the uploaded sequence.
+            pulse_train_delay (float): Delay between executions of the uploaded sequence [ms].
+            collapsed (bool): True if the pulse train is mapped onto the repetition controls.
+            n_pulses_expanded (int): Number of pulses of the pulse train uploaded pulse by pulse.
+        """
+
+        self.runs = runs
+        self.n_pulse_train_rep = n_pulse_train_rep
+        self.pulse_train_delay = pulse_train_delay
+        self.collapsed = collapsed
+        self.n_pulses_expanded = n_pulses_expanded
+
+    @property
+    def n_pulses(self):
+        """
+        Returns the number of pulses in the uploaded sequence.
+
+        Returns:
+            int: Number of uploaded pulses.
+        """
+
+        return sum(run.count for run in self.runs)
+
+    def pulses(self):
+        """
+        Returns the uploaded sequence as a list of pulses, the format expected by the generator.
+
+        Returns:
+            list: Pulses of the uploaded sequence.
+        """
+
+        seq = []
+        for run in self.runs:
+            seq += run.count * [run.pulse]
+
+        return seq
+
+    def estimated_bytes(self, n_values, expanded=False):
+        """
+        Returns a model estimate of the upload size of the sequence, based on the assumed sizes
+        PULSE_HEADER_BYTES and VALUE_BYTES. It is not the measured number of uploaded bytes.
+
+        Parameters:
+            n_values (int): Number of phase, frequency and amplitude values per pulse.
+            expanded (bool): True = size when the pulse train is uploaded pulse by pulse.
+
+        Returns:
+            int: Model estimate of the upload size [bytes].
+        """
+
+        n_pulses = self.n_pulses_expanded if expanded else self.n_pulses
+        return n_pulses * (PULSE_HEADER_BYTES + VALUE_BYTES * n_values)
+
+    def __str__(self):
+        """
+        Returns a formatted string containing information about the encoded sequence.
+
+        Returns:
+            str: Formatted information about the encoded sequence.
+        """
+
+        info = ''
+        info += f"Run lengths: {[run.count for run in self.runs]} \n "
+        info += f"Uploaded pulses: {self.n_pulses} \n "
+        info += f"Executions of uploaded sequence: {self.n_pulse_train_rep} \n "
+        info += f"Delay between executions [ms]: {self.pulse_train_delay} \n "
+        info += f"Mapped onto repetition controls: {self.collapsed} \n "
+
+        return info
+
+
+def run_length_encode(pulses):
+    """
+    Encodes a list of pulses as runs of identical consecutive pulses. Pulses are identical when they
+    are the same object, as pulse objects of the generator can not be compared by value.
+
+    Parameters:
+        pulses (list): Pulses of a pulse train.
+
+    Returns:
+        list(PulseRun): Runs of identical consecutive pulses.
+    """
+
+    runs = []
+    for pulse in pulses:
+        if runs and runs[-1].pulse is pulse:
+            runs[-1] = PulseRun(pulse, runs[-1].count + 1)
+        else:
+            runs.append(PulseRun(pulse, 1))
+
+    return runs
+
+
+def encode_pulse_train(pulses, n_pulse_train_rep, pulse_train_delay, allow_collapse=True):
+    """
+    Encodes a pulse train and its repetitions. A pulse train of one run of identical pulses is
+    uploaded as a single pulse executed repeatedly by the generator when the timing allows it:
+    either the pulse trains directly follow each other (no delay between pulse trains), or the
+    pulse train is executed once. Otherwise, the pulse train is uploaded pulse by pulse.
+
+    Parameters:
+        pulses (list): Pulses of one pulse train.
+        n_pulse_train_rep (int): Number of executions of the pulse train.
+        pulse_train_delay (float): Delay between pulse trains [ms].
+        allow_collapse (bool): False = always upload the pulse train pulse by pulse, e.g. when
+        the repetition controls are used for triggering.
+
+    Returns:
+        EncodedSequence: The encoded sequence.
+    """
+
+    runs = run_length_encode(pulses)
+
+    if (allow_collapse and len(runs) == 1 and runs[0].count > 1
+            and (pulse_train_delay == 0 or n_pulse_train_rep == 1)):
+        return EncodedSequence([PulseRun(runs[0].pulse, 1)], runs[0].count * n_pulse_train_rep,
+                               0, True, len(pulses))
+
+    return EncodedSequence(runs, n_pulse_train_rep, pulse_train_delay, False, len(pulses))
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2024 Margely Cornelissen, Stein Fekkes (Radboud University) and Erik Dumont (Image
+Guided Therapy)
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+**Attribution Notice**:
+If you use this kit in your research or project, please include the following attribution:
+Margely Cornelissen, Stein Fekkes (Radboud University, Nijmegen, The Netherlands) & Erik Dumont
+(Image Guided Therapy, Pessac, France) (2024), Radboud FUS measurement kit (version 0.8),
+https://github.com/Donders-Institute/Radboud-FUS-measurement-kit
+"""
+
+# Basis packages
+from collections import OrderedDict
+import hashlib
+
+# Miscellaneous packages
+import numpy as np
+
+
+def fingerprint(*parts):
+    """
+    Returns a fingerprint of compiled sequence content. Numbers, strings, None and (nested) lists,
+    tuples and NumPy arrays are supported.
+
+    Parameters:
+        parts: Content of the compiled sequence, e.g. pulse durations, phases and modulation.
+
+    Returns:
+        str: SHA-1 of the content.
+    """
+
+    sha = hashlib.sha1()
+
+    def update(part):
+        if isinstance(part, np.ndarray):
+            sha.update(f'a{part.dtype.str}{part.shape}'.encode())
+            sha.update(np.ascontiguousarray(part).tobytes())
+        elif isinstance(part, (list, tuple)):
+            sha.update(f'l{len(part)}'.encode())
+            for item in part:
+                update(item)
+        else:
+            sha.update(f'{type(part).__name__}:{part!r};'.encode())
+
+    update(parts)
+
+    return sha.hexdigest().upper()
+
+
+class SlotEntry:
+    """
+    Class representing a sequence resident in a buffer slot of the generator.
+
+    Attributes:
+        fingerprint (str): Fingerprint of the compiled sequence content.
+        slot (int): Sequence number of the buffer slot on the generator.
+        n_pulse_train_rep (int): Number of executions of the uploaded sequence.
+        pulse_train_delay (float): Delay between executions of the uploaded sequence [ms].
+        total_duration_ms (float): Total duration of the execution [ms].
+        modulation (tuple): Pulse modulation applied during execution, None = no modulation.
+    """
+
+    def __init__(self, fingerprint, slot, n_pulse_train_rep, pulse_train_delay,
+                 total_duration_ms, modulation):
+        """
+        Initializes a SlotEntry object.
+        """
+
+        self.fingerprint = fingerprint
+        self.slot = slot
+        self.n_pulse_train_rep = n_pulse_train_rep
+        self.pulse_train_delay = pulse_train_delay
+        self.total_duration_ms = total_duration_ms
+        self.modulation = modulation
+
+
+class SlotManager:
+    """
+    Class mapping compiled sequence content to buffer slots of the generator. Content that is
+    already resident is not uploaded again; when all slots are in use, the least recently used slot
+    is reused. Pinned content, e.g. an armed or running sequence, is never replaced.
+
+    Attributes:
+        capacity (int): Number of buffer slots of the generator.
+        hits (int): Number of lookups of content that was resident.
+        misses (int): Number of lookups of content that had to be uploaded.
+        evictions (int): Number of resident sequences that were replaced.
+    """
+
+    def __init__(self, capacity):
+        """
+        Initializes a SlotManager object.
+
+        Parameters:
+            capacity (int): Number of buffer slots of the generator.
+        """
+
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # Resident entries indexed by fingerprint, least recently used first
+        self._entries = OrderedDict()
+
+        # Sequence numbers of the user mapped to fingerprints
+        self._seq_nums = {}
+
+    def clear(self):
+        """
+        Forgets all resident sequences, e.g. after (re)connecting to the generator. The counters
+        are kept.
+        """
+
+        self._entries.clear()
+        self._seq_nums.clear()
+
+    def lookup(self, fingerprint):
+        """
+        Returns the resident entry of the content and marks it as most recently used.
+
+        Parameters:
+            fingerprint (str): Fingerprint of the compiled sequence content.
+
+        Returns:
+            SlotEntry: The resident entry, or None if the content has to be uploaded.
+        """
+
+        entry = self._entries.get(fingerprint)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(fingerprint)
+
+        return entry
+
+    def allocate(self, fingerprint, n_pulse_train_rep, pulse_train_delay, total_duration_ms,
+                 modulation, pinned=()):
+        """
+        Returns a new entry for content that will be uploaded. When all slots are in use, the slot
+        of the least recently used entry that is not pinned is reused.
+
+        Parameters:
+            fingerprint (str): Fingerprint of the compiled sequence content.
+            n_pulse_train_rep (int): Number of executions of the uploaded sequence.
+            pulse_train_delay (float): Delay between executions of the uploaded sequence [ms].
+            total_duration_ms (float): Total duration of the execution [ms].
+            modulation (tuple): Pulse modulation applied during execution, None = no modulation.
+            pinned (iterable): Fingerprints of resident content that may not be replaced.
+
+        Returns:
+            SlotEntry: The entry with the slot to upload the content to, or None if all slots
+            are pinned.
+        """
+
+        self._entries.pop(fingerprint, None)
+
+        if len(self._entries) < self.capacity:
+            used = {entry.slot for entry in self._entries.values()}
+            slot = min(set(range(self.capacity)) - used)
+        else:
+            evicted = next((key for key in self._entries if key not in pinned), None)
+            if evicted is None:
+                return None
+
+            slot = self._entries.pop(evicted).slot
+            self.evictions += 1
+
+        entry = SlotEntry(fingerprint, slot, n_pulse_train_rep, pulse_train_delay,
+                          total_duration_ms, modulation)
+        self._entries[fingerprint] = entry
+
+        return entry
+
+    def bind(self, seq_num, fingerprint):
+        """
+        Maps a sequence number of the user to resident content.
+
+        Parameters:
+            seq_num (int): Sequence number of the user.
+            fingerprint (str): Fingerprint of the compiled sequence content.
+        """
+
+        self._seq_nums[seq_num] = fingerprint
+
+    def entry(self, seq_num):
+        """
+        Returns the resident entry of a sequence number of the user and marks it as most recently
+        used.
+
+        Parameters:
+            seq_num (int): Sequence number of the user.
+
+        Returns:
+            SlotEntry: The resident entry, or None if the sequence is not (anymore) resident.
+        """
+
+        fingerprint = self._seq_nums.get(seq_num)
+        if fingerprint is None or fingerprint not in self._entries:
+            return None
+
+        self._entries.move_to_end(fingerprint)
+
+        return self._entries[fingerprint]
+
+    def stats(self):
+        """
+        Returns the counters of the slot manager.
+
+        Returns:
+            dict: Hits, misses, evictions and number of resident sequences.
+        """
+
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'resident': len(self._entries)}
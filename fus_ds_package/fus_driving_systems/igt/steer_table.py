@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2024 Margely Cornelissen, Stein Fekkes (Radboud University) and Erik Dumont (Image
+Guided Therapy)
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+**Attribution Notice**:
+If you use this kit in your research or project, please include the following attribution:
+Margely Cornelissen, Stein Fekkes (Radboud University, Nijmegen, The Netherlands) & Erik Dumont
+(Image Guided Therapy, Pessac, France) (2024), Radboud FUS measurement kit (version 0.8),
+https://github.com/Donders-Institute/Radboud-FUS-measurement-kit
+"""
+
+# Basis packages
+import hashlib
+import os
+
+# Miscellaneous packages
+import numpy as np
+
+# Own packages
+from fus_driving_systems import control_driving_system as ds
+
+# Access the logger
+from fus_driving_systems.config.logging_config import logger
+from fus_driving_systems.config.config import get_cache_path
+
+# Tolerance used to match a focal depth with a distance of the steer table [mm]
+DISTANCE_TOL = 1e-6
+
+# Steer tables loaded in this process, indexed by normalized path: (mtime, size, SteerTable)
+_tables = {}
+
+
+class SteerTable:
+    """
+    Class representing a steer table with the phases per channel for each focal depth.
+
+    Attributes:
+        distances (np.ndarray): Sorted focal depths [mm].
+        phases (np.ndarray): (rows x channels) float32 array of phases [degrees].
+        file_hash (str): SHA-1 of the steer table file the table is converted from.
+    """
+
+    def __init__(self, distances, phases, file_hash):
+        """
+        Initializes a SteerTable object.
+
+        Parameters:
+            distances (np.ndarray): Sorted focal depths [mm].
+            phases (np.ndarray): (rows x channels) array of phases [degrees].
+            file_hash (str): SHA-1 of the steer table file the table is converted from.
+        """
+
+        self.distances = distances
+        self.phases = phases
+        self.file_hash = file_hash
+
+        # Phases unwrapped along the distance axis, computed on first interpolation
+        self._unwrapped = None
+
+    @property
+    def max_gap(self):
+        """
+        Returns the largest distance between two successive rows of the table [mm], which is the
+        largest gap an interpolated focal depth can be away from a tabulated one.
+
+        Returns:
+            float: Largest distance between successive rows [mm].
+        """
+
+        if len(self.distances) < 2:
+            return 0.0
+
+        return float(np.diff(self.distances).max())
+
+    def _bracket(self, depths):
+        """
+        Returns the indices of the rows above and below each focal depth.
+        """
+
+        upper = np.clip(np.searchsorted(self.distances, depths), 1, len(self.distances) - 1)
+        return upper, upper - 1
+
+    def interpolation_gaps(self, depths):
+        """
+        Returns, per requested focal depth, the distance between the two rows it is interpolated
+        from. Tabulated depths have a gap of 0 and depths outside the table (extrapolation) a gap
+        of infinity.
+
+        Parameters:
+            depths (array-like): Focal depths [mm].
+
+        Returns:
+            np.ndarray: Gap per focal depth [mm].
+        """
+
+        depths = np.atleast_1d(np.asarray(depths, dtype=np.float64))
+        if len(self.distances) < 2:
+            return np.where(np.abs(depths - self.distances[0]) <= DISTANCE_TOL, 0.0, np.inf)
+
+        upper, lower = self._bracket(depths)
+        gaps = self.distances[upper] - self.distances[lower]
+
+        exact = ((np.abs(self.distances[lower] - depths) <= DISTANCE_TOL) |
+                 (np.abs(self.distances[upper] - depths) <= DISTANCE_TOL))
+        gaps[exact] = 0.0
+
+        inside = ((depths >= self.distances[0] - DISTANCE_TOL) &
+                  (depths <= self.distances[-1] + DISTANCE_TOL))
+        gaps[~inside] = np.inf
+
+        return gaps
+
+    def interpolate(self, depths, n_channels=None, max_gap=None):
+        """
+        Returns the phases of the requested focal depths, linearly interpolated between the rows of
+        the table. Phases are circular: they are unwrapped along the distance axis before the
+        interpolation and wrapped into [0, 360) afterwards.
+
+        Parameters:
+            depths (array-like): Focal depths [mm].
+            n_channels (int): Number of channels to return. None = all channels of the table.
+            max_gap (float): Largest allowed distance between the rows a depth is interpolated
+            from [mm]. None = no limit. Depths outside the table are always rejected.
+
+        Returns:
+            np.ndarray: (depths x channels) array of phases [degrees].
+        """
+
+        depths = np.atleast_1d(np.asarray(depths, dtype=np.float64))
+        gaps = self.interpolation_gaps(depths)
+
+        rejected = np.isinf(gaps) if max_gap is None else gaps > max_gap + DISTANCE_TOL
+        if rejected.any():
+            logger.error(f'Focal depth(s) {depths[rejected].tolist()} can not be interpolated ' +
+                         f'from the steer table between {self.distances[0]} and ' +
+                         f'{self.distances[-1]} mm (maximum gap: {max_gap} mm)')
+            raise ds.DrivingSystemExit(f'Focal depth(s) {depths[rejected].tolist()} can not be ' +
+                                       'interpolated.')
+
+        if self._unwrapped is None:
+            self._unwrapped = np.unwrap(self.phases.astype(np.float64), period=360.0, axis=0)
+
+        if len(self.distances) < 2:
+            return np.mod(self._unwrapped[np.zeros(len(depths), dtype=int), :n_channels], 360.0)
+
+        upper, lower = self._bracket(depths)
+        weight = ((depths - self.distances[lower]) /
+                  (self.distances[upper] - self.distances[lower]))[:, np.newaxis]
+        weight = np.clip(weight, 0.0, 1.0)
+
+        phases = ((1 - weight) * self._unwrapped[lower, :n_channels] +
+                  weight * self._unwrapped[upper, :n_channels])
+
+        return np.mod(phases, 360.0)
+
+    def row_index(self, focus):
+        """
+        Returns the row index of the given focal depth.
+
+        Parameters:
+            focus (float): The focus value [mm].
+
+        Returns:
+            int: Row index, or None if the focus is not in the steer table.
+        """
+
+        index = int(np.searchsorted(self.distances, focus - DISTANCE_TOL))
+        if index == len(self.distances) or self.distances[index] > focus + DISTANCE_TOL:
+            return None
+
+        if index + 1 < len(self.distances) and self.distances[index+1] <= focus + DISTANCE_TOL:
+            logger.error('Duplicate foci %s found in steer table', focus)
+            raise ds.DrivingSystemExit(f'Duplicate foci {focus} found in steer table.')
+
+        return index
+
+    def get_phases(self, focus, n_channels=None):
+        """
+        Returns the phases of the given focal depth.
+
+        Parameters:
+            focus (float): The focus value [mm].
+            n_channels (int): Number of channels to return. None = all channels of the table.
+
+        Returns:
+            np.ndarray: Phases per channel [degrees], or None if the focus is not in the table.
+        """
+
+        index = self.row_index(focus)
+        if index is None:
+            return None
+
+        return self.phases[index, :n_channels].astype(np.float64)
+
+
+def _convert(excel_path):
+    """
+    Reads an Excel steer table: a 'Distance' column followed by one 'CH<n> Phase' column per
+    channel.
+
+    Parameters:
+        excel_path (str): Path to the Excel steer table.
+
+    Returns:
+        tuple: Sorted distances [mm] and (rows x channels) float32 phases [degrees].
+    """
+
+    # pandas is only needed to convert the table once
+    import pandas as pd
+
+    data = pd.read_excel(excel_path, engine='openpyxl')
+    channel_columns = [column for column in data.columns[1:] if str(column).startswith('CH')]
+
+    distances = data['Distance'].to_numpy(dtype=np.float64)
+    phases = data[channel_columns].to_numpy(dtype=np.float32)
+
+    order = np.argsort(distances, kind='stable')
+    return distances[order], np.ascontiguousarray(phases[order])
+
+
+def load_steer_table(excel_path, cache_dir=None):
+    """
+    Returns the steer table of an Excel file. On first use, the Excel file is converted into a
+    binary .npz file in the cache folder, keyed by the hash of the Excel file. The table is only
+    reloaded when the modification time or size of the Excel file changes.
+
+    Parameters:
+        excel_path (str): Path to the Excel steer table.
+        cache_dir (str): Folder to store the converted tables. None = cache path in the
+        configuration.
+
+    Returns:
+        SteerTable: The steer table.
+    """
+
+    path = os.path.normcase(os.path.abspath(excel_path))
+    stat = os.stat(path)
+
+    cached = _tables.get(path)
+    if cached is not None and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+        return cached[2]
+
+    if cache_dir is None:
+        cache_dir = get_cache_path()
+
+    with open(path, 'rb') as f:
+        file_hash = hashlib.sha1(f.read()).hexdigest().upper()
+
+    cache_path = os.path.join(cache_dir, 'steer_table_' + file_hash + '.npz')
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as data:
+            distances = data['distances']
+            phases = data['phases']
+    else:
+        logger.info('Convert steer table %s to %s', excel_path, cache_path)
+        distances, phases = _convert(path)
+
+        # Write to a temporary file first so that other processes never read a partial table
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = cache_path + f'.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, distances=distances, phases=phases)
+        os.replace(tmp_path, cache_path)
+
+    table = SteerTable(distances, phases, file_hash)
+    _tables[path] = (stat.st_mtime, stat.st_size, table)
+
+    return table
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2024 Margely Cornelissen, Stein Fekkes (Radboud University) and Erik Dumont (Image
+Guided Therapy)
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+**Attribution Notice**:
+If you use this kit in your research or project, please include the following attribution:
+Margely Cornelissen, Stein Fekkes (Radboud University, Nijmegen, The Netherlands) & Erik Dumont
+(Image Guided Therapy, Pessac, France) (2024), Radboud FUS measurement kit (version 0.8),
+https://github.com/Donders-Institute/Radboud-FUS-measurement-kit
+"""
+
+# Basis packages
+import sys
+
+# Miscellaneous packages
+import numpy as np
+
+# Own packages
+from fus_driving_systems.igt import transducerXYZ
+
+# Access the logger
+from fus_driving_systems.config.logging_config import logger
+
+# Number of targets computed per batch when filling the grid, limits the temporary memory usage
+BATCH_SIZE = 4096
+
+
+class SteeringPlanner:
+    """
+    Class containing precomputed phases over a 3D grid of targets inside the steering envelope
+    (xRange, yRange and zRange) declared in a transducer definition file. Phases of arbitrary
+    targets inside the envelope are obtained by a nearest-neighbour or trilinear lookup.
+
+    The returned phases can be used to aim off-axis by setting them as dephasing_degree of a
+    sequence: a list with one entry per element overrides the phases based on the focus.
+
+    Targets are cartesian coordinates (x, y, z) in mm in the transducer space: origin at the
+    natural focal point, Z axis toward the transducer.
+
+    Attributes:
+        oper_freq_hz (int): Operating frequency [Hz].
+        axes (tuple(np.ndarray)): Grid coordinates along x, y and z [mm].
+        step_mm (float): Grid resolution [mm].
+        phases (np.ndarray): (nx, ny, nz, n_elements) array of phases [degrees].
+    """
+
+    def __init__(self, trans, oper_freq_hz, step_mm=1.0):
+        """
+        Initializes a SteeringPlanner object and precomputes the phases of all grid targets.
+
+        Parameters:
+            trans (transducerXYZ.Transducer): Loaded transducer definition.
+            oper_freq_hz (int): Operating frequency [Hz].
+            step_mm (float): Grid resolution [mm].
+        """
+
+        ranges = (trans.xRange, trans.yRange, trans.zRange)
+        if None in ranges:
+            logger.error('Steering envelope (xRange, yRange and zRange) is not declared in the ' +
+                         'transducer definition.')
+            sys.exit()
+
+        self.oper_freq_hz = oper_freq_hz
+        self.step_mm = step_mm
+        self.ranges = ranges
+        self.axes = tuple(self._grid_axis(low, high, step_mm) for low, high in ranges)
+
+        grid = np.stack(np.meshgrid(*self.axes, indexing='ij'), axis=-1).reshape(-1, 3)
+
+        phases = np.empty((len(grid), trans.channelCount()), dtype=np.float32)
+        for start in range(0, len(grid), BATCH_SIZE):
+            stop = start + BATCH_SIZE
+            phases[start:stop] = trans.computePhasesBatch(grid[start:stop], oper_freq_hz)
+
+        self.phases = phases.reshape(tuple(len(axis) for axis in self.axes) + (-1,))
+
+        logger.info(f'Steering grid of {len(grid)} targets precomputed for ' +
+                    f'{trans.channelCount()} elements at {oper_freq_hz} Hz')
+
+    @classmethod
+    def from_definition(cls, ini_path, oper_freq_hz, step_mm=1.0):
+        """
+        Creates a SteeringPlanner from a transducer definition file.
+
+        Parameters:
+            ini_path (str): Path to the transducer definition file.
+            oper_freq_hz (int): Operating frequency [Hz].
+            step_mm (float): Grid resolution [mm].
+
+        Returns:
+            SteeringPlanner: The steering planner.
+        """
+
+        trans = transducerXYZ.Transducer()
+        if not trans.load(ini_path):
+            logger.error('Error: can not load the transducer definition from %s', ini_path)
+            sys.exit()
+
+        return cls(trans, oper_freq_hz, step_mm)
+
+    @staticmethod
+    def _grid_axis(low, high, step_mm):
+        """
+        Returns the grid coordinates between low and high, both included [mm].
+        """
+
+        n_points = int(round((high - low) / step_mm)) + 1
+        return np.linspace(low, high, n_points)
+
+    def in_envelope(self, point_mm):
+        """
+        Checks whether the target is inside the steering envelope.
+
+        Parameters:
+            point_mm (tuple): Cartesian coordinates (x, y, z) of the target [mm].
+
+        Returns:
+            bool: True if the target is inside the envelope, False otherwise.
+        """
+
+        return all(low - 1e-9 <= value <= high + 1e-9
+                   for value, (low, high) in zip(point_mm, self.ranges))
+
+    def get_phases(self, point_mm, method='trilinear'):
+        """
+        Returns the phases needed to aim at the given target.
+
+        Parameters:
+            point_mm (tuple): Cartesian coordinates (x, y, z) of the target [mm].
+            method (str): 'nearest' or 'trilinear'.
+
+        Returns:
+            np.ndarray: Phases per element [degrees], in [0,360).
+        """
+
+        if not self.in_envelope(point_mm):
+            logger.error(f'Target {tuple(point_mm)} is outside of the steering envelope ' +
+                         f'x: {self.ranges[0]}, y: {self.ranges[1]}, z: {self.ranges[2]}.')
+            sys.exit()
+
+        if method == 'nearest':
+            index = tuple(int(np.abs(axis - value).argmin())
+                          for axis, value in zip(self.axes, point_mm))
+            return self.phases[index].astype(np.float64)
+
+        elif method == 'trilinear':
+            return self._trilinear(point_mm)
+
+        logger.error(f'Unknown lookup method {method}, use nearest or trilinear.')
+        sys.exit()
+
+    def _trilinear(self, point_mm):
+        """
+        Interpolates the phases of the eight surrounding grid targets. Phases are circular, so the
+        unit phasors are interpolated and converted back to an angle.
+        """
+
+        lower = []
+        weights = []
+        for axis, value in zip(self.axes, point_mm):
+            if len(axis) == 1:
+                lower.append(0)
+                weights.append(0.0)
+                continue
+            # The linspace spacing can differ from step_mm, so locate the value on the axis itself
+            index = int(np.searchsorted(axis, value, side='right')) - 1
+            index = min(max(index, 0), len(axis) - 2)
+            lower.append(index)
+            weights.append(min(max((value - axis[index]) / (axis[index+1] - axis[index]), 0.0),
+                               1.0))
+
+        # Select the 2x2x2 neighbourhood (or less along axes without steering range)
+        cube = self.phases[tuple(slice(i, i + 2) for i in lower)]
+        phasors = np.exp(1j * np.deg2rad(cube.astype(np.float64)))
+        for w in weights:
+            if phasors.shape[0] == 2:
+                phasors = (1 - w) * phasors[0] + w * phasors[1]
+            else:
+                phasors = phasors[0]
+
+        return np.mod(np.rad2deg(np.angle(phasors)), 360.0)
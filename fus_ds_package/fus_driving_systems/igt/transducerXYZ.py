@@ -43,12 +43,13 @@ https://github.com/Donders-Institute/Radboud-FUS-measurement-kit
 
 # Access the logger
 from fus_driving_systems.config.logging_config import logger
-import sys
+from fus_driving_systems.igt import phase_processing
+import hashlib
+import os
 import math
-try:  # for Python 2/3 compatibility
-    from StringIO import StringIO
-except ImportError:
-    from io import StringIO
+
+import numpy as np
+
 try:  # for Python 2/3 compatibility
     import ConfigParser as cfg
 except ImportError:
@@ -58,6 +59,140 @@ except ImportError:
 SOUND_SPEED_WATER = 1500.0  # sound speed in water, m.s-1
 TWO_PI = 2.0 * math.pi      # 2 pi, rad
 
+# Process-wide cache of parsed definitions, indexed by normalized file path
+_definitions = {}
+
+
+def phaseKernel(elements, points, wavelens):
+    """
+    Computes the phases necessary to aim at each of the specified points, for all channels at once.
+        :param elements: (N,3) array = cartesian coordinates (in m) of the elements
+        :param points: (M,3) array = cartesian coordinates (in m) of the targets
+        :param wavelens: wavelength (in m), either one value for all channels or a (N,) array
+        :return: (M,N) array of phases in degrees, in [0,360)
+    """
+    diff = points[:, np.newaxis, :] - elements[np.newaxis, :, :]
+    dist = np.sqrt(np.einsum('mnk,mnk->mn', diff, diff))
+    rem = np.modf(dist / wavelens)[0]  # take fractional part
+    return rem * 360.0
+
+
+class TransducerDefinition(object):
+    """
+    An immutable, parsed transducer definition file.
+        path: normalized path of the definition file
+        mtime: modification time of the file when it was parsed
+        checksum: checksum embedded in the file ('' if absent)
+        contentHash: SHA-1 of the file content; the embedded checksum is not unique per geometry
+        name, serial: identification of the transducer
+        focalLength: natural focal length (in mm)
+        defaultFrequency: default frequency (in Hz)
+        maxAmplitude: maximum amplitude
+        shootingDirection, xRange, yRange, zRange: see Transducer
+        elements: read-only (N,3) float64 array = element positions (in m)
+    """
+
+    def __init__(self, path, mtime, checksum, contentHash, trans):
+        self.path = path
+        self.mtime = mtime
+        self.checksum = checksum
+        self.contentHash = contentHash
+        self.name = trans.name
+        self.serial = trans.serial
+        self.focalLength = trans.focalLength
+        self.defaultFrequency = trans.defaultFrequency
+        self.maxAmplitude = trans.maxAmplitude
+        self.shootingDirection = trans.shootingDirection
+        self.xRange = trans.xRange
+        self.yRange = trans.yRange
+        self.zRange = trans.zRange
+        self.elements = trans.elements
+        self.elements.setflags(write=False)
+
+    def channelCount(self):
+        """Returns the number of channels / elements."""
+        return len(self.elements)
+
+
+def _parseDefinition(path):
+    """Reads and parses a definition file once, returns a TransducerDefinition or None."""
+    try:
+        with open(path, "rb") as f:
+            content = f.read()
+        mtime = os.path.getmtime(path)
+    except IOError as e:
+        print("Error: "+str(e))
+        return None
+
+    text = content.decode("utf-8-sig")
+
+    # the checksum trick places a line before the first section, which raises a
+    # ConfigParser.MissingSectionHeaderError, so only the text from the first section is parsed
+    checksum = ""
+    first_line = text.lstrip().split("\n", 1)[0].strip()
+    if first_line.lower().startswith("checksum="):
+        checksum = first_line.split("=", 1)[1].strip()
+    start = text.find("[")
+    if start < 0:
+        print("Error: empty content")
+        return None
+
+    trans = Transducer()
+    if not trans.loadFromString(text[start:]):
+        return None
+
+    return TransducerDefinition(path, mtime, checksum, hashlib.sha1(content).hexdigest().upper(),
+                                trans)
+
+
+def loadDefinition(filename, revalidate=False):
+    """
+    Returns the parsed definition of a transducer definition file. Each file is parsed once per
+    process; later calls are served from memory without accessing the file system.
+        :param filename: path of the transducer definition file
+        :param revalidate: if True, the file is reparsed (and its checksum read again) when its
+        modification time changed since it was parsed
+        :return: TransducerDefinition, or None if the file can not be loaded
+    """
+    path = os.path.normcase(os.path.abspath(filename))
+    definition = _definitions.get(path)
+
+    if definition is not None and revalidate:
+        try:
+            if os.path.getmtime(path) != definition.mtime:
+                definition = None
+        except OSError:
+            definition = None
+
+    if definition is None:
+        definition = _parseDefinition(path)
+
+    if definition is None:
+        _definitions.pop(path, None)
+    else:
+        _definitions[path] = definition
+    return definition
+
+
+def cachedDefinition(filename):
+    """
+    Returns the parsed definition of a transducer definition file if it is in the process-wide
+    cache, without accessing the file system.
+        :param filename: path of the transducer definition file
+        :return: TransducerDefinition, or None if the file has not been parsed yet
+    """
+    return _definitions.get(os.path.normcase(os.path.abspath(filename)))
+
+
+def invalidateDefinitions(filename=None):
+    """
+    Removes a definition file from the process-wide cache, or all definitions if None.
+    """
+    if filename is None:
+        _definitions.clear()
+    else:
+        _definitions.pop(os.path.normcase(os.path.abspath(filename)), None)
+
 
 class Transducer(object):
     """
@@ -70,49 +205,54 @@ class Transducer(object):
     """
 
     def __init__(self):
-        # self.name = ""
-        # self.focalLength = 0
-        self.elements = []
+        self.name = ""
+        self.serial = ""
+        self.focalLength = 0
+        self.defaultFrequency = 0
+        self.maxAmplitude = 0
+        self.shootingDirection = (0.0, 0.0, -1.0)
+        # steering ranges (min, max) in mm in transducer space, None = not declared
+        self.xRange = None
+        self.yRange = None
+        self.zRange = None
+        self.elements = np.empty((0, 3), dtype=np.float64)
 
     def load(self, filename):
-        # config = cfg.ConfigParser()
-        # this easy version can not be used because of the checksum trick
-        # that raises a ConfigParser.MissingSectionHeaderError
-        # if config.read (filename) == []:
-        #    return False
-        # return self._loadConfig (config)
-        text = ""
-        outside = True
-        try:
-            with open(filename, "r") as f:
-                for line in f:
-                    if line.strip() == "":
-                        continue
-                    if outside:
-                        if line.strip()[0] == "[":
-                            text += line
-                            outside = False
-                        continue
-                    text += line
-            return self.loadFromString(text)
-        except IOError as e:
-            print("Error: "+str(e))
+        """
+        Loads the definition file, using the process-wide cache of parsed definitions.
+            :param filename: path of the transducer definition file
+            :return: True if loaded, False otherwise
+        """
+        definition = loadDefinition(filename)
+        if definition is None:
             return False
+        self.setDefinition(definition)
+        return True
+
+    def setDefinition(self, definition):
+        """Copies the metadata and (read-only) geometry of a parsed TransducerDefinition."""
+        self.name = definition.name
+        self.serial = definition.serial
+        self.focalLength = definition.focalLength
+        self.defaultFrequency = definition.defaultFrequency
+        self.maxAmplitude = definition.maxAmplitude
+        self.shootingDirection = definition.shootingDirection
+        self.xRange = definition.xRange
+        self.yRange = definition.yRange
+        self.zRange = definition.zRange
+        self.elements = definition.elements
 
     def loadFromString(self, definition):
         config = cfg.ConfigParser()
-        stringio = StringIO(definition)
-        if config.readfp(stringio) == []:
+        config.read_string(definition)
+        if config.sections() == []:
             print("Error: empty content")
             return False
         return self._loadConfig(config)
 
     def _loadConfig(self, config):
         size = 0
-        # self.name = ""
         try:
-            # self.name = config.get ("transducer", "name")
-            # self.focalLength = config.getfloat ("transducer", "focalLength") / 1000.0
             size = config.getint("elements", "size")
         except:
             print("Error: missing 'elements.size' parameter")
@@ -121,20 +261,54 @@ class Transducer(object):
             print("Error: size is 0")
             return False
 
-        self.elements = []
+        # optional description of the transducer and its steering envelope
+        try:
+            self.name = config.get("transducer", "name", fallback="")
+            self.serial = config.get("transducer", "serial", fallback="")
+            self.focalLength = config.getfloat("transducer", "focalLength", fallback=0)
+            self.defaultFrequency = config.getint("transducer", "defaultFrequency", fallback=0)
+            self.maxAmplitude = config.getint("transducer", "maxAmplitude", fallback=0)
+            direction = config.get("transducer", "shootingDirection", fallback=None)
+            if direction is not None:
+                self.shootingDirection = self._parseValues(direction, 3)
+            self.xRange = self._parseRange(config, "xRange")
+            self.yRange = self._parseRange(config, "yRange")
+            self.zRange = self._parseRange(config, "zRange")
+        except Exception as ex:
+            print("Error: "+str(ex))
+            return False
+
+        elements = np.empty((size, 3), dtype=np.float64)
         for i in range(1, 1+size):
             try:
                 elem = config.get("elements", "%d" % i).strip()
                 coords = elem.split("|")
-                # read coordinates in mm (convert them in m)
-                item = (float(coords[0])/1000.0, float(coords[1])/1000.0, float(coords[2])/1000.0)
-                self.elements.append(item)
+                # read coordinates in mm
+                elements[i-1] = (float(coords[0]), float(coords[1]), float(coords[2]))
             except Exception as ex:
                 print("Error: "+str(ex))
                 return False
 
+        # convert them in m, stored as a contiguous (N,3) array
+        self.elements = np.ascontiguousarray(elements / 1000.0)
         return True
 
+    @staticmethod
+    def _parseValues(text, count):
+        """Parses a 'a|b|c' string into a tuple of count floats."""
+        values = tuple(float(v) for v in text.strip().split("|"))
+        if len(values) != count:
+            raise ValueError("expected %d values in '%s'" % (count, text))
+        return values
+
+    def _parseRange(self, config, option):
+        """Reads a 'min|max' steering range (in mm) of the transducer section, if declared."""
+        text = config.get("transducer", option, fallback=None)
+        if text is None:
+            return None
+        low, high = self._parseValues(text, 2)
+        return (min(low, high), max(low, high))
+
     def channelCount(self):
         """Returns the number of channels / elements."""
         return len(self.elements)
@@ -159,44 +333,15 @@ class Transducer(object):
                   "computePhases().")
             return False
         if freqCount == 1:
-            wavelen = SOUND_SPEED_WATER / pulse.frequency(0)
+            frequencies = pulse.frequency(0)
         elif freqCount != self.channelCount():
             print("Error: bad number of frequencies (%d in pulse, %d elements in transducer)"
                   % (freqCount, self.channelCount()))
             return False
+        else:
+            frequencies = [pulse.frequency(i) for i in range(freqCount)]
 
-        phases = [0.0] * self.channelCount()
-        x = point_mm[0] / 1000.0
-        y = point_mm[1] / 1000.0
-        z = point_mm[2] / 1000.0
-
-        for i in range(self.channelCount()):
-            elem = self.elements[i]
-            if freqCount > 1:
-                wavelen = SOUND_SPEED_WATER / pulse.frequency(i)
-            dist = math.sqrt(math.pow(elem[0]-x, 2) + math.pow(elem[1]-y, 2) +
-                             math.pow(elem[2]-z, 2))
-            rem = math.modf(dist / wavelen)[0]  # take fractional part
-            phases[i] = rem * 360.0
-
-        if dephasing_degree is not None:
-            if len(dephasing_degree) > 1:
-                logger.error('Too few or too many entries given at dephasing_degree.' +
-                             ' Only the first one is now used for dephasing purposes.')
-                sys.exit()
-
-            dephasing_degree = dephasing_degree[0]
-
-            # determine n elements to dephase in one cycle
-            nth_elem = round(360/dephasing_degree)
-            dephasing_elem = 0
-            for i in range(len(phases)):
-                # Add chosen degrees to dephase signal
-                phases[i] = phases[i] + dephasing_degree*dephasing_elem
-
-                dephasing_elem = dephasing_elem + 1
-                if dephasing_elem == nth_elem:
-                    dephasing_elem = 0
+        phases = self.computePhasesBatch([point_mm], frequencies, dephasing_degree)[0].tolist()
 
         phases_str = ', '.join([format(x, '.2f') for x in phases])
         natural_foc = set_focus_mm + point_mm[2]
@@ -205,3 +350,25 @@ class Transducer(object):
 
         pulse.setPhases(phases)
         return True
+
+    def computePhasesBatch(self, points_mm, frequencies, dephasing_degree=None):
+        """
+        Computes the phases necessary to aim at each of the specified points in one pass.
+            :param points_mm: M 3-tuples (x,y,z) or a (M,3) array = cartesian coordinates (in mm) of
+            the targets, in the transducer space
+            :param frequencies: frequency (in Hz), either one value for all channels or one value per
+            channel
+            :dephasing_degree (list(float)): The degree used to dephase n elements in one cycle.
+            None = no dephasing. Only the first entry is used.
+            :return: (M,N) array of phases in degrees in [0,360), one row per target
+        """
+
+        points = np.asarray(points_mm, dtype=np.float64).reshape(-1, 3) / 1000.0
+        wavelens = SOUND_SPEED_WATER / np.asarray(frequencies, dtype=np.float64)
+
+        phases = phaseKernel(self.elements, points, wavelens)
+
+        if dephasing_degree is not None:
+            phases = phase_processing.post_process_phases(phases, dephasing_degree)
+
+        return phases
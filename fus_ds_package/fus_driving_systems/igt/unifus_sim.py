@@ -0,0 +1,625 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2024 Margely Cornelissen, Stein Fekkes (Radboud University) and Erik Dumont (Image
+Guided Therapy)
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+**Attribution Notice**:
+If you use this kit in your research or project, please include the following attribution:
+Margely Cornelissen, Stein Fekkes (Radboud University, Nijmegen, The Netherlands) & Erik Dumont
+(Image Guided Therapy, Pessac, France) (2024), Radboud FUS measurement kit (version 0.8),
+https://github.com/Donders-Institute/Radboud-FUS-measurement-kit
+"""
+
+# Pure-Python simulator of the part of the unifus module used by the IGT driving system. The
+# module mirrors the unifus API, so that it can be used in place of the Windows-only unifus.pyd
+# (see the 'Unifus backend' key in the configuration). Listener events are sent from a background
+# thread with configurable timing and synthetic channel and board measurements.
+
+# Basis packages
+import enum
+import json
+import math
+import queue
+import threading
+import time
+
+# Miscellaneous packages
+import numpy as np
+
+# Access the logger
+from fus_driving_systems.config.logging_config import logger
+
+# Channel count when the configuration file does not define the units
+DEFAULT_CHANNEL_COUNT = 128
+
+# Channels per board of the simulated generator
+CHANNELS_PER_BOARD = 64
+
+# Error code of a stopped sequence
+ERROR_STOPPED = 1
+
+
+class SimSettings:
+    """
+    Class representing the timing and measurements of the simulated generator. The durations
+    are in milliseconds of simulated time, which runs time_scale times slower than real time.
+
+    Attributes:
+        time_scale (float): Real time per simulated time, 0 = no waiting.
+        connect_ms (float): Duration of a connection.
+        disconnect_ms (float): Duration of a disconnection.
+        upload_base_ms (float): Fixed duration of a sequence upload.
+        upload_us_per_value (float): Duration of the upload per phase, frequency and amplitude.
+        prepare_ms (float): Duration of the preparation of a sequence.
+        start_latency_ms (float): Time between the start and the first pulse.
+        max_voltage (float): Channel voltage at 100 % amplitude [V].
+        impedance (float): Mean impedance of the channels [Ohm].
+        impedance_spread (float): Standard deviation of the impedance between channels [Ohm].
+        noise (float): Relative measurement noise.
+        seed (int): Seed of the synthetic measurements.
+    """
+
+    def __init__(self):
+        """
+        Initializes a SimSettings object with the default timing.
+        """
+
+        self.time_scale = 1.0
+        self.connect_ms = 200.0
+        self.disconnect_ms = 20.0
+        self.upload_base_ms = 5.0
+        self.upload_us_per_value = 0.2
+        self.prepare_ms = 1.0
+        self.start_latency_ms = 0.5
+        self.max_voltage = 60.0
+        self.impedance = 50.0
+        self.impedance_spread = 2.0
+        self.noise = 0.01
+        self.seed = 0
+
+
+# Settings used by the simulated systems created afterwards
+settings = SimSettings()
+
+_log_path = None
+_log_level = None
+
+
+class LogLevel(enum.Enum):
+    Error = 0
+    Warning = 1
+    Info = 2
+    Debug = 3
+
+
+class ConnectResult(enum.Enum):
+    Success = 0
+    Failure = 1
+
+
+class MechResult(enum.Enum):
+    Success = 0
+    Failure = 1
+
+
+class GenParam(enum.Enum):
+    ChannelCount = 0
+    HeartBeatTimeout = 1
+    MultiplexerValue = 2
+
+
+class ExecFlag(enum.IntFlag):
+    NONE = 0
+    TriggerOneSequence = 1
+    TriggerAllSequences = 2
+    MeasureChannels = 4
+    MeasureBoards = 8
+    MeasureTimings = 16
+    DisableMonitoringChannelCombiner = 32
+    DisableMonitoringChannelCurrentOut = 64
+
+
+def setLogPath(path, name):
+    """
+    Sets the folder and name of the log, which the simulator does not write.
+    """
+
+    global _log_path
+    _log_path = (path, name)
+
+
+def setLogLevel(level):
+    """
+    Sets the level of the log, which the simulator does not write.
+    """
+
+    global _log_level
+    _log_level = level
+
+
+def _sleep_ms(duration_ms):
+    """
+    Sleeps for a duration in simulated time.
+    """
+
+    if settings.time_scale > 0 and duration_ms > 0:
+        time.sleep(duration_ms * settings.time_scale / 1000.0)
+
+
+class Pulse:
+    """
+    Class representing a pulse with a duration, a delay after the pulse, and per channel phases,
+    frequencies and amplitudes.
+    """
+
+    def __init__(self, phaseCount, frequencyCount, amplitudeCount):
+        self._phases = [0.0] * phaseCount
+        self._frequencies = [0.0] * frequencyCount
+        self._amplitudes = [0.0] * amplitudeCount
+        self._duration = 0.0
+        self._delay = 0.0
+
+    def setDuration(self, duration, delay=0.0):
+        self._duration = float(duration)
+        self._delay = float(delay)
+
+    def duration(self):
+        return self._duration
+
+    def delay(self):
+        return self._delay
+
+    def setPhases(self, phases):
+        self._phases = [float(phase) for phase in phases]
+
+    def phases(self):
+        return list(self._phases)
+
+    def phaseCount(self):
+        return len(self._phases)
+
+    def setFrequencies(self, frequencies):
+        self._frequencies = [float(frequency) for frequency in frequencies]
+
+    def frequency(self, index):
+        return self._frequencies[index]
+
+    def frequencyCount(self):
+        return len(self._frequencies)
+
+    def setAmplitudes(self, amplitudes):
+        self._amplitudes = [float(amplitude) for amplitude in amplitudes]
+
+    def amplitude(self, index):
+        return self._amplitudes[index]
+
+    def amplitudeCount(self):
+        return len(self._amplitudes)
+
+    def valueCount(self):
+        return len(self._phases) + len(self._frequencies) + len(self._amplitudes)
+
+
+def sequenceDurationMs(sequence, repetitions, delay):
+    """
+    Returns the duration of a sequence of pulses executed a number of times with a delay
+    between the executions [ms].
+    """
+
+    single = sum(pulse.duration() + pulse.delay() for pulse in sequence)
+
+    return repetitions * single + max(0, repetitions - 1) * delay
+
+
+class FUSListener:
+    """
+    Base class of the listeners of a FUSSystem; the events are sent from one background thread.
+    """
+
+    def __init__(self):
+        pass
+
+    def onConnectStart(self):
+        pass
+
+    def onConnectResult(self, result):
+        pass
+
+    def onDisconnect(self, reason):
+        pass
+
+    def onSequenceStart(self, execID, buffer, count, delay, flags):
+        pass
+
+    def onPulseResult(self, result):
+        pass
+
+    def onSequenceResult(self, execID, execIndex, pulseIndex, errorCode):
+        pass
+
+    def onMechOriginStart(self):
+        pass
+
+    def onMechOriginResult(self, result, msg):
+        pass
+
+    def onMechStart(self, execID, count):
+        pass
+
+    def onMechResult(self, execID, result, errorCode):
+        pass
+
+
+class SharedMeasurements:
+    """
+    Class representing the synthetic measurements of a pulse. Channels have 5 measures: voltage,
+    current, V/I phase, V/Vref phase (physical values) and frequency (raw value).
+    """
+
+    def __init__(self, channels, power, boards):
+        self._channels = channels
+        self._power = power
+        self._boards = boards
+
+    def channelCount(self):
+        return 0 if self._channels is None else self._channels.shape[0]
+
+    def channelMeasureCount(self):
+        return 0 if self._channels is None else self._channels.shape[1]
+
+    def physicalChannelMeasureAvailable(self, measure):
+        return measure < 4
+
+    def channelPhysicalValue(self, channel, measure):
+        return float(self._channels[channel, measure])
+
+    def channelRawValue(self, channel, measure):
+        return int(self._channels[channel, measure])
+
+    def power(self, channel):
+        return float(self._power[channel])
+
+    def powerAvailable(self):
+        return self._channels is not None
+
+    def boardCount(self):
+        return 0 if self._boards is None else self._boards.shape[0]
+
+    def boardMeasureCount(self):
+        return 0 if self._boards is None else self._boards.shape[1]
+
+    def physicalBoardMeasureAvailable(self, measure):
+        return True
+
+    def boardPhysicalValue(self, board, measure):
+        return float(self._boards[board, measure])
+
+    def boardRawValue(self, board, measure):
+        return int(self._boards[board, measure])
+
+
+class PulseResult:
+    """
+    Class representing the result of an executed pulse.
+    """
+
+    def __init__(self, execIndex, pulseIndex, duration, msFromStart, measures):
+        self._execIndex = execIndex
+        self._pulseIndex = pulseIndex
+        self._duration = duration
+        self._msFromStart = msFromStart
+        self._measures = measures
+
+    def execIndex(self):
+        return self._execIndex
+
+    def pulseIndex(self):
+        return self._pulseIndex
+
+    def duration(self):
+        return self._duration
+
+    def msFromStart(self):
+        return self._msFromStart
+
+    def sharedMeasurements(self):
+        return self._measures
+
+
+class Generator:
+    """
+    Class representing the simulated generator of a FUSSystem.
+    """
+
+    def __init__(self, system, channelCount):
+        self._system = system
+        self._params = {GenParam.ChannelCount: channelCount, GenParam.HeartBeatTimeout: 0,
+                        GenParam.MultiplexerValue: 0}
+        self._sequences = {}
+        self._modulation = None
+        self._prepared = None
+        self._execID = 0
+        self._stop = threading.Event()
+        self._triggers = threading.Semaphore(0)
+        self._thread = None
+
+        rng = np.random.default_rng(settings.seed)
+        self._impedance = settings.impedance + settings.impedance_spread * rng.standard_normal(
+            channelCount)
+        self._phaseVI = -10.0 + 2.0 * rng.standard_normal(channelCount)
+        self._rng = rng
+
+    def getParam(self, param):
+        return self._params[param]
+
+    def setParam(self, param, value):
+        if param == GenParam.ChannelCount:
+            raise ValueError('The channel count can not be changed')
+        self._params[param] = value
+
+    def enableAllChannels(self):
+        pass
+
+    def setPulseModulation(self, *modulation):
+        self._modulation = modulation
+
+    def sendSequence(self, buffer, sequence):
+        """
+        Uploads a sequence into a buffer of the generator.
+        """
+
+        n_values = sum(pulse.valueCount() for pulse in sequence)
+        _sleep_ms(settings.upload_base_ms + n_values * settings.upload_us_per_value / 1000.0)
+        self._sequences[buffer] = list(sequence)
+
+    def prepareSequence(self, buffer, count, delay, flags=ExecFlag.NONE):
+        """
+        Prepares the execution of an uploaded sequence.
+        """
+
+        if buffer not in self._sequences:
+            raise RuntimeError(f'No sequence in buffer {buffer}')
+
+        _sleep_ms(settings.prepare_ms)
+        self._prepared = (buffer, int(count), float(delay), ExecFlag(int(flags)))
+
+    def startSequence(self):
+        """
+        Starts the prepared sequence on a background thread.
+        """
+
+        if self._prepared is None:
+            raise RuntimeError('No prepared sequence')
+
+        self.stopSequence()
+
+        self._execID += 1
+        self._stop.clear()
+        self._triggers = threading.Semaphore(0)
+        self._thread = threading.Thread(target=self._execute, args=(self._execID,) + self._prepared,
+                                        name='UnifusSimExecution', daemon=True)
+        self._thread.start()
+
+    def stopSequence(self):
+        """
+        Stops the running sequence; its result is sent with error code ERROR_STOPPED.
+        """
+
+        self._stop.set()
+        self._triggers.release()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self._thread = None
+
+    def trigger(self):
+        """
+        Simulates a trigger input for sequences prepared with a trigger flag.
+        """
+
+        self._triggers.release()
+
+    def _measure(self, pulse, flags):
+        """
+        Returns synthetic measurements of a pulse, None if not measured.
+        """
+
+        measure_channels = bool(flags & ExecFlag.MeasureChannels)
+        measure_boards = bool(flags & (ExecFlag.MeasureBoards | ExecFlag.MeasureChannels))
+        if not measure_channels and not measure_boards:
+            return None
+
+        n_channels = len(self._impedance)
+        noise = settings.noise * self._rng.standard_normal((3, n_channels))
+
+        channels = power = None
+        if measure_channels:
+            amplitude = pulse.amplitude(0) if pulse.amplitudeCount() > 0 else 0.0
+            phases = np.resize(np.asarray(pulse.phases() or [0.0]), n_channels)
+
+            voltage = settings.max_voltage * amplitude / 100.0 * (1 + noise[0])
+            current = voltage / self._impedance * (1 + noise[1])
+            phase_vi = self._phaseVI + noise[2]
+            channels = np.column_stack([voltage, current, phase_vi, np.mod(phases, 360),
+                                        np.full(n_channels, pulse.frequency(0))])
+            power = voltage * current * np.cos(np.radians(phase_vi))
+
+        boards = None
+        if measure_boards:
+            n_boards = math.ceil(n_channels / CHANNELS_PER_BOARD)
+            # Supply voltages and temperature per board
+            boards = np.tile([48.0, 12.0, 5.0, 35.0], (n_boards, 1)) * (
+                1 + settings.noise * self._rng.standard_normal((n_boards, 4)))
+
+        return SharedMeasurements(channels, power, boards)
+
+    def _execute(self, execID, buffer, count, delay, flags):
+        """
+        Executes a sequence and sends its events.
+        """
+
+        sequence = self._sequences[buffer]
+        system = self._system
+        triggered = flags & (ExecFlag.TriggerOneSequence | ExecFlag.TriggerAllSequences)
+
+        _sleep_ms(settings.start_latency_ms)
+        system._post('onSequenceStart', execID, buffer, count, delay, int(flags))
+
+        start = time.monotonic()
+        elapsed_ms = 0.0
+        exec_index = pulse_index = 0
+        error_code = 0
+
+        for exec_index in range(count):
+            if triggered and (exec_index == 0 or flags & ExecFlag.TriggerOneSequence):
+                self._triggers.acquire()
+                start = time.monotonic() - elapsed_ms * settings.time_scale / 1000.0
+
+            for pulse_index, pulse in enumerate(sequence):
+                if self._stop.is_set():
+                    error_code = ERROR_STOPPED
+                    break
+
+                end_ms = elapsed_ms + pulse.duration()
+                if settings.time_scale > 0:
+                    remaining = start + end_ms * settings.time_scale / 1000.0 - time.monotonic()
+                    if remaining > 0 and self._stop.wait(remaining):
+                        error_code = ERROR_STOPPED
+                        break
+
+                system._post('onPulseResult', PulseResult(exec_index, pulse_index,
+                                                          pulse.duration(), elapsed_ms,
+                                                          self._measure(pulse, flags)))
+                elapsed_ms = end_ms + pulse.delay()
+
+            if error_code != 0:
+                break
+            elapsed_ms += delay
+
+        system._post('onSequenceResult', execID, exec_index, pulse_index, error_code)
+
+
+def _unit_channel_count(unit):
+    """
+    Returns the number of output channels of a unit of a generator configuration file.
+    """
+
+    channels = unit.get('channels', [])
+    n_channels = channels if isinstance(channels, int) else len(channels)
+
+    return n_channels // max(1, int(unit.get('channelsCombiner', 1)))
+
+
+class FUSSystem:
+    """
+    Class representing a simulated FUS system with one generator.
+    """
+
+    def __init__(self):
+        self._listeners = []
+        self._connected = False
+        self._channelCount = DEFAULT_CHANNEL_COUNT
+        self._gen = None
+
+        # Listener events are sent in order from one thread
+        self._events = queue.Queue()
+        self._dispatcher = threading.Thread(target=self._dispatch, name='UnifusSimEvents',
+                                            daemon=True)
+        self._dispatcher.start()
+
+    def _post(self, event, *args):
+        self._events.put((event, args))
+
+    def _dispatch(self):
+        while True:
+            event, args = self._events.get()
+            for listener in list(self._listeners):
+                try:
+                    getattr(listener, event)(*args)
+                except Exception as e:
+                    logger.error('Listener %s failed: %s', event, e)
+
+    def loadConfig(self, path):
+        """
+        Loads a generator configuration file; the channel count is the number of channels of
+        its units. The channels of a unit are given as a count or as a list of channel indices; a
+        channel combiner merges that many channels into one output channel.
+        """
+
+        with open(path) as f:
+            gen_config = json.load(f)
+
+        units = gen_config.get('units', [])
+        if len(units) > 0:
+            self._channelCount = sum(_unit_channel_count(unit) for unit in units)
+
+    def registerListener(self, listener):
+        self._listeners.append(listener)
+
+    def clearListeners(self):
+        self._listeners = []
+
+    def connect(self):
+        """
+        Connects in the background; the result is sent to the listeners.
+        """
+
+        def connecting():
+            self._post('onConnectStart')
+            _sleep_ms(settings.connect_ms)
+            self._gen = Generator(self, self._channelCount)
+            self._connected = True
+            self._post('onConnectResult', ConnectResult.Success)
+
+        threading.Thread(target=connecting, name='UnifusSimConnect', daemon=True).start()
+
+    def isConnected(self):
+        return self._connected
+
+    def gen(self):
+        return self._gen
+
+    def disconnect(self):
+        """
+        Disconnects in the background; the disconnection is sent to the listeners.
+        """
+
+        def disconnecting():
+            if self._gen is not None:
+                self._gen.stopSequence()
+            _sleep_ms(settings.disconnect_ms)
+            self._connected = False
+            self._post('onDisconnect', 'requested')
+
+        threading.Thread(target=disconnecting, name='UnifusSimDisconnect', daemon=True).start()
+
+    def simulateConnectionLoss(self):
+        """
+        Drops the connection immediately, e.g. to exercise reconnections.
+        """
+
+        if self._gen is not None:
+            self._gen._stop.set()
+            self._gen._triggers.release()
+        self._connected = False
+        self._post('onDisconnect', 'connection lost')
@@ -32,73 +32,252 @@ https://github.com/Donders-Institute/Radboud-FUS-measurement-kit
 
 # This file contains some general purpose functions used in most examples.
 
+import threading
 import time
-from fus_driving_systems.igt import unifus
+from collections import namedtuple
+from fus_driving_systems.igt.unifus_backend import unifus
+from fus_driving_systems.igt.measurements import MeasurementExtractor, MeasurementLog, LOG_SUMMARY
+from fus_driving_systems.igt.pulse_recorder import PulseRing, SessionWriter
 
 # Access the logger
 from fus_driving_systems.config.logging_config import logger
 
+# Time to wait for the start event of an operation that has not been announced with expect*()
+START_TIMEOUT = 0.2
+
+
+class WaitResult(namedtuple('WaitResult', ['success', 'errorCode', 'timedOut'])):
+    """
+    Result of a wait on the listener.
+        success: True if the operation finished successfully
+        errorCode: error code or result reported by the operation (None if not finished)
+        timedOut: True if the operation did not finish before the timeout
+    A WaitResult evaluates to the success of the operation.
+    """
+    __slots__ = ()
+
+    def __bool__(self):
+        return bool(self.success)
+
+
+class _Operation(object):
+    """
+    State of an asynchronous operation (connection, sequence, origins or motion), updated from the
+    listener callbacks and waited for with a condition on a monotonic clock.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.running = False
+        self.finished = False
+        self.success = False
+        self.errorCode = None
+        self._callbacks = []
+
+    def expect(self, callback=None):
+        """
+        Announces that the operation is about to start: a wait returns on its result only.
+        The optional callback is called once with the WaitResult when the operation finishes.
+        """
+        with self._cond:
+            self.running = True
+            self.finished = False
+            self.errorCode = None
+            if callback is not None:
+                self._callbacks.append(callback)
+
+    def _notify(self, result):
+        """Calls the callbacks outside of the lock; they are called from the listener thread."""
+        with self._cond:
+            callbacks = self._callbacks
+            self._callbacks = []
+        for callback in callbacks:
+            callback(result)
+
+    def start(self):
+        with self._cond:
+            self.running = True
+            self.finished = False
+            self._cond.notify_all()
+
+    def finish(self, success, errorCode):
+        with self._cond:
+            self.running = False
+            self.finished = True
+            self.success = success
+            self.errorCode = errorCode
+            self._cond.notify_all()
+        self._notify(WaitResult(success, errorCode, False))
+
+    def cancel(self):
+        """Releases the waits, e.g. on a disconnection."""
+        with self._cond:
+            if not self.running:
+                return
+            self.running = False
+            self.finished = True
+            self.success = False
+            self._cond.notify_all()
+        self._notify(WaitResult(False, None, False))
+
+    def wait(self, timeout):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            # An operation that has not been announced nor started may not have sent its start
+            # event yet
+            if not self.running and not self.finished:
+                self._cond.wait_for(lambda: self.running or self.finished,
+                                    min(START_TIMEOUT, timeout))
+
+            if not self.running and not self.finished:
+                # Nothing started: nothing to wait for
+                return WaitResult(True, None, False)
+
+            done = self._cond.wait_for(lambda: not self.running,
+                                       max(0.0, deadline - time.monotonic()))
+            if not done:
+                return WaitResult(False, None, True)
+
+            # The result is consumed, so that a next wait does not return it again
+            self.finished = False
+            return WaitResult(self.success, self.errorCode, False)
+
+
 class ExecListener(unifus.FUSListener):
     """
     A listener class used to illustrate how to receive events sent by the FUS object,
     and also how to wait for the end of an execution properly.
     """
 
-    def __init__(self):
+    def __init__(self, measurementLogging=LOG_SUMMARY):
         unifus.FUSListener.__init__(self)
-        self._connecting = False
+        self._connection = _Operation()
         # for ultrasounds
-        self._running = False
-        self.pulseResults = []
+        self._sequence = _Operation()
+        # bounded: the oldest results are overwritten when they are not drained in time
+        self.pulseResults = PulseRing()
+        self._sessionWriter = None
+        # measurements are copied into reused arrays here and formatted on a consumer thread
+        self._extractor = MeasurementExtractor()
+        self.measurementLog = MeasurementLog(measurementLogging)
+        # optional ChannelHealthMonitor updated with the channel measurements of every pulse
+        self.channelHealth = None
         self.execResult = None
         # for mechanics
-        self._findingOrigin = False
-        self._moving = False
+        self._origins = _Operation()
+        self._motion = _Operation()
         self.mechResult = None
+        self._disconnection = _Operation()
+
+    @property
+    def _connecting(self):
+        return self._connection.running
+
+    @property
+    def _running(self):
+        return self._sequence.running
+
+    @property
+    def _findingOrigin(self):
+        return self._origins.running
+
+    @property
+    def _moving(self):
+        return self._motion.running
+
+    def expectConnection(self):
+        """Call before connecting, so that waitConnection() waits for this connection result."""
+        self._connection.expect()
+
+    def expectSequence(self, callback=None):
+        """
+        Call before starting a sequence, so that waitSequence() waits for its result.
+        The optional callback is called once with the WaitResult of the sequence.
+        """
+        self._sequence.expect(callback)
+
+    def cancelSequence(self):
+        """
+        Releases the waits and callbacks of an announced sequence that will not be started, e.g.
+        when a prepared sequence is disarmed.
+        """
+        self._sequence.cancel()
+
+    def expectDisconnect(self):
+        """Call before disconnecting, so that waitDisconnect() waits for the disconnection."""
+        self._disconnection.expect()
+
+    def isSequenceRunning(self):
+        """Returns True while a started or announced sequence has not sent its result."""
+        return self._sequence.running
+
+    def expectOrigins(self):
+        """Call before finding the origins, so that waitOrigins() waits for the result."""
+        self._origins.expect()
+
+    def expectMotion(self):
+        """Call before starting a motion, so that waitMotion() waits for its result."""
+        self._motion.expect()
 
     def onConnectStart(self):
-        self._connecting = True
+        self._connection.start()
         print("Listener: CONNECTING")
 
     def onConnectResult(self, result):
-        self._connecting = False
+        self._connection.finish(result == unifus.ConnectResult.Success, result)
         if result == unifus.ConnectResult.Success:
             print("Listener: CONNECTED")
         else:
             print("Listener: CONNECTION FAILED (%s)" % str(result))
 
     def onDisconnect(self, reason):
-        self._running = False
+        self._sequence.cancel()
+        self._origins.cancel()
+        self._motion.cancel()
+        self._disconnection.finish(True, reason)
         print("Listener: DISCONNECTED (%s)" % str(reason))
 
+    def startRecording(self, path):
+        """
+        Starts writing the pulse results to a session folder in the background.
+        """
+        self.stopRecording()
+        self._sessionWriter = SessionWriter(path, self.pulseResults)
+
+    def stopRecording(self):
+        """
+        Writes the remaining pulse results and stops the session writer, if any. Queued
+        measurements are logged first.
+        Returns the session folder, None if nothing was recorded.
+        """
+        self.measurementLog.stop()
+        writer = self._sessionWriter
+        if writer is None:
+            return None
+        self._sessionWriter = None
+        writer.stop()
+        return writer.path
+
     def onSequenceStart(self, execID, buffer, count, delay, flags):
-        self._running = True
-        self.pulseResults = []
+        self._sequence.start()
         print("Listener: EXEC START (buff: %d, count: %d, delay: %g)" % (buffer, count, delay))
 
     def onPulseResult(self, result):
-        self.pulseResults.append (result)
-        print ("Listener: PULS RESULT (exec: %d, pulse: %d, duration: %g ms, elapsed: %g ms)" %
-            (result.execIndex(), result.pulseIndex(), result.duration(), result.msFromStart()))
+        channels = boards = None
         measures = result.sharedMeasurements()
         if measures is not None:
-            logger.info("          Available: %d measures for %d board(s), %d measures for %d channel(s)" %
-                (measures.boardMeasureCount(), measures.boardCount(), measures.channelMeasureCount(), measures.channelCount()))
-            for channel in range(measures.channelCount()):
-                # Note: it is advised to call measures.physicalChannelMeasureAvailable(measure) to check
-                # before calling .channelPhysicalValue (channel, measure).
-                if measures.channelMeasureCount() == 5:
-                    logger.info("    ch[%d] V=%#4.3g V, I=%#4.3g A, PhaseV/I=%#4.3g°, PhaseV/Vref=%#5.4g°, Freq=%7d Hz, Pow=%#g W" % (channel,
-                        measures.channelPhysicalValue (channel, 0), measures.channelPhysicalValue (channel, 1),
-                        measures.channelPhysicalValue (channel, 2), measures.channelPhysicalValue (channel, 3),
-                        measures.channelRawValue (channel, 4), measures.power(channel)))
-                else:
-                    logger.info("    ch[%d] Vfwd=%#4.3g V, Vrev=%#4.3g V, PhaseV/Vref=%#5.4g°, Freq=%7d Hz, Pow=%#g W" % (channel,
-                        measures.channelPhysicalValue (channel, 0), measures.channelPhysicalValue (channel, 1),
-                        measures.channelPhysicalValue (channel, 2), measures.channelRawValue (channel, 3), measures.power(channel)))
+            channels, boards = self._extractor.extract(measures)
+        execIndex = result.execIndex()
+        pulseIndex = result.pulseIndex()
+        self.pulseResults.append(execIndex, pulseIndex, result.duration(), result.msFromStart(),
+                                 channels, boards)
+        if measures is not None:
+            self.measurementLog.submit(execIndex, pulseIndex, channels, boards)
+            if self.channelHealth is not None and channels is not None:
+                self.channelHealth.update(channels)
 
     def onSequenceResult(self, execID, execIndex, pulseIndex, errorCode):
-        self._running = False
+        self._sequence.finish(errorCode == 0, errorCode)
         if errorCode == 0:
             print("Listener: EXEC RESULT SUCCESS (exec: %d)" % (execIndex))
         else:
@@ -106,21 +285,21 @@ class ExecListener(unifus.FUSListener):
                   (errorCode, execIndex, pulseIndex))
 
     def onMechOriginStart(self):
-        self._findingOrigin = True
+        self._origins.start()
         print("Listener: START  finding mech origins")
 
     def onMechOriginResult(self, result, msg):
-        self._findingOrigin = False
+        self._origins.finish(result.name == "Success", result)
         print("Listener: RESULT finding mech origins: %s (%s)" % (result.name, msg))
 
     def onMechStart(self, execID, count):
-        self._moving = True
         self.mechResult = None
+        self._motion.start()
         print("Listener: START  motion (id: %d, count: %d)" % (execID, count))
 
     def onMechResult(self, execID, result, errorCode):
-        self._moving = False
         self.mechResult = result
+        self._motion.finish(errorCode == 0, errorCode)
         if errorCode == 0:
             print("Listener: RESULT motion success (id: %d)" % (execID))
         else:
@@ -128,53 +307,39 @@ class ExecListener(unifus.FUSListener):
                   (execID, errorCode, str(result)))
 
     def waitConnection(self, timeout=5.0):
-        maxWait = time.time() + timeout
-        while True:
-            time.sleep(0.2)
-            if not self._connecting:
-                return True
-            if time.time() > maxWait:
-                return False
+        """
+            Wait until the connection result is received, or specified timeout in seconds.
+            Returns a WaitResult.
+        """
+        return self._connection.wait(timeout)
 
     def waitSequence(self, timeout=5.0):
         """
             Wait until the current ultrasound sequence is finished, or specified timeout in seconds.
+            Returns a WaitResult.
         """
-        maxWait = time.time() + timeout
-        # Start with a sleep to make sure the start event has been received
-        # and _running has been set to true.
-        while True:
-            time.sleep(0.2)
-            if not self._running:
-                return
-            if time.time() > maxWait:
-                return False
+        return self._sequence.wait(timeout)
+
+    def waitDisconnect(self, timeout=2.0):
+        """
+            Wait until the disconnection is received, or specified timeout in seconds.
+            Returns a WaitResult.
+        """
+        return self._disconnection.wait(timeout)
 
     def waitOrigins(self, timeout=20.0):
         """
             Wait until the mechanical origins are found, or specified timeout in seconds.
+            Returns a WaitResult.
         """
-        maxWait = time.time() + timeout
-        # Start with a sleep to make sure the start event has been received
-        # and _moving has been set to true.
-        while True:
-            time.sleep(0.2)
-            if not self._findingOrigin:
-                return
-            if time.time() > maxWait:
-                return False
+        return self._origins.wait(timeout)
 
     def waitMotion(self, timeout=30.0):
-        """Wait until the current motion is finished, or specified timeout in seconds."""
-        maxWait = time.time() + timeout
-        # Start with a sleep to make sure the start event has been received
-        # and _moving has been set to true.
-        while True:
-            time.sleep(0.2)
-            if not self._moving:
-                return
-            if time.time() > maxWait:
-                return False
+        """
+            Wait until the current motion is finished, or specified timeout in seconds.
+            Returns a WaitResult.
+        """
+        return self._motion.wait(timeout)
 
     def printExecResult(self):
         msg = "Execution result: "
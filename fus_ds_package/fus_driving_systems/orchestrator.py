@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2024 Margely Cornelissen, Stein Fekkes (Radboud University) and Erik Dumont (Image
+Guided Therapy)
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+**Attribution Notice**:
+If you use this kit in your research or project, please include the following attribution:
+Margely Cornelissen, Stein Fekkes (Radboud University, Nijmegen, The Netherlands) & Erik Dumont
+(Image Guided Therapy, Pessac, France) (2024), Radboud FUS measurement kit (version 0.8),
+https://github.com/Donders-Institute/Radboud-FUS-measurement-kit
+"""
+
+# Basis packages
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+# Miscellaneous packages
+
+# Own packages
+
+# Access the logger
+from fus_driving_systems.config.logging_config import logger
+
+# Maximum time the devices wait for each other before the start [s]
+BARRIER_TIMEOUT = 60.0
+
+Device = collections.namedtuple('Device', ['name', 'driving_system', 'connect_info',
+                                           'connect_kwargs'], defaults=[None])
+Device.__doc__ = """
+A driving system driven by the orchestrator.
+
+Attributes:
+    name (str): Name of the device in the report, e.g. its serial number.
+    driving_system (ControlDrivingSystem): The driving system.
+    connect_info: Information required for establishing a connection, either a com port or
+    configuration file.
+    connect_kwargs (dict): Additional keyword arguments of connect(), None = no arguments.
+"""
+
+
+class OrchestratorError(Exception):
+    """
+    Raised when a device failed to connect, upload, arm or start. The devices that were armed,
+    including the ones armed for a trigger by the upload, are disarmed and stopped first.
+    """
+
+
+class DeviceTimings:
+    """
+    Class representing the timings of a device during an orchestrated start.
+
+    Attributes:
+        connect_ms (float): Duration of the connection, 0 if it was already connected.
+        upload_ms (float): Duration of the upload of the sequence.
+        arm_ms (float): Duration of the preparation of the start.
+        start_time (float): time.perf_counter() just before the start was issued [s].
+        start_ms (float): Duration of the start call.
+        start_offset_ms (float): Start relative to the first started device.
+        result: Result of the sequence reported by the driving system, None until finished.
+    """
+
+    def __init__(self):
+        """
+        Initializes a DeviceTimings object.
+        """
+
+        self.connect_ms = 0.0
+        self.upload_ms = 0.0
+        self.arm_ms = 0.0
+        self.start_time = None
+        self.start_ms = 0.0
+        self.start_offset_ms = 0.0
+        self.result = None
+
+    def __str__(self):
+        return (f'connect {self.connect_ms:.0f} ms, upload {self.upload_ms:.0f} ms, arm '
+                + f'{self.arm_ms:.1f} ms, start offset {self.start_offset_ms:.3f} ms, start call '
+                + f'{self.start_ms:.3f} ms')
+
+
+class Orchestrator:
+    """
+    Class driving several ControlDrivingSystems together. The devices are connected, the
+    sequences uploaded and the starts prepared concurrently on a thread pool. The threads then
+    wait on a barrier, which releases all starts at once to align them.
+
+    Attributes:
+        devices (list): The orchestrated devices.
+        barrier_timeout (float): Maximum time the devices wait for each other before the start.
+        timings (dict): DeviceTimings per device name of the last run.
+        skew_ms (float): Difference between the first and the last start of the last run.
+    """
+
+    def __init__(self, devices, barrier_timeout=BARRIER_TIMEOUT):
+        """
+        Initializes an Orchestrator object.
+
+        Parameters:
+            devices (list): Device per driving system.
+            barrier_timeout (float): Maximum time the devices wait for each other before the start
+            [s].
+        """
+
+        names = [device.name for device in devices]
+        if len(set(names)) != len(names):
+            raise ValueError(f'Device names are not unique: {names}')
+
+        self.devices = list(devices)
+        self.barrier_timeout = barrier_timeout
+
+        self.timings = {}
+        self.skew_ms = None
+
+        # One thread per device, so that all devices can wait on the barrier
+        self._executor = ThreadPoolExecutor(max_workers=max(1, len(self.devices)),
+                                            thread_name_prefix='Orchestrator')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.disconnect()
+        self.close()
+
+    def _map(self, func, *args):
+        """
+        Calls a function per device concurrently and returns the results per device name. A
+        failure of any device is raised as OrchestratorError after all calls ended.
+        """
+
+        futures = {device.name: self._executor.submit(func, device, *args)
+                   for device in self.devices}
+
+        results = {}
+        errors = []
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except BaseException as e:
+                errors.append(f'{name}: {str(e) or type(e).__name__}')
+
+        if len(errors) > 0:
+            raise OrchestratorError('; '.join(errors))
+
+        return results
+
+    def _connect(self, device):
+        """
+        Connects a device when it is not connected and returns the duration [ms].
+        """
+
+        driving_system = device.driving_system
+        if driving_system.is_connected():
+            return 0.0
+
+        start_time = time.perf_counter()
+        kwargs = device.connect_kwargs if device.connect_kwargs is not None else {}
+        driving_system.connect(device.connect_info, **kwargs)
+
+        return (time.perf_counter() - start_time) * 1000
+
+    def connect(self):
+        """
+        Connects all devices concurrently.
+
+        Returns:
+            dict: Duration of the connection per device name [ms].
+        """
+
+        return self._map(self._connect)
+
+    def _run_device(self, device, sequence, barrier, finished, armed):
+        """
+        Connects, uploads and arms one device, waits for the other devices and starts. The name
+        of the device is added to armed before the upload.
+        """
+
+        timings = self.timings[device.name]
+        driving_system = device.driving_system
+
+        def on_result(result):
+            timings.result = result
+            finished.release()
+
+        try:
+            timings.connect_ms = self._connect(device)
+
+            # A sequence that waits for a trigger can already be armed by the upload
+            armed.add(device.name)
+
+            start_time = time.perf_counter()
+            driving_system.send_sequence(sequence)
+            timings.upload_ms = (time.perf_counter() - start_time) * 1000
+
+            start_time = time.perf_counter()
+            driving_system.arm_sequence(sequence, callback=on_result)
+            timings.arm_ms = (time.perf_counter() - start_time) * 1000
+        except BaseException:
+            # Releases the other devices without starting them
+            barrier.abort()
+            raise
+
+        barrier.wait(self.barrier_timeout)
+
+        timings.start_time = time.perf_counter()
+        driving_system.start_armed_sequence()
+        timings.start_ms = (time.perf_counter() - timings.start_time) * 1000
+
+    def run(self, sequences, wait=True, timeout=None):
+        """
+        Connects, uploads and arms all devices concurrently and starts them together.
+
+        Parameters:
+            sequences (dict): Sequence per device name.
+            wait (bool): True = wait until the sequences of all devices are finished.
+            timeout (float): Maximum time to wait for the sequences to finish [s], None = no limit.
+
+        Returns:
+            dict: DeviceTimings per device name.
+        """
+
+        missing = [device.name for device in self.devices if device.name not in sequences]
+        if len(missing) > 0:
+            raise OrchestratorError(f'No sequence for device(s) {", ".join(missing)}')
+
+        self.timings = {device.name: DeviceTimings() for device in self.devices}
+        self.skew_ms = None
+
+        barrier = threading.Barrier(len(self.devices))
+        finished = threading.Semaphore(0)
+        armed = set()
+
+        futures = {device.name: self._executor.submit(self._run_device, device,
+                                                      sequences[device.name], barrier, finished,
+                                                      armed)
+                   for device in self.devices}
+
+        errors = []
+        not_ready = []
+        for name, future in futures.items():
+            try:
+                future.result()
+            except threading.BrokenBarrierError:
+                not_ready.append(name)
+            except BaseException as e:
+                errors.append(f'{name}: {str(e) or type(e).__name__}')
+
+        # Without another error, the devices did not arrive within the barrier timeout
+        if len(not_ready) > 0 and len(errors) == 0:
+            errors.append(f'{", ".join(not_ready)}: devices not ready within '
+                          + f'{self.barrier_timeout} s')
+
+        if len(errors) > 0:
+            self._disarm(armed)
+            raise OrchestratorError('; '.join(errors))
+
+        start_times = [timings.start_time for timings in self.timings.values()]
+        first_start = min(start_times)
+        for timings in self.timings.values():
+            timings.start_offset_ms = (timings.start_time - first_start) * 1000
+        self.skew_ms = (max(start_times) - first_start) * 1000
+
+        for name, timings in self.timings.items():
+            logger.info('Device %s: %s', name, timings)
+        logger.info('Start skew over %d device(s): %.3f ms', len(self.devices), self.skew_ms)
+
+        if wait:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            for _ in self.devices:
+                remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+                if not finished.acquire(timeout=remaining):
+                    logger.warning('Not all sequences finished within %s s', timeout)
+                    break
+
+        return self.timings
+
+    def _disarm(self, names):
+        """
+        Disarms and stops the given devices concurrently after a failed run. Failures are logged,
+        so that every device is disarmed.
+        """
+
+        futures = {device.name: self._executor.submit(device.driving_system.disarm_sequence)
+                   for device in self.devices if device.name in names}
+
+        for name, future in futures.items():
+            try:
+                future.result()
+                logger.info('Device %s is disarmed', name)
+            except BaseException as e:
+                logger.error('Device %s could not be disarmed: %s', name,
+                             str(e) or type(e).__name__)
+
+    def _disconnect(self, device):
+        """
+        Disconnects a device.
+        """
+
+        device.driving_system.disconnect()
+
+    def disconnect(self):
+        """
+        Disconnects all devices concurrently.
+        """
+
+        self._map(self._disconnect)
+
+    def close(self):
+        """
+        Shuts the thread pool down.
+        """
+
+        self._executor.shutdown(wait=True)
@@ -839,13 +839,19 @@ class Sequence():
 
     def get_ramp_shapes(self):
         """
-        Returns a list of available ramp shapes for pulse modulation.
+        Returns a list of available ramp shapes for pulse modulation. IGT driving systems
+        support additional ramp shapes.
 
         Returns:
             List[str]: Available ramp shapes.
         """
 
-        return config['General']['Ramp shapes'].split('\n')
+        ramp_shapes = config['General']['Ramp shapes'].split('\n')
+        igt_config = config['Equipment.Manufacturer.IGT']
+        if self._driving_sys.manufact == igt_config['Name']:
+            ramp_shapes += igt_config['Additional ramp shapes'].split('\n')
+
+        return ramp_shapes
 
     @property
     def pulse_ramp_shape(self):
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2024 Margely Cornelissen, Stein Fekkes (Radboud University) and Erik Dumont (Image
+Guided Therapy)
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+**Attribution Notice**:
+If you use this kit in your research or project, please include the following attribution:
+Margely Cornelissen, Stein Fekkes (Radboud University, Nijmegen, The Netherlands) & Erik Dumont
+(Image Guided Therapy, Pessac, France) (2024), Radboud FUS measurement kit (version 0.8),
+https://github.com/Donders-Institute/Radboud-FUS-measurement-kit
+"""
+
+# pySerial URL handler of the virtual Sonic Concepts driving system:
+#   neurofus://<serial>[?latency=<s>][&fail=<COMMAND>,...][&fail_connect=1]
+# e.g. 'neurofus://203-035?latency=0.01' as 'Connection info'. It is found by serial_for_url()
+# once 'fus_driving_systems.sonic_concepts' is in serial.protocol_handler_packages.
+
+# Basis packages
+import threading
+import time
+import urllib.parse
+
+# Miscellaneous packages
+from serial.serialutil import SerialBase, SerialException, PortNotOpenError, to_bytes
+
+# Own packages
+from fus_driving_systems.sonic_concepts.virtual_device import (DEFAULT_LATENCY, VirtualNeuroFUS,
+                                                               split_lines)
+
+
+class Serial(SerialBase):
+    """
+    Class representing a serial port connected to an in-process virtual Sonic Concepts driving
+    system. Responses become readable after the latency of the device.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.device = None
+        self._received = bytearray()
+
+        # (time.monotonic() when readable, response bytes)
+        self._responses = []
+        self._cond = threading.Condition()
+        super().__init__(*args, **kwargs)
+
+    def from_url(self, url):
+        """
+        Creates the virtual device described by the URL.
+        """
+
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme != 'neurofus':
+            raise SerialException(f'expected a neurofus://<serial> URL, not {url!r}')
+
+        options = urllib.parse.parse_qs(parts.query)
+        try:
+            latency = float(options.pop('latency', [DEFAULT_LATENCY])[0])
+            fail_commands = [command for value in options.pop('fail', [])
+                             for command in value.split(',') if command]
+            fail_connect = options.pop('fail_connect', ['0'])[0] not in ('0', 'false', 'False')
+        except ValueError as e:
+            raise SerialException(f'invalid option in {url!r}: {e}')
+
+        if len(options) > 0:
+            raise SerialException(f'unknown option(s) in {url!r}: {", ".join(options)}')
+
+        self.device = VirtualNeuroFUS(parts.netloc or 'virtual', latency, fail_commands,
+                                      fail_connect)
+
+    def open(self):
+        if self.is_open:
+            raise SerialException('Port is already open.')
+        if self._port is None:
+            raise SerialException('Port must be configured before it can be used.')
+
+        self.from_url(self.port)
+        self.is_open = True
+
+        self._received = bytearray()
+        self._responses = [(time.monotonic(), (self.device.startup_message() + '\r\n').encode())]
+
+    def close(self):
+        self.is_open = False
+        with self._cond:
+            self._cond.notify_all()
+
+    def _reconfigure_port(self):
+        pass
+
+    def _update_rts_state(self):
+        pass
+
+    def _update_dtr_state(self):
+        pass
+
+    def _update_break_state(self):
+        pass
+
+    def _ready(self, now):
+        """
+        Returns the number of bytes readable at a time.
+        """
+
+        return sum(len(data) for ready, data in self._responses if ready <= now)
+
+    @property
+    def in_waiting(self):
+        if not self.is_open:
+            raise PortNotOpenError()
+
+        with self._cond:
+            return self._ready(time.monotonic())
+
+    def read(self, size=1):
+        if not self.is_open:
+            raise PortNotOpenError()
+
+        deadline = None if self._timeout is None else time.monotonic() + self._timeout
+        data = bytearray()
+
+        with self._cond:
+            while len(data) < size and self.is_open:
+                now = time.monotonic()
+                while self._responses and self._responses[0][0] <= now and len(data) < size:
+                    ready, response = self._responses[0]
+                    n_bytes = size - len(data)
+                    data += response[:n_bytes]
+                    if n_bytes >= len(response):
+                        self._responses.pop(0)
+                    else:
+                        self._responses[0] = (ready, response[n_bytes:])
+
+                if len(data) >= size:
+                    break
+
+                # Wait for the next response or the timeout
+                wait = None if not self._responses else max(0.0, self._responses[0][0] - now)
+                if deadline is not None:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        break
+                    wait = remaining if wait is None else min(wait, remaining)
+                self._cond.wait(wait)
+
+        return bytes(data)
+
+    def write(self, data):
+        if not self.is_open:
+            raise PortNotOpenError()
+
+        data = to_bytes(data)
+        self._received += data
+
+        with self._cond:
+            # Responses follow each other, each after the latency of the device
+            ready = time.monotonic()
+            for line in split_lines(self._received):
+                response = self.device.handle(line)
+                if self._responses:
+                    ready = max(ready, self._responses[-1][0])
+                ready += self.device.latency
+                self._responses.append((ready, (response + '\r\n').encode('ascii')))
+            self._cond.notify_all()
+
+        return len(data)
+
+    def reset_input_buffer(self):
+        if not self.is_open:
+            raise PortNotOpenError()
+        with self._cond:
+            self._responses = []
+
+    def reset_output_buffer(self):
+        if not self.is_open:
+            raise PortNotOpenError()
+
+    @property
+    def out_waiting(self):
+        return 0
+
+    @property
+    def cts(self):
+        return True
+
+    @property
+    def dsr(self):
+        return True
+
+    @property
+    def ri(self):
+        return False
+
+    @property
+    def cd(self):
+        return True
@@ -32,7 +32,7 @@ https://github.com/Donders-Institute/Radboud-FUS-measurement-kit
 
 # Basis packages
 import re
-import sys
+import threading
 import time
 
 # Miscellaneous packages
@@ -47,6 +47,44 @@ from fus_driving_systems import control_driving_system as ds
 from fus_driving_systems.config.config import config_info as config
 from fus_driving_systems.config.logging_config import logger
 
+# 'Connection info' can be a COM port or a pySerial URL, including the virtual driving system
+# (neurofus://<serial>, see protocol_neurofus.py)
+PROTOCOL_HANDLER_PACKAGE = 'fus_driving_systems.sonic_concepts'
+if PROTOCOL_HANDLER_PACKAGE not in serial.protocol_handler_packages:
+    serial.protocol_handler_packages.append(PROTOCOL_HANDLER_PACKAGE)
+
+# Timeout of a single read of the serial port, so that responses are read up to the terminator
+# and the deadline of a command is kept [s]
+READ_POLL_S = 0.05
+
+# Timeout of the startup message when connecting [s]
+STARTUP_TIMEOUT_S = 1.0
+
+# Timeout of the query that checks whether the driving system still responds [s]
+CHECK_TIMEOUT_S = 0.2
+
+# Default timeout and expected response of a command
+DEFAULT_TIMEOUT_S = 1.0
+DEFAULT_PATTERN = r'\S'
+
+# Timeout [s] and expected response pattern per command. The response of the period query has
+# to contain the period. Other responses only have to be non-empty, as their format depends on
+# the firmware.
+COMMAND_RESPONSES = {'LOCAL': (2.0, DEFAULT_PATTERN),
+                     'LOCAL?': (CHECK_TIMEOUT_S, DEFAULT_PATTERN),
+                     'ABORT': (1.0, DEFAULT_PATTERN),
+                     'RAMPMODE': (2.0, DEFAULT_PATTERN),
+                     'RAMPLENGTH': (2.0, DEFAULT_PATTERN),
+                     'GLOBALFREQ': (2.0, DEFAULT_PATTERN),
+                     'FOCUS': (2.0, DEFAULT_PATTERN),
+                     'GLOBALPOWER': (1.0, DEFAULT_PATTERN),
+                     'BURST': (1.0, DEFAULT_PATTERN),
+                     'PERIOD': (1.0, DEFAULT_PATTERN),
+                     'PERIOD?': (1.0, r'\d+\.?\d*'),
+                     'TIMER': (1.0, DEFAULT_PATTERN),
+                     'TRIGGERMODE': (2.0, DEFAULT_PATTERN),
+                     'START': (1.0, DEFAULT_PATTERN)}
+
 
 class SonicConcepts(ds.ControlDrivingSystem):
     """
@@ -63,24 +101,47 @@ class SonicConcepts(ds.ControlDrivingSystem):
         Connects to the Sonic Concepts ultrasound driving system.
 
         Parameters:
-            connect_info (str): COM port information.
+            connect_info (str): COM port information or pySerial URL.
         """
         
         # When no connection, it is assumed that sent sequence isn't available (anymore)
         self.sequence_sent = False
 
-        self.gen = serial.Serial(connect_info, 115200, timeout=1)
-        startup_message = self.gen.readline().decode("ascii").strip()
+        self.gen = serial.serial_for_url(connect_info, 115200, timeout=READ_POLL_S)
+        startup_message = self._read_response(time.monotonic() + STARTUP_TIMEOUT_S) or ''
         logger.info("Driving system: %s", startup_message)
 
         if startup_message == 'E2':
             self.connected = False
             logger.error("Error E2; connection cannot be made with driving system")
-            sys.exit()
+            raise ds.DrivingSystemExit('Error E2; connection cannot be made with driving system.')
         else:
             self.connected = True
             logger.info("Connection with driving system %s is established", startup_message)
 
+    def validate_sequence(self, sequence):
+        """
+        Validates if the sequence only uses parameters supported by the Sonic Concepts driving
+        system.
+
+        Parameters:
+            sequence(Object): contains, amongst other things, of:
+                the ultrasound protocol (focus, pulse duration, pulse rep. interval and etcetera)
+                used equipment (driving system and transducer)
+
+        Returns:
+            List: List of error messages.
+        """
+
+        error_messages = []
+
+        # The IGT specific ramp shapes are not available as ramp mode on the hardware
+        if sequence.pulse_ramp_shape not in config['General']['Ramp shapes'].split('\n'):
+            error_messages.append(f'Ramp shape {sequence.pulse_ramp_shape} is not supported by ' +
+                                  'the Sonic Concepts driving system.')
+
+        return error_messages
+
     def send_sequence(self, sequence):
         """
         Sends an ultrasound sequence to the Sonic Concepts ultrasound driving system.
@@ -94,6 +155,12 @@ class SonicConcepts(ds.ControlDrivingSystem):
         logger.info('Sequence with the following parameters is send to the driving system: \n'
                     + ' %s', sequence)
 
+        error_messages = self.validate_sequence(sequence)
+        if error_messages:
+            for error in error_messages:
+                logger.error(error)
+            raise ds.DrivingSystemExit(' '.join(error_messages))
+
         if self.is_connected():
 
             self._reset_parameters()
@@ -123,24 +190,43 @@ class SonicConcepts(ds.ControlDrivingSystem):
         Executes the previously sent sequence on the Sonic Concepts ultrasound driving system.
         """
 
+        self.start_sequence(sequence)
+
+    def start_sequence(self, sequence, callback=None):
+        """
+        Starts the previously sent sequence on the Sonic Concepts ultrasound driving system.
+
+        Parameters:
+            sequence (Sequence): The sequence object containing ultrasound parameters.
+            callback (function): Called once from a timer thread with True when the sonication
+            duration has elapsed, as the driving system does not report the end of a sonication.
+            None = no callback.
+        """
+
         if self.is_connected():
             if self.is_sequence_sent():
                 try:
-                    cmd = 'START\r'
-                    self.gen.write(cmd.encode('ascii'))
-                    time.sleep(0.05)
-                    line = self.gen.readline()
-                    logger.info('START: %s', line)
+                    # An error response is logged only, the sonication is reported as failed
+                    line = self._send_command('START\r', exit_on_error=False)
+                    if line == 'E2':
+                        raise RuntimeError('START answered with E2')
+
+                    if callback is not None:
+                        threading.Timer(sequence.pulse_train_dur / 1000.0, callback,
+                                        args=(True,)).start()
 
                 except Exception as why:
                     logger.error("Exception: %s", str(why))
+
+                    if callback is not None:
+                        callback(False)
             else:
                 logger.warning('The sequence has to be sent first using send_sequence() before ' +
                                'the driving system can execute a sequence.')
                 logger.warning('Sending sequence...')
 
                 self.send_sequence(sequence)
-                self.execute_sequence(sequence)
+                self.start_sequence(sequence, callback)
 
         else:
             logger.warning("No connection with driving system.")
@@ -149,7 +235,47 @@ class SonicConcepts(ds.ControlDrivingSystem):
             # if no connection can be made, program stops preventing infinite loop
             self.connect(sequence.driving_sys.connect_info)
             self.send_sequence(sequence)
-            self.execute_sequence(sequence)
+            self.start_sequence(sequence, callback)
+
+    def check_connection(self):
+        """
+        Checks whether the Sonic Concepts ultrasound driving system still responds. An open serial
+        port does not mean that the driving system is still connected, so the LOCAL mode is
+        queried with a short timeout. Any response, including an error, counts as alive. Updates
+        the connection state.
+
+        Returns:
+            bool: True if the connection is alive, False otherwise.
+        """
+
+        if not self.connected or self.gen is None or not self.gen.is_open:
+            self.connected = False
+            return False
+
+        try:
+            response = self._send_command('LOCAL?\r\n', exit_on_error=False)
+        except (serial.SerialException, OSError) as why:
+            logger.warning("Connection check failed: %s", str(why))
+            response = ''
+
+        self.connected = response != ''
+
+        return self.connected
+
+    def disarm_sequence(self):
+        """
+        Releases the sequence prepared by arm_sequence() without starting it. A started
+        sonication is aborted and the trigger mode is disabled, so that a sequence sent to wait
+        for a trigger is not started anymore.
+        """
+
+        self.armed_sequence = None
+
+        if not self.is_connected():
+            return
+
+        self._send_command('ABORT\r\n', exit_on_error=False)
+        self._send_command('TRIGGERMODE=0\r\n', exit_on_error=False)
 
     def disconnect(self):
         """
@@ -160,27 +286,70 @@ class SonicConcepts(ds.ControlDrivingSystem):
             self.gen.close()
             self.connected = False
 
-    def _send_command(self, command, sleep_time_s=1):
+    def _read_response(self, deadline):
+        """
+        Reads a response line from the Sonic Concepts ultrasound driving system.
+
+        Parameters:
+            deadline (float): time.monotonic() at which the read is given up.
+
+        Returns:
+            str: The response without terminator, None if no complete line was received before
+            the deadline.
+        """
+
+        response = bytearray()
+        while True:
+            response += self.gen.read_until(b'\n')
+            if response.endswith(b'\n'):
+                return response.decode("ascii", errors="replace").strip()
+            if time.monotonic() >= deadline:
+                return None
+
+    def _send_command(self, command, timeout_s=None, expected=None, exit_on_error=True):
         """
         Sends a command to the Sonic Concepts ultrasound driving system and waits for the response.
+        The timeout and expected response default to those of the command in COMMAND_RESPONSES.
 
         Parameters:
             command (str): The command to be sent.
-            sleep_time_s (float): Time to sleep after sending the command [seconds].
+            timeout_s (float): Maximum time to wait for the response [seconds].
+            expected (str): Regular expression the response has to contain.
+            exit_on_error (bool): True = stop the program when the response is E2.
 
         Returns:
-            str: The response from the ultrasound driving system.
+            str: The response from the ultrasound driving system, '' if no response was received.
         """
 
+        name = re.match(r'[A-Z]*\??', command.strip()).group(0)
+        default_timeout_s, default_expected = COMMAND_RESPONSES.get(
+            name, COMMAND_RESPONSES.get(name.rstrip('?'), (DEFAULT_TIMEOUT_S, DEFAULT_PATTERN)))
+        timeout_s = default_timeout_s if timeout_s is None else timeout_s
+        expected = default_expected if expected is None else expected
+
+        # Responses that arrived after an earlier timeout would be read as this response
+        if self.gen.in_waiting > 0:
+            stale = self.gen.read(self.gen.in_waiting)
+            logger.warning("Discarded unread response(s) from gen: %s", stale)
+
+        start_time = time.monotonic()
         self.gen.write(command.encode("ascii"))
-        logger.info("Sent to gen: %s", command.strip())
-        time.sleep(sleep_time_s)
-        response = self.gen.readline().decode("ascii").rstrip()
-        logger.info("Response from gen: %response", response)
+        response = self._read_response(start_time + timeout_s)
+        rtt_ms = (time.monotonic() - start_time) * 1000
+
+        if response is None:
+            logger.warning("No response to %s within %g s", command.strip(), timeout_s)
+            return ''
+
+        logger.info("Sent to gen: %s, response: %s (%.1f ms)", command.strip(), response, rtt_ms)
 
         if response == 'E2':
-            logger.error("Error E2")
-            sys.exit()
+            logger.error("Error E2 in response to %s", command.strip())
+            if exit_on_error:
+                raise ds.DrivingSystemExit(f'Error E2 in response to {command.strip()}.')
+
+        elif re.search(expected, response) is None:
+            logger.warning("Unexpected response to %s: %s", command.strip(), response)
 
         return response
 
@@ -201,7 +370,7 @@ class SonicConcepts(ds.ControlDrivingSystem):
 
         # Make sure ramping is off prior to experiment
         command = 'ABORT\r\n'
-        self._send_command(command, 0.5)
+        self._send_command(command)
 
         command = 'RAMPMODE=0\r\n'
         self._send_command(command)
@@ -246,10 +415,10 @@ class SonicConcepts(ds.ControlDrivingSystem):
             # convert global power in W to mW
             global_power = global_power * 1e3
             command = f'GLOBALPOWER={global_power}\r\n'
-            self._send_command(command, 0.1)
+            self._send_command(command)
         else:
             logger.error("Intensity parameter may be set incorrectly. Global power is None.")
-            sys.exit()
+            raise ds.DrivingSystemExit('Global power is None.')
 
     def _set_burst_length(self, burst):
         """
@@ -261,7 +430,7 @@ class SonicConcepts(ds.ControlDrivingSystem):
 
         # Set pulse duration (PD)
         command = f'BURST={burst}\r\n'
-        self._send_command(command, 0.1)
+        self._send_command(command)
 
     def _set_period(self, period):
         """
@@ -273,7 +442,7 @@ class SonicConcepts(ds.ControlDrivingSystem):
 
         # Set pulse repetition period (PRP)
         command = f'PERIOD={period}\r\n'
-        self._send_command(command, 0.1)
+        self._send_command(command)
 
     def _set_burst_and_period(self, des_burst, des_period):
         """
@@ -293,8 +462,12 @@ class SonicConcepts(ds.ControlDrivingSystem):
         # Get current pulse repetition period (PRP)
         command = 'PERIOD?\r\n'
 
-        feedback = self._send_command(command, 0.1)
+        feedback = self._send_command(command)
         matches = re.findall(r'\d+\.?\d*', feedback)  # extract the number
+        if not matches:
+            logger.error("No period found in response to %s: '%s'", command.strip(), feedback)
+            raise ds.DrivingSystemExit(f"No period found in response to {command.strip()}.")
+
         read_prp = float(matches[0])*1e3  # convert to float and from ms to us
 
         # Depending on current settings, set PD and PRP in the appropriate order
@@ -319,7 +492,7 @@ class SonicConcepts(ds.ControlDrivingSystem):
 
         # Set sonication duration (SD)
         command = f'TIMER={timer}\r\n'
-        self._send_command(command, 0.1)
+        self._send_command(command)
 
     def _set_ramping(self, ramp_mode, ramp_length):
         """
@@ -338,7 +511,7 @@ class SonicConcepts(ds.ControlDrivingSystem):
 
             # Send abort command to allow further control after applying ramping
             command = 'ABORT\r\n'
-            self._send_command(command, 0.1)
+            self._send_command(command)
         else:
             if ramp_mode == config['General']['Ramp shape.lin']:
                 ramp_mode = 1
@@ -346,9 +519,9 @@ class SonicConcepts(ds.ControlDrivingSystem):
                 ramp_mode = 2
             else:
                 logger.error("Unknown modulation value: %s", ramp_mode)
-                sys.exit(f"Unknown modulation value: {ramp_mode}")
+                raise ds.DrivingSystemExit(f'Unknown modulation value: {ramp_mode}')
 
-            command = 'RAMPMODE={ramp_mode}\r\n'
+            command = f'RAMPMODE={ramp_mode}\r\n'
             self._send_command(command)
 
             command = f'RAMPLENGTH={ramp_length}\r\n'
@@ -375,4 +548,4 @@ class SonicConcepts(ds.ControlDrivingSystem):
             logger.info("Correct transducer selection is confirmed.")
         else:
             logger.error("Pipeline is cancelled by user.")
-            sys.exit()
+            raise ds.DrivingSystemExit('Pipeline is cancelled by user.')
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2024 Margely Cornelissen, Stein Fekkes (Radboud University) and Erik Dumont (Image
+Guided Therapy)
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+**Attribution Notice**:
+If you use this kit in your research or project, please include the following attribution:
+Margely Cornelissen, Stein Fekkes (Radboud University, Nijmegen, The Netherlands) & Erik Dumont
+(Image Guided Therapy, Pessac, France) (2024), Radboud FUS measurement kit (version 0.8),
+https://github.com/Donders-Institute/Radboud-FUS-measurement-kit
+"""
+
+# Virtual Sonic Concepts (NeuroFUS) driving system emulating the ASCII command set used by
+# sonic_concepts_ds. Use it through 'Connection info' with a 'neurofus://<serial>' URL (see
+# protocol_neurofus.py) or on a Linux pseudo-terminal with VirtualDeviceServer.
+
+# Basis packages
+import os
+import re
+import select
+import threading
+import time
+
+# Miscellaneous packages
+
+# Own packages
+
+# Access the logger
+from fus_driving_systems.config.logging_config import logger
+
+# Response of the driving system to an invalid command or state
+ERROR = 'E2'
+
+# Default time between a command and its response [s]
+DEFAULT_LATENCY = 0.005
+
+# Valid ranges of the numeric commands, in the units of the commands
+RANGES = {'LOCAL': (0, 1),
+          'GLOBALFREQ': (100e3, 10e6),  # [Hz]
+          'FOCUS': (0, 200e3),  # [um]
+          'GLOBALPOWER': (0, 100e3),  # [mW]
+          'BURST': (1, 10e6),  # [us]
+          'PERIOD': (1, 10e6),  # [us]
+          'TIMER': (1, 3600e6),  # [us]
+          'RAMPMODE': (0, 2),
+          'RAMPLENGTH': (0, 10e6),  # [us]
+          'TRIGGERMODE': (0, 1)}
+
+COMMAND_PATTERN = re.compile(r'^([A-Z]+)(?:(\?)|=(.*))?$')
+
+
+class VirtualNeuroFUS:
+    """
+    Class representing the state model of a virtual Sonic Concepts driving system. Commands are
+    handled one line at a time; invalid commands, values out of range, a burst longer than the
+    period and parameter changes during a sonication are answered with E2.
+
+    Attributes:
+        serial (str): Serial number reported in the startup message.
+        latency (float): Time between a command and its response [s].
+        fail_commands (set): Commands that are answered with E2, e.g. to test the error path.
+        fail_connect (bool): True = the startup message is E2.
+        params (dict): Current value per numeric command.
+        sonication_end (float): time.monotonic() at the end of the running sonication.
+        commands (list): Received commands.
+    """
+
+    def __init__(self, serial='virtual', latency=DEFAULT_LATENCY, fail_commands=(),
+                 fail_connect=False):
+        """
+        Initializes a VirtualNeuroFUS object.
+
+        Parameters:
+            serial (str): Serial number reported in the startup message.
+            latency (float): Time between a command and its response [s].
+            fail_commands (iterable): Commands that are answered with E2.
+            fail_connect (bool): True = the startup message is E2.
+        """
+
+        self.serial = serial
+        self.latency = latency
+        self.fail_commands = {command.upper() for command in fail_commands}
+        self.fail_connect = fail_connect
+
+        self.params = {'LOCAL': 0, 'GLOBALFREQ': 250e3, 'FOCUS': 0, 'GLOBALPOWER': 0,
+                       'BURST': 1000, 'PERIOD': 10000, 'TIMER': 1e6, 'RAMPMODE': 0,
+                       'RAMPLENGTH': 0, 'TRIGGERMODE': 0}
+        self.sonication_end = 0.0
+        self.commands = []
+
+        self._lock = threading.Lock()
+
+    def startup_message(self):
+        """
+        Returns the message sent when the port is opened.
+
+        Returns:
+            str: The startup message.
+        """
+
+        return ERROR if self.fail_connect else f'TPO-{self.serial} NeuroFUS'
+
+    def is_sonicating(self):
+        """
+        Returns True while a started sonication has not ended.
+        """
+
+        return time.monotonic() < self.sonication_end
+
+    def handle(self, line):
+        """
+        Handles a command line and returns the response.
+
+        Parameters:
+            line (str): The command without line terminator.
+
+        Returns:
+            str: The response.
+        """
+
+        with self._lock:
+            self.commands.append(line)
+            match = COMMAND_PATTERN.match(line.strip().upper())
+            if match is None or match.group(1) in self.fail_commands:
+                return ERROR
+
+            name, query, value = match.groups()
+            if query:
+                return self._query(name)
+            if value is not None:
+                return self._set(name, value)
+
+            return self._action(name)
+
+    def _query(self, name):
+        """
+        Returns the value of a parameter; the period is reported in ms.
+        """
+
+        if name not in self.params:
+            return ERROR
+        if name == 'PERIOD':
+            return f'PERIOD={self.params[name] / 1e3:.3f}ms'
+
+        return f'{name}={self.params[name]:g}'
+
+    def _set(self, name, value):
+        """
+        Sets a parameter after checking its range and the burst and period combination.
+        """
+
+        if name not in RANGES or self.is_sonicating():
+            return ERROR
+
+        try:
+            value = float(value)
+        except ValueError:
+            return ERROR
+
+        low, high = RANGES[name]
+        if not low <= value <= high:
+            return ERROR
+
+        # A burst can not be longer than the period
+        if ((name == 'BURST' and value > self.params['PERIOD'])
+                or (name == 'PERIOD' and value < self.params['BURST'])):
+            return ERROR
+
+        self.params[name] = value
+
+        return f'{name}={value:g}'
+
+    def _action(self, name):
+        """
+        Handles a command without value.
+        """
+
+        if name == 'ABORT':
+            self.sonication_end = 0.0
+            return 'ABORT'
+
+        if name == 'START':
+            if self.is_sonicating():
+                return ERROR
+            self.sonication_end = time.monotonic() + self.params['TIMER'] / 1e6
+            return 'START'
+
+        return ERROR
+
+
+def split_lines(buffer):
+    """
+    Splits the complete command lines from a receive buffer. Lines end with CR, LF or CR LF.
+
+    Parameters:
+        buffer (bytearray): Received bytes, the complete lines are removed.
+
+    Returns:
+        list: The complete command lines.
+    """
+
+    lines = []
+    while True:
+        match = re.search(rb'\r\n|\r|\n', buffer)
+        if match is None:
+            return lines
+
+        line = bytes(buffer[:match.start()]).decode('ascii', errors='replace')
+        del buffer[:match.end()]
+
+        # The LF of a CR LF split over two reads ends an empty line
+        if line != '':
+            lines.append(line)
+
+
+class VirtualDeviceServer:
+    """
+    Class serving a virtual driving system on a Linux pseudo-terminal, so that it can be opened
+    like a serial port, e.g. serial.Serial(server.port).
+
+    Attributes:
+        device (VirtualNeuroFUS): The served device.
+        port (str): Path of the pseudo-terminal to open.
+    """
+
+    def __init__(self, device=None):
+        """
+        Initializes a VirtualDeviceServer object and starts serving.
+
+        Parameters:
+            device (VirtualNeuroFUS): The device to serve, None = a default device.
+        """
+
+        import tty
+
+        self.device = device if device is not None else VirtualNeuroFUS()
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._serve, name='VirtualNeuroFUS', daemon=True)
+        self._thread.start()
+
+    def _write_line(self, text):
+        os.write(self._master, (text + '\r\n').encode('ascii'))
+
+    def _serve(self):
+        """
+        Answers the received commands until the server is closed.
+        """
+
+        self._write_line(self.device.startup_message())
+
+        buffer = bytearray()
+        while not self._stop.is_set():
+            readable, _, _ = select.select([self._master], [], [], 0.1)
+            if not readable:
+                continue
+
+            try:
+                buffer += os.read(self._master, 1024)
+            except OSError:
+                break
+
+            for line in split_lines(buffer):
+                response = self.device.handle(line)
+                time.sleep(self.device.latency)
+                self._write_line(response)
+
+    def close(self):
+        """
+        Stops serving and closes the pseudo-terminal.
+        """
+
+        self._stop.set()
+        self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+        logger.info('Virtual driving system on %s closed', self.port)
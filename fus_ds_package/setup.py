@@ -41,6 +41,9 @@ setup(name='fus_driving_systems',
       packages=find_packages(),
       package_data={'fus_driving_systems': ['config/*', 'igt/config/imasonic_transducers/*',
                                             'igt/config/sonic_concepts_transducers/*',
-                                            'igt/config/*.json', 'igt/*.pyd']},
+                                            'igt/config/*.json', 'igt/config/*.bin',
+                                            'igt/*.pyd']},
       py_modules=['driving_system', 'transducer', 'control_driving_system', 'sequence', 'utils'],
+      entry_points={'console_scripts': [
+          'fus-ds-compile-index = fus_driving_systems.igt.equipment_index_cli:main']},
       zip_safe=False)